@@ -0,0 +1,47 @@
+# Fills the child tables of the bills (bill_members, bill_committees,
+# bill_references and bill_versions) from the bills already in the database,
+# e.g. `python backfill.py`. Run it once after creating a child table that
+# didn't exist when the bills were written. It reads the same config as run.py
+# and is safe to run again if it's stopped partway through.
+
+import json
+import logging
+import os
+
+from interfaces.api_interface import save_location
+from interfaces.logging_interface import *
+from interfaces.storage_interface import *
+
+# Create the logger for the program.
+logger = logging.getLogger("backfill")
+
+# Read the config, if there is one.
+config = {}
+if os.path.isfile("configs/config.json"):
+    with open("configs/config.json", 'rt') as config_file:
+        config = json.load(config_file)
+
+# Log to its own file so the last run's log isn't rotated out.
+setup_logging(config.get("backfill_log_file", "Bill_The_backfill.log"),
+              config.get("log_level", "INFO"), config.get("log_levels"),
+              config.get("log_max_mb", 10), config.get("log_backups", 5),
+              config.get("log_format", "text") == "json")
+
+# Open the same database run.py writes to.
+if config.get("backend", "mysql") == "sqlite":
+    set_backend("sqlite", path=config.get("sqlite_path",
+                                          f"{save_location}billme.db"))
+else:
+    set_backend("mysql", pool_size=config.get("pool_size", 5))
+
+# Rebuild the child rows a chunk of bills at a time.
+migrated = get_backend().backfill_child_tables(
+    config.get("backfill_chunk_size", 1000))
+
+# Close the database.
+get_backend().close()
+
+logger.info(f"Backfill complete. Migrated the child rows of {migrated} bills.")
+
+# Write out whatever is still waiting to be logged.
+shutdown_logging()
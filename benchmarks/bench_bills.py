@@ -0,0 +1,93 @@
+"""
+Measure how long it takes to turn a package summary into a row for the bills
+table, comparing the original attribute-by-attribute conversion with the
+precompiled field map in classes.Record, with and without the fingerprint
+that upserts compare.
+
+Run from the root of the repository with `python -m benchmarks.bench_bills`.
+"""
+import json
+import sys
+import timeit
+from datetime import datetime
+
+from classes.Bills import Bills
+
+# A summary shaped like the ones returned by packages/{packageId}/summary.
+sample_summary = {
+    "title": "To amend title 10, United States Code, and for other purposes.",
+    "shortTitle": [{"type": "Short Title", "title": "Example Act of 2020"}],
+    "collectionCode": "BILLS", "collectionName": "Congressional Bills",
+    "category": "Bills and Statutes", "dateIssued": "2020-03-05",
+    "detailsLink": "https://www.govinfo.gov/app/details/BILLS-116s3398is",
+    "packageId": "BILLS-116s3398is",
+    "download": {"txtLink": "https://api.govinfo.gov/packages/x/htm",
+                 "xmlLink": "https://api.govinfo.gov/packages/x/xml",
+                 "pdfLink": "https://api.govinfo.gov/packages/x/pdf"},
+    "related": {"billStatusLink": "https://api.govinfo.gov/x"},
+    "branch": "legislative", "pages": "12",
+    "governmentAuthor1": "Congress", "governmentAuthor2": "Senate",
+    "suDocClassNumber": "Y 1.4/1:", "billType": "s", "congress": "116",
+    "originChamber": "SENATE", "currentChamber": "SENATE", "session": "2",
+    "billNumber": "3398", "billVersion": "is", "isAppropriation": "false",
+    "isPrivate": "false", "publisher": "U.S. Government Publishing Office",
+    "committees": [{"committeeName": "Committee on the Judiciary",
+                    "chamber": "SENATE", "type": "S"}],
+    "members": [{"role": "SPONSOR", "chamber": "S", "congress": "116",
+                 "bioGuideId": "G000359", "memberName": "Graham, Lindsey",
+                 "state": "SC", "party": "R"}],
+    "otherIdentifier": {"migrated-doc-id": "f:s3398is.txt"},
+    "references": [{"collectionName": "United States Code",
+                    "contents": [{"title": "18", "label": "U.S.C."}]}],
+    "lastModified": "2020-03-06T03:10:06Z",
+}
+
+
+def original_row(digest: dict) -> tuple:
+    """The conversion insert_bill_values did before the field map."""
+    vals = Bills(digest)
+    last_modified = str(vals.last_modified).replace("T", " ")
+    last_modified = str(last_modified).replace("Z","")
+    last_modified = datetime.strptime(last_modified, '%Y-%m-%d %H:%M:%S')
+
+    return (str(vals.package_ID),str(vals.title),str(vals.short_title),
+            str(vals.collection_code),str(vals.collection_name),
+            str(vals.category),vals.date_issued,str(vals.details_link),
+            str(vals.download),str(vals.related),str(vals.branch),
+            int(vals.pages),str(vals.government_author_1),
+            str(vals.government_author_2),str(vals.SuDoc_class_number),
+            str(vals.bill_type),int(vals.congress),str(vals.origin_chamber),
+            str(vals.current_chamber),str(vals.session),int(vals.bill_number),
+            str(vals.bill_version),bool(vals.is_appropriation),
+            bool(vals.is_private),str(vals.publisher),str(vals.committees),
+            str(vals.members),str(vals.other_identifier),str(vals.references),
+            str(last_modified))
+
+
+def main(number: int = 100000):
+    """
+    Time both conversions and print the cost per row.\n
+    number  = The number of rows to convert with each.
+    """
+    results = {}
+
+    # The field map is timed the way plain inserts use it, and again with the
+    # fingerprint the upserts add.
+    for name, convert in (("original", original_row),
+                          ("field_map",
+                           lambda digest: Bills.row_from_digest(digest,
+                                                                False)),
+                          ("field_map_fingerprint", Bills.row_from_digest)):
+        seconds = min(timeit.repeat(lambda: convert(sample_summary),
+                                    number=number, repeat=3))
+        results[name] = seconds / number * 1e6
+
+    print(json.dumps({"rows": number,
+                      "us_per_row": {name: round(cost, 3)
+                                     for name, cost in results.items()},
+                      "speedup": round(results["original"] /
+                                       results["field_map"], 2)}, indent=4))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,284 @@
+"""
+Measure the throughput of the run.py pipeline against a local stand-in for the
+govinfo API. Each scale is run in its own process so the peak memory of one
+doesn't carry over into the next, while the fake server runs in this one.
+
+For every scale it records:
+    pages_per_sec       = Pages of published/ the enumeration gets through.
+    packages_per_sec    = Packages taken end to end, from enumeration through
+                          the summaries to the database.
+    rows_per_sec        = Rows written to the database, counting only the time
+                          spent writing. Only measured with --credentials or
+                          --backend sqlite.
+    peak_rss_kb         = The peak resident memory of the pipeline process.
+
+The results are written as JSON to benchmarks/results/ so runs can be compared
+with --compare.
+
+Run from the root of the repository with
+`python -m benchmarks.bench_pipeline --scales 1000 10000 100000`.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks.fake_govinfo import FakeGovinfo
+
+# The root of the repository, so the pipeline process can import it from a
+# scratch directory.
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_pipeline(args: argparse.Namespace) -> dict:
+    """
+    Run the pipeline once against the fake server and time it. This runs in
+    the child process, from a scratch directory so the log, the API key and
+    the save location don't touch the real ones.\n
+    args    = The parsed command line.
+    """
+    # Give the API interface the files it expects.
+    os.makedirs("sensitive", exist_ok=True)
+    with open("sensitive/apiKey", 'wt') as key:
+        key.write("benchmark")
+
+    if args.credentials:
+        with open(args.credentials, 'rt') as source:
+            with open("sensitive/database_credentials", 'wt') as key:
+                key.write(source.read())
+
+    sys.path.insert(0, repo_root)
+    import interfaces.api_interface as api_interface
+    from interfaces.metrics_interface import get_metrics
+    from requests import fetch_summaries, iter_list_of_type
+
+    # Point the API at the fake server and take the rate limit out of the way.
+    api_interface.site_base = args.site_base
+    api_interface.set_rate_limit(1e6, 1e6)
+
+    results = {"packages": args.scale}
+
+    # Time the enumeration on its own. The packageId's are only counted so
+    # holding them doesn't add to the peak memory of the pipeline.
+    start = time.perf_counter()
+    results["enumerated"] = sum(1 for _ in iter_list_of_type(
+        "BILLS", args.scale, args.workers, args.page_size))
+    results["enumeration_sec"] = time.perf_counter() - start
+
+    # Only open a database if there's one to write to. MySQL needs a scratch
+    # server, while SQLite writes to a file in the scratch directory.
+    writing = args.backend == "sqlite" or bool(args.credentials)
+    if writing:
+        from interfaces.collection_registry import upsert_batch
+        from interfaces.storage_interface import set_backend
+        if args.backend == "sqlite":
+            backend = set_backend("sqlite", path="billme.db")
+        else:
+            backend = set_backend("mysql", pool_size=args.pool_size)
+
+    # Run the whole pipeline the way run.py does, with the enumeration feeding
+    # straight into the summaries and the summaries into the database.
+    write_sec = 0.0
+    rows = 0
+    failed = 0
+    pending = []
+
+    start = time.perf_counter()
+    items = iter_list_of_type("BILLS", args.scale, args.workers,
+                              args.page_size)
+    if writing:
+        items = backend.iter_missing(items, "bills", args.batch_size)
+
+    for item, summary, error in fetch_summaries(items, args.workers):
+        if error:
+            failed = failed + 1
+            continue
+
+        pending.append(summary)
+
+        if writing and len(pending) >= args.batch_size:
+            write_start = time.perf_counter()
+            upsert_batch("BILLS", pending, args.batch_size)
+            write_sec = write_sec + time.perf_counter() - write_start
+            rows = rows + len(pending)
+            pending = []
+
+    if writing and pending:
+        write_start = time.perf_counter()
+        upsert_batch("BILLS", pending, args.batch_size)
+        write_sec = write_sec + time.perf_counter() - write_start
+        rows = rows + len(pending)
+
+    results["end_to_end_sec"] = time.perf_counter() - start
+    results["failed"] = failed
+    results["rows"] = rows
+    results["write_sec"] = write_sec
+
+    if writing:
+        backend.close()
+    api_interface.close_sessions()
+
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results["peak_rss_kb"] = peak // 1024 if sys.platform == "darwin" else peak
+    results["request_stats"] = api_interface.get_request_stats()
+    results["metrics"] = get_metrics()
+
+    return results
+
+
+def run_scale(args: argparse.Namespace, scale: int) -> dict:
+    """
+    Start the fake server, run the pipeline against it in a new process and
+    work out the rates.\n
+    args    = The parsed command line.\n
+    scale   = The number of packages to serve and pull.
+    """
+    summary = None
+    if args.summary:
+        with open(args.summary, 'rt') as recorded:
+            summary = json.load(recorded)
+
+    with FakeGovinfo(scale, args.latency, args.error_rate, summary) as fake:
+        command = [sys.executable, "-m", "benchmarks.bench_pipeline",
+                   "--child", "--site-base", fake.site_base,
+                   "--scale", str(scale), "--workers", str(args.workers),
+                   "--page-size", str(args.page_size),
+                   "--batch-size", str(args.batch_size),
+                   "--pool-size", str(args.pool_size),
+                   "--backend", args.backend]
+        if args.credentials:
+            command = command + ["--credentials",
+                                 os.path.abspath(args.credentials)]
+
+        # Run it from a scratch directory, with the repository importable.
+        with tempfile.TemporaryDirectory() as scratch:
+            env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+                filter(None, [repo_root, os.environ.get("PYTHONPATH")])))
+            output = subprocess.run(command, cwd=scratch, env=env,
+                                    check=True, stdout=subprocess.PIPE,
+                                    text=True).stdout
+
+        results = json.loads(output)
+        results["server_hits"] = dict(fake.hits)
+
+    # The enumeration runs twice, once on its own and once in the pipeline, so
+    # halve the pages to get the ones from the first.
+    pages = fake.hits["published"] / 2
+    results["pages_per_sec"] = round(pages / results["enumeration_sec"], 2)
+    results["packages_per_sec"] = round(results["enumerated"] /
+                                        results["end_to_end_sec"], 2)
+    results["rows_per_sec"] = (round(results["rows"] / results["write_sec"], 2)
+                               if results["write_sec"] else None)
+
+    return results
+
+
+def git_commit() -> str:
+    """Return the commit being measured, if it can be found."""
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=repo_root,
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(previous: dict, current: dict):
+    """
+    Print how each rate changed since an earlier run.\n
+    previous    = The results of the earlier run.\n
+    current     = The results of this run.
+    """
+    for scale, result in current["scales"].items():
+        before = previous.get("scales", {}).get(scale)
+        if not before:
+            continue
+
+        for rate in ("pages_per_sec", "packages_per_sec", "rows_per_sec"):
+            if before.get(rate) and result.get(rate):
+                print(f"{scale:>8} {rate:<17} {before[rate]:>12} -> "+
+                      f"{result[rate]:>12} ({result[rate]/before[rate]:.2f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scales", type=int, nargs="+",
+                        default=[1000, 10000, 100000])
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Seconds the fake server waits per request.")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Fraction of requests answered with a 503.")
+    parser.add_argument("--summary",
+                        help="A recorded summary JSON to serve instead.")
+    parser.add_argument("--credentials",
+                        help="A database_credentials file for a scratch "+
+                             "database with the bills tables. Without it "+
+                             "nothing is written.")
+    parser.add_argument("--backend", choices=["mysql", "sqlite"],
+                        default="mysql",
+                        help="The database to write to. sqlite needs no "+
+                             "credentials.")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--pool-size", type=int, default=5)
+    parser.add_argument("--output",
+                        help="Where to write the results. Defaults to "+
+                             "benchmarks/results/pipeline-<time>.json")
+    parser.add_argument("--compare",
+                        help="Earlier results to compare against.")
+    parser.add_argument("--child", action="store_true",
+                        help=argparse.SUPPRESS)
+    parser.add_argument("--site-base", help=argparse.SUPPRESS)
+    parser.add_argument("--scale", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # The child process runs the pipeline and hands its timings back.
+    if args.child:
+        print(json.dumps(run_pipeline(args)))
+        return
+
+    results = {"started": datetime.now().isoformat(timespec="seconds"),
+               "commit": git_commit(),
+               "python": platform.python_version(),
+               "platform": platform.platform(),
+               "settings": {"latency": args.latency,
+                            "error_rate": args.error_rate,
+                            "workers": args.workers,
+                            "page_size": args.page_size,
+                            "batch_size": args.batch_size,
+                            "database": (args.backend
+                                         if args.backend == "sqlite" or
+                                         args.credentials else None)},
+               "scales": {}}
+
+    for scale in args.scales:
+        results["scales"][str(scale)] = run_scale(args, scale)
+        print(json.dumps({scale: {key: results["scales"][str(scale)][key]
+                                  for key in ("pages_per_sec",
+                                              "packages_per_sec",
+                                              "rows_per_sec",
+                                              "peak_rss_kb")}}))
+
+    output = args.output or os.path.join(
+        repo_root, "benchmarks", "results",
+        f"pipeline-{datetime.now().strftime('%Y%m%dT%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'wt') as result_file:
+        json.dump(results, result_file, indent=4)
+    print(f"Wrote {output}")
+
+    if args.compare:
+        with open(args.compare, 'rt') as previous:
+            compare(json.load(previous), results)
+
+
+if __name__ == "__main__":
+    main()
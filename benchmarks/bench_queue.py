@@ -0,0 +1,128 @@
+"""
+Measure how the work queue scales with the number of worker processes. For
+each worker count, a fresh SQLite database is filled by `worker.py enqueue`
+from a local stand-in for the govinfo API, and then that many
+`worker.py work` processes drain it at the same time.
+
+For every worker count it records:
+    packages_per_sec    = Packages written per second while the workers ran.
+    speedup             = packages_per_sec over that of the first count.
+    double_fetches      = Summaries requested more than once. Should be 0.
+    rows                = Rows in the bills table at the end.
+    queue               = The state of the queue at the end.
+
+The results are written as JSON to benchmarks/results/ like bench_pipeline.
+
+Run from the root of the repository with
+`python -m benchmarks.bench_queue --packages 2000 --worker-counts 1 2 4`.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks.bench_pipeline import git_commit, repo_root
+from benchmarks.fake_govinfo import FakeGovinfo
+
+
+def run_workers(args: argparse.Namespace, workers: int) -> dict:
+    """
+    Queue a collection and drain it with some number of worker processes.\n
+    args    = The parsed command line.\n
+    workers = The number of worker processes.
+    """
+    with FakeGovinfo(args.packages, args.latency) as fake, \
+            tempfile.TemporaryDirectory() as scratch:
+        # Give the workers their config and API key.
+        os.makedirs(os.path.join(scratch, "configs"))
+        os.makedirs(os.path.join(scratch, "sensitive"))
+        with open(os.path.join(scratch, "sensitive", "apiKey"), 'wt') as key:
+            key.write("benchmark")
+        with open(os.path.join(scratch, "configs", "config.json"),
+                  'wt') as config_file:
+            json.dump({"backend": "sqlite", "sqlite_path": "billme.db",
+                       "api_base": fake.site_base,
+                       "requests_per_second": 1e6, "request_burst": 1e6,
+                       "fetch_workers": args.fetch_workers,
+                       "queue_batch_size": args.claim_size,
+                       "queue_poll_seconds": 0.5,
+                       "membership_index": False}, config_file)
+
+        worker = os.path.join(repo_root, "worker.py")
+        subprocess.run([sys.executable, worker, "enqueue", "BILLS"],
+                       cwd=scratch, check=True)
+        enqueue_hits = dict(fake.hits)
+
+        # Start every worker at once and wait for them all.
+        start = time.perf_counter()
+        processes = [subprocess.Popen([sys.executable, worker, "work",
+                                       "BILLS"], cwd=scratch)
+                     for _ in range(workers)]
+        codes = [process.wait() for process in processes]
+        elapsed = time.perf_counter() - start
+
+        database = sqlite3.connect(os.path.join(scratch, "billme.db"))
+        rows = database.execute("SELECT COUNT(*) FROM bills").fetchone()[0]
+        queue = dict(database.execute("SELECT status,COUNT(*) FROM "+
+                                      "work_queue GROUP BY status"))
+        database.close()
+
+        summaries = fake.hits["summary"] - enqueue_hits["summary"]
+
+    return {"workers": workers, "exit_codes": codes,
+            "seconds": round(elapsed, 3), "rows": rows,
+            "packages_per_sec": round(rows / elapsed, 2),
+            "double_fetches": summaries - rows,
+            "queue": {str(status): number for status, number in queue.items()}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--packages", type=int, default=2000)
+    parser.add_argument("--worker-counts", type=int, nargs="+",
+                        default=[1, 2, 4])
+    parser.add_argument("--latency", type=float, default=0.02,
+                        help="Seconds the fake server waits per request, "+
+                             "standing in for the round trip to the API.")
+    parser.add_argument("--fetch-workers", type=int, default=4,
+                        help="Summaries each worker pulls at once.")
+    parser.add_argument("--claim-size", type=int, default=100)
+    parser.add_argument("--output",
+                        help="Where to write the results. Defaults to "+
+                             "benchmarks/results/queue-<time>.json")
+    args = parser.parse_args()
+
+    results = {"started": datetime.now().isoformat(timespec="seconds"),
+               "commit": git_commit(),
+               "settings": {"packages": args.packages,
+                            "latency": args.latency,
+                            "fetch_workers": args.fetch_workers,
+                            "claim_size": args.claim_size},
+               "runs": []}
+
+    for workers in args.worker_counts:
+        run = run_workers(args, workers)
+        run["speedup"] = round(run["packages_per_sec"] /
+                               results["runs"][0]["packages_per_sec"], 2) \
+            if results["runs"] else 1.0
+        results["runs"].append(run)
+        print(json.dumps({key: run[key] for key in
+                          ("workers", "packages_per_sec", "speedup",
+                           "double_fetches", "rows")}))
+
+    output = args.output or os.path.join(
+        repo_root, "benchmarks", "results",
+        f"queue-{datetime.now().strftime('%Y%m%dT%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'wt') as result_file:
+        json.dump(results, result_file, indent=4)
+    print(f"Wrote {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""
+A stand-in for api.govinfo.gov that runs locally so the pipeline can be
+measured without the network or an API key. It serves the collections,
+collections/{code}/{start}/{end}, published/{start}/{end} and
+packages/{packageId}/summary endpoints from a generated set of packages, with
+an optional delay and error rate on every request.
+
+Run it on its own with `python -m benchmarks.fake_govinfo 10000` and point
+api_interface.site_base at the address it prints.
+"""
+import bisect
+import json
+import random
+import sys
+import threading
+import time
+from copy import deepcopy
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from benchmarks.bench_bills import sample_summary
+
+# The same ISO8601 format the API uses.
+time_format = "%Y-%m-%dT%H:%M:%SZ"
+
+# The API won't page past this many items in one query.
+max_query_items = 10000
+
+
+class _Server(ThreadingHTTPServer):
+    # The pipeline opens a connection per worker all at once, which overflows
+    # the default backlog of 5 and stalls the extra ones for a second.
+    request_queue_size = 128
+    daemon_threads = True
+
+
+class FakeGovinfo:
+    """
+    A threaded HTTP server that answers like the govinfo API.\n
+    num_packages    = The number of BILLS packages to serve.\n
+    latency         = Seconds to wait before answering each request.\n
+    error_rate      = The fraction of requests answered with a 503 instead.\n
+    summary         = A recorded summary to use as the template for every
+                      package. Defaults to the one in bench_bills.\n
+    seed            = The seed for the generated dates and the errors.
+    """
+
+    def __init__(self, num_packages: int, latency: float = 0.0,
+                 error_rate: float = 0.0, summary: dict = None,
+                 seed: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.summary = summary or sample_summary
+        self.random = random.Random(seed)
+
+        # Spread the packages out between 1993 and now. Each one is issued at
+        # a time and modified a day later. Kept sorted by both so the date
+        # ranges can be found with a binary search.
+        start = datetime(1993, 1, 1)
+        span = int((datetime.utcnow() - start).total_seconds()) - 86400
+        issued = sorted(self.random.randrange(span)
+                        for _ in range(num_packages))
+        self.packages = [(start + timedelta(seconds=offset),
+                          f"BILLS-{100 + number % 20}hr{number}ih")
+                         for number, offset in enumerate(issued)]
+        self.issued_keys = [date for date, _ in self.packages]
+        self.modified_keys = [date + timedelta(days=1)
+                              for date in self.issued_keys]
+
+        # How many requests each endpoint got, and how many were failed on
+        # purpose.
+        self.hits = {"collections": 0, "collection": 0, "published": 0,
+                     "summary": 0, "errors": 0}
+        self.lock = threading.Lock()
+
+        self.server = _Server(("127.0.0.1", 0), self._make_handler())
+        self.thread = None
+
+    @property
+    def site_base(self) -> str:
+        """The value to put in api_interface.site_base."""
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self):
+        """Start answering requests on a background thread."""
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop the server and close its socket."""
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _count(self, endpoint: str):
+        with self.lock:
+            self.hits[endpoint] = self.hits[endpoint] + 1
+
+    def _window(self, keys: list, start: str, end: str) -> range:
+        """
+        Return the indexes of the packages whose key falls between two dates,
+        newest first.\n
+        keys    = Either the issued or the modified dates.\n
+        start   = The start of the window in the API's format.\n
+        end     = The end of the window in the API's format.
+        """
+        low = bisect.bisect_left(keys, datetime.strptime(start, time_format))
+        high = bisect.bisect_right(keys, datetime.strptime(end, time_format))
+
+        return range(high - 1, low - 1, -1)
+
+    def _listing(self, window: range, query: dict) -> tuple:
+        """
+        Page through a window the way the API does.\n
+        window  = The indexes of the packages in the window.\n
+        query   = The parsed query string.
+        """
+        offset = int(query.get("offset", ["0"])[0])
+        page_size = int(query.get("pageSize", ["10"])[0])
+
+        # The API refuses to page past its limit.
+        if offset >= max_query_items:
+            return 400, {"message": "offset is too large"}
+
+        packages = [{"packageId": self.packages[index][1],
+                     "lastModified": self.modified_keys[index].strftime(
+                         time_format),
+                     "dateIssued": self.issued_keys[index].strftime(
+                         "%Y-%m-%d")}
+                    for index in window[offset:offset+page_size]]
+
+        return 200, {"count": len(window), "nextPage": None,
+                     "packages": packages}
+
+    def _summary(self, package_id: str) -> tuple:
+        """Build the summary of one package from the template."""
+        summary = deepcopy(self.summary)
+        summary["packageId"] = package_id
+        summary["billType"] = "hr"
+        summary["billNumber"] = package_id.split("hr")[-1][:-2]
+        summary["congress"] = package_id[6:9]
+
+        return 200, summary
+
+    def route(self, path: str) -> tuple:
+        """
+        Answer a request. Returns the status and the JSON body.\n
+        path    = The path and query string of the request.
+        """
+        parts = urlsplit(path)
+        query = parse_qs(parts.query)
+        segments = [unquote(segment) for segment in
+                    parts.path.strip("/").split("/")]
+
+        if segments == ["collections"]:
+            self._count("collections")
+            return 200, {"collections": [{
+                "collectionCode": "BILLS",
+                "collectionName": "Congressional Bills",
+                "packageCount": len(self.packages)}]}
+
+        if segments[0] == "collections" and len(segments) >= 3:
+            self._count("collection")
+            end = (segments[3] if len(segments) > 3 else
+                   datetime.utcnow().strftime(time_format))
+            return self._listing(self._window(self.modified_keys,
+                                              segments[2], end), query)
+
+        if segments[0] == "published" and len(segments) >= 2:
+            self._count("published")
+            end = (segments[2] if len(segments) > 2 else
+                   datetime.utcnow().strftime(time_format))
+            return self._listing(self._window(self.issued_keys,
+                                              segments[1], end), query)
+
+        if (segments[0] == "packages" and len(segments) == 3 and
+                segments[2] == "summary"):
+            self._count("summary")
+            return self._summary(segments[1])
+
+        return 404, {"message": "not found"}
+
+    def _make_handler(self):
+        """Build the request handler class bound to this server."""
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep the connections alive like the real API.
+            protocol_version = "HTTP/1.1"
+
+            # Buffer the headers and the body so they go out in one write
+            # instead of waiting on a delayed ACK between them.
+            wbufsize = 65536
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if fake.latency:
+                    time.sleep(fake.latency)
+
+                with fake.lock:
+                    failed = fake.random.random() < fake.error_rate
+
+                if failed:
+                    fake._count("errors")
+                    status, body = 503, {"message": "try again"}
+                else:
+                    status, body = fake.route(self.path)
+
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
+
+
+if __name__ == "__main__":
+    with FakeGovinfo(int(sys.argv[1]) if len(sys.argv) > 1 else 1000) as fake:
+        print(f"Serving {len(fake.packages)} packages at {fake.site_base}")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
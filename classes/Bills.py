@@ -1,33 +1,219 @@
-class Bills:
+import ast
+import logging
+import re
+
+from classes.Record import Record, boolean, integer, text, timestamp
+
+# Create the logger for this module.
+logger = logging.getLogger(__name__)
+
+# Splits a bill's packageId into its congress, bill type, bill number and
+# version. E.g. BILLS-116hr1234ih
+package_id_pattern = re.compile(r"^BILLS-(\d+)([a-z]+?)(\d+)([a-z]+)$")
+
+
+class Bills(Record):
     """A class that is used to build the Bills"""
-    def __init__(self, digest):
-        self.title = digest.get("title")
-        self.short_title = digest.get("shortTitle")
-        self.collection_code = digest.get("collectionCode")
-        self.collection_name = digest.get("collectionName")
-        self.category = digest.get("category")
-        self.date_issued = digest.get("dateIssued")
-        self.details_link = digest.get("detailsLink")
-        self.package_ID = digest.get("packageId")
-        self.download = digest.get("download")
-        self.related = digest.get("related")
-        self.branch = digest.get("branch")
-        self.pages = digest.get("pages")
-        self.government_author_1 = digest.get("governmentAuthor1")
-        self.government_author_2 = digest.get("governmentAuthor2")
-        self.SuDoc_class_number = digest.get("suDocClassNumber")
-        self.bill_type = digest.get("billType")
-        self.congress = digest.get("congress")
-        self.origin_chamber = digest.get("originChamber")
-        self.current_chamber = digest.get("currentChamber")
-        self.session = digest.get("session")
-        self.bill_number = digest.get("billNumber")
-        self.bill_version = digest.get("billVersion")
-        self.is_appropriation = digest.get("isAppropriation")
-        self.is_private = digest.get("isPrivate")
-        self.publisher = digest.get("publisher")
-        self.committees = digest.get("committees")
-        self.members = digest.get("members")
-        self.other_identifier = digest.get("otherIdentifier")
-        self.references = digest.get("references")
-        self.last_modified = digest.get("lastModified")
\ No newline at end of file
+    # Each attribute, the key it comes from in the summary, the column of the
+    # bills table it goes into, and how it's converted for the database. The
+    # order is the order of the columns in the INSERT.
+    FIELDS = (("package_ID", "packageId", "packageId", text),
+              ("title", "title", "title", text),
+              ("short_title", "shortTitle", "shortTitle", text),
+              ("collection_code", "collectionCode", "collectionCode", text),
+              ("collection_name", "collectionName", "collectionName", text),
+              ("category", "category", "category", text),
+              ("date_issued", "dateIssued", "dateIssued", text),
+              ("details_link", "detailsLink", "detailsLink", text),
+              ("download", "download", "download", text),
+              ("related", "related", "related", text),
+              ("branch", "branch", "branch", text),
+              ("pages", "pages", "pages", integer),
+              ("government_author_1", "governmentAuthor1",
+               "governmentAuthor1", text),
+              ("government_author_2", "governmentAuthor2",
+               "governmentAuthor2", text),
+              ("SuDoc_class_number", "suDocClassNumber", "suDocClassNumber",
+               text),
+              ("bill_type", "billType", "billtype", text),
+              ("congress", "congress", "congress", integer),
+              ("origin_chamber", "originChamber", "originChamber", text),
+              ("current_chamber", "currentChamber", "currentChamber", text),
+              ("session", "session", "docSession", text),
+              ("bill_number", "billNumber", "billNumber", integer),
+              ("bill_version", "billVersion", "billVersion", text),
+              ("is_appropriation", "isAppropriation", "isAppropriation",
+               boolean),
+              ("is_private", "isPrivate", "isPrivate", boolean),
+              ("publisher", "publisher", "publisher", text),
+              ("committees", "committees", "committees", text),
+              ("members", "members", "members", text),
+              ("other_identifier", "otherIdentifier", "otherIdentifier",
+               text),
+              ("references", "references", "docReferences", text),
+              ("last_modified", "lastModified", "lastModified", timestamp))
+
+    __slots__ = tuple(field[0] for field in FIELDS)
+
+    # The columns of the child tables, which hold the members, committees,
+    # references and version links of each bill in a form that can be
+    # indexed. See helpers/create_child_tables.sql and
+    # helpers/create_bill_versions_table.sql.
+    CHILD_TABLES = {
+        "bill_members": ("packageId", "role", "bioGuideId", "memberName",
+                         "chamber", "congress", "state", "party"),
+        "bill_committees": ("packageId", "committeeName", "chamber",
+                            "committeeType"),
+        "bill_references": ("packageId", "collectionName", "title", "label",
+                            "section"),
+        "bill_versions": ("packageId", "congress", "billType", "billNumber",
+                          "billVersion", "stage", "dateIssued")}
+
+    # The indexes of the child tables other than the one on packageId, by
+    # name, for backends that create the child tables themselves. They match
+    # the ones in the helpers folder.
+    CHILD_INDEXES = {
+        "bill_members": {
+            "idx_members_bioguide": ("bioGuideId", "congress", "role"),
+            "idx_members_name": ("memberName", "congress", "role")},
+        "bill_committees": {
+            "idx_committees_name": ("committeeName",)},
+        "bill_references": {
+            "idx_references_target": ("collectionName", "title", "section")},
+        "bill_versions": {
+            "idx_versions_bill": ("congress", "billType", "billNumber",
+                                  "stage", "dateIssued")}}
+
+    # The columns of the bills table the child rows can be rebuilt from, and
+    # the summary key each one was filled in from.
+    STORED_CHILD_SOURCES = (("packageId", "packageId"),
+                            ("committees", "committees"),
+                            ("members", "members"),
+                            ("docReferences", "references"),
+                            ("congress", "congress"),
+                            ("billtype", "billType"),
+                            ("billNumber", "billNumber"),
+                            ("billVersion", "billVersion"),
+                            ("dateIssued", "dateIssued"))
+
+    # The legislative stage each bill version code is at, so every version of
+    # a bill can be put in the order it moved through Congress. Versions at
+    # the same stage are ordered by dateIssued, and unknown codes go last.
+    VERSION_STAGES = {
+        # Introduced.
+        "ih": 1, "is": 1,
+        # Referral, sponsor or committee changes before being reported.
+        "rih": 2, "ris": 2, "rch": 2, "rcs": 2, "rth": 2, "rts": 2, "sc": 2,
+        "ash": 2, "sas": 2,
+        # Reported, discharged, held at the desk, or placed on the calendar.
+        "rh": 3, "rs": 3, "cdh": 3, "cds": 3, "hdh": 3, "hds": 3, "pch": 3,
+        "pcs": 3, "as": 3,
+        # Agreed to, passed or engrossed in the chamber it started in.
+        "ath": 4, "ats": 4, "cph": 4, "cps": 4, "eh": 4, "es": 4, "pap": 4,
+        "pp": 4,
+        # Received or referred in the other chamber.
+        "rdh": 5, "rds": 5, "rfh": 5, "rfs": 5,
+        # Engrossed with the other chamber's amendments.
+        "eah": 6, "eas": 6,
+        # Enrolled and sent to the President.
+        "enr": 7, "renr": 7,
+        # Failed, postponed indefinitely or laid on the table.
+        "fah": 8, "fph": 8, "fps": 8, "iph": 8, "ips": 8, "lth": 8, "lts": 8}
+    unknown_stage = 99
+
+    @staticmethod
+    def summary_from_stored(row: tuple) -> dict:
+        """
+        Rebuild as much of a summary as child_rows() needs from a stored row
+        of the bills table. The committees, members and references were
+        stored as their Python representation, so they're read back with
+        literal_eval.\n
+        row = The values of the columns in STORED_CHILD_SOURCES, in order.
+        """
+        summary = {}
+
+        for (column, key), value in zip(Bills.STORED_CHILD_SOURCES, row):
+            if key in ("committees", "members", "references"):
+                value = parse_stored(value)
+            summary[key] = value
+
+        return summary
+
+    @staticmethod
+    def child_rows(summary: dict) -> dict:
+        """
+        Build the rows of each child table for one bill, keyed by the table
+        name, in the order of CHILD_TABLES.\n
+        summary = The parsed package summary.
+        """
+        package_id = summary.get("packageId")
+
+        # One row per member.
+        members = []
+        for member in summary.get("members") or []:
+            congress = member.get("congress")
+            members.append((package_id, member.get("role"),
+                            member.get("bioGuideId"),
+                            member.get("memberName"), member.get("chamber"),
+                            int(congress) if congress else None,
+                            member.get("state"), member.get("party")))
+
+        # One row per committee.
+        committees = [(package_id, committee.get("committeeName"),
+                       committee.get("chamber"), committee.get("type"))
+                      for committee in summary.get("committees") or []]
+
+        # One row per referenced section, or per title if no sections are
+        # listed.
+        references = []
+        for reference in summary.get("references") or []:
+            for content in reference.get("contents") or []:
+                for section in content.get("sections") or [None]:
+                    references.append((package_id,
+                                       reference.get("collectionName"),
+                                       content.get("title"),
+                                       content.get("label"), section))
+
+        # One row linking the package to the other versions of the same bill.
+        versions = []
+        congress = summary.get("congress")
+        bill_type = summary.get("billType")
+        bill_number = summary.get("billNumber")
+        bill_version = summary.get("billVersion")
+
+        # Older summaries can be missing the fields, but the packageId always
+        # has them.
+        if not (congress and bill_type and bill_number and bill_version):
+            match = package_id_pattern.match(package_id or "")
+            if match:
+                congress, bill_type, bill_number, bill_version = match.groups()
+
+        if congress and bill_type and bill_number and bill_version:
+            bill_version = str(bill_version).lower()
+            versions.append((package_id, int(congress),
+                             str(bill_type).lower(), int(bill_number),
+                             bill_version,
+                             Bills.VERSION_STAGES.get(bill_version,
+                                                      Bills.unknown_stage),
+                             summary.get("dateIssued")))
+
+        return {"bill_members": members, "bill_committees": committees,
+                "bill_references": references, "bill_versions": versions}
+
+
+def parse_stored(text: str):
+    """
+    Turn a list or dictionary that was stored as its Python representation
+    back into the real thing. Returns None if the value is empty or can't be
+    read.\n
+    text    = The stored value.
+    """
+    if text is None or text == "None":
+        return None
+
+    try:
+        return ast.literal_eval(text)
+
+    except (ValueError, SyntaxError) as error:
+        logger.warning(f"Could not parse a stored value. {error}")
+        return None
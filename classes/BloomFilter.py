@@ -0,0 +1,109 @@
+import math
+import os
+import struct
+from hashlib import blake2b
+from threading import Lock
+
+
+class BloomFilter:
+    """
+    A set of strings that answers "definitely not in it" or "maybe in it"
+    using a fixed array of bits, a couple of bytes per item instead of the
+    strings themselves. Items can be added but never removed. If more items
+    are added than it was sized for the false positive rate goes up, but it
+    never says an item that was added is missing.\n
+    capacity    = The number of items it is sized for.\n
+    error_rate  = The fraction of lookups of missing items that should come
+                  back as maybe in it, at capacity.
+    """
+    # The header of a saved filter: the capacity, the number of bits, the
+    # number of hashes, the number of items added and the error rate.
+    header = struct.Struct(">QQQQd")
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        self.capacity = max(int(capacity), 1)
+        self.error_rate = error_rate
+
+        # The optimal number of bits and hashes for the capacity and rate.
+        self.size = max(8, math.ceil(-self.capacity * math.log(error_rate) /
+                                     math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+        self.lock = Lock()
+
+    def _positions(self, item: str):
+        """
+        A helper definition that yields the bits an item sets. Two halves of
+        one hash are combined to make the rest, which is as good as separate
+        hashes for a filter.\n
+        item    = The string to hash.
+        """
+        digest = blake2b(item.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "big")
+        step = int.from_bytes(digest[8:], "big") | 1
+
+        for i in range(self.hashes):
+            yield (first + i * step) % self.size
+
+    def add(self, item: str):
+        """
+        Add an item.\n
+        item    = The string to add. E.g. a packageId
+        """
+        self.update((item,))
+
+    def update(self, items):
+        """
+        Add many items at once.\n
+        items   = Any iterable of strings.
+        """
+        with self.lock:
+            for item in items:
+                for position in self._positions(item):
+                    self.bits[position >> 3] |= 1 << (position & 7)
+                self.count = self.count + 1
+
+    def __contains__(self, item: str) -> bool:
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(item))
+
+    def __len__(self) -> int:
+        return self.count
+
+    def save(self, path: str):
+        """
+        Write the filter to a file. It's written to a temporary file first so
+        a crash never leaves half of one behind.\n
+        path    = The location of the file.
+        """
+        with self.lock:
+            with open(path + ".tmp", 'wb') as saved:
+                saved.write(self.header.pack(self.capacity, self.size,
+                                             self.hashes, self.count,
+                                             self.error_rate))
+                saved.write(self.bits)
+            os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path: str) -> "BloomFilter":
+        """
+        Read a filter written by save().\n
+        path    = The location of the file.
+        """
+        with open(path, 'rb') as saved:
+            capacity, size, hashes, count, error_rate = cls.header.unpack(
+                saved.read(cls.header.size))
+            bits = bytearray(saved.read())
+
+        if len(bits) != (size + 7) // 8:
+            raise ValueError(f"{path} is not a complete Bloom filter")
+
+        bloom = cls(capacity, error_rate)
+        bloom.size = size
+        bloom.hashes = hashes
+        bloom.bits = bits
+        bloom.count = count
+
+        return bloom
@@ -0,0 +1,67 @@
+from bisect import bisect_left
+
+
+class Histogram:
+    """
+    A latency histogram with fixed buckets, in seconds. Recording a value is
+    a binary search and an increment so it is cheap enough for the hot path.
+    Not thread safe on its own, the caller holds a lock around it.
+    """
+    # From a millisecond up to a minute, which covers a local database query
+    # through to a slow page from the API.
+    default_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                       0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    __slots__ = ("buckets", "counts", "count", "sum", "max")
+
+    def __init__(self, buckets: tuple = None):
+        self.buckets = tuple(buckets or self.default_buckets)
+
+        # One count per bucket plus one for anything over the last bucket.
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        """
+        Record a value.\n
+        value   = The value, in seconds.
+        """
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count = self.count + 1
+        self.sum = self.sum + value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimate a quantile from the buckets. Returns the upper bound of the
+        bucket the quantile falls in, or the largest value seen if it's past
+        the last bucket.\n
+        q   = The quantile, between 0 and 1. E.g. 0.95
+        """
+        if not self.count:
+            return 0.0
+
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen = seen + count
+            if seen >= target:
+                return min(bound, self.max)
+
+        return self.max
+
+    def cumulative(self) -> list:
+        """
+        Return the (upper bound, count of values at or under it) pairs, ending
+        with infinity, the way Prometheus expects its buckets.
+        """
+        pairs = []
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            seen = seen + count
+            pairs.append((bound, seen))
+
+        return pairs
@@ -0,0 +1,25 @@
+import json
+import logging
+from datetime import datetime, timezone
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats each log record as one line of JSON so the log can be searched and
+    loaded by other tools. Always has the time, level, logger, function and
+    message, plus the exception if there is one.
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {"time": datetime.fromtimestamp(
+                     record.created, timezone.utc).isoformat(
+                         timespec="milliseconds"),
+                 "level": record.levelname,
+                 "logger": record.name,
+                 "function": record.funcName,
+                 "thread": record.threadName,
+                 "message": record.getMessage()}
+
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+
+        return json.dumps(entry)
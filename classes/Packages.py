@@ -0,0 +1,32 @@
+from classes.Record import Record, integer, text, timestamp
+
+
+class Packages(Record):
+    """
+    A class that is used to build the packages of any collection that doesn't
+    have its own class. It holds the fields every package summary shares.
+    """
+    FIELDS = (("package_ID", "packageId", "packageId", text),
+              ("title", "title", "title", text),
+              ("collection_code", "collectionCode", "collectionCode", text),
+              ("collection_name", "collectionName", "collectionName", text),
+              ("category", "category", "category", text),
+              ("date_issued", "dateIssued", "dateIssued", text),
+              ("details_link", "detailsLink", "detailsLink", text),
+              ("download", "download", "download", text),
+              ("related", "related", "related", text),
+              ("branch", "branch", "branch", text),
+              ("pages", "pages", "pages", integer),
+              ("government_author_1", "governmentAuthor1",
+               "governmentAuthor1", text),
+              ("government_author_2", "governmentAuthor2",
+               "governmentAuthor2", text),
+              ("SuDoc_class_number", "suDocClassNumber", "suDocClassNumber",
+               text),
+              ("congress", "congress", "congress", integer),
+              ("publisher", "publisher", "publisher", text),
+              ("other_identifier", "otherIdentifier", "otherIdentifier",
+               text),
+              ("last_modified", "lastModified", "lastModified", timestamp))
+
+    __slots__ = tuple(field[0] for field in FIELDS)
@@ -0,0 +1,76 @@
+import time
+from threading import Lock
+
+
+class RateLimiter:
+    """
+    A token bucket that is shared between threads to limit how quickly
+    requests are made. The rate is lowered when the server throttles and slowly
+    raised back up to the maximum while requests succeed.
+    """
+    def __init__(self, rate: float, capacity: int, min_rate: float = 0.5):
+        self.max_rate = rate
+        self.min_rate = min_rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = Lock()
+
+    def acquire(self) -> float:
+        """
+        Wait until a token is available and take it. Returns the number of
+        seconds that were spent waiting.
+        """
+        waited = 0.0
+
+        while True:
+            with self.lock:
+                now = time.monotonic()
+
+                # If the server asked everyone to back off, wait it out.
+                if now < self.paused_until:
+                    delay = self.paused_until - now
+
+                else:
+                    # Refill the bucket for the time that has passed.
+                    self.tokens = min(self.capacity, self.tokens +
+                                      (now - self.updated) * self.rate)
+                    self.updated = now
+
+                    # If there is a token, take it.
+                    if self.tokens >= 1:
+                        self.tokens = self.tokens - 1
+                        return waited
+
+                    # Otherwise work out how long until there is one.
+                    delay = (1 - self.tokens) / self.rate
+
+            time.sleep(delay)
+            waited = waited + delay
+
+    def pause(self, seconds: float):
+        """
+        Stop every thread from making requests for the given number of seconds
+        and empty the bucket so they don't all burst afterwards.\n
+        seconds = How long to pause for.
+        """
+        with self.lock:
+            self.paused_until = max(self.paused_until,
+                                    time.monotonic() + seconds)
+            self.updated = self.paused_until
+            self.tokens = 0.0
+
+    def slow_down(self):
+        """Halve the rate, but never below the minimum."""
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def speed_up(self, step: float = 0.1):
+        """
+        Raise the rate a little, but never above the maximum.\n
+        step    = How many requests per second to add.
+        """
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + step)
@@ -0,0 +1,133 @@
+from datetime import date, datetime
+from hashlib import blake2b
+
+
+def text(value):
+    """Convert a value to text for the database, keeping None as NULL."""
+    if value is None or type(value) is str:
+        return value
+    return str(value)
+
+
+def integer(value):
+    """Convert a value to an integer for the database, keeping None as NULL."""
+    return None if value is None else int(value)
+
+
+def boolean(value):
+    """Convert a value to a boolean for the database, keeping None as NULL."""
+    if value is None:
+        return None
+    if type(value) is str:
+        return value.lower() == "true"
+    return bool(value)
+
+
+def timestamp(value):
+    """
+    Convert an ISO8601 timestamp such as 2020-06-30T20:10:06Z to a datetime for
+    the database, keeping None as NULL.
+    """
+    if value is None:
+        return None
+    if value[-1:] == "Z":
+        value = value[:-1]
+    return datetime.fromisoformat(value)
+
+
+def comparable(value):
+    """
+    Put a value the way it was built for the database and the way the database
+    hands it back into the same form, so the two can be compared. E.g. True
+    and 1, or "2020-06-30" and a date.
+    """
+    if value is None or type(value) is str:
+        return value
+    if type(value) is bool:
+        return str(int(value))
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+class Record:
+    """
+    The base of the classes that hold one package summary. Each subclass lists
+    its FIELDS as (attribute, summary key, column, converter) tuples in the
+    order of the columns of its table, starting with packageId and ending with
+    lastModified. Rows built for an upsert also carry a fingerprint of their
+    contents, just before lastModified, so a summary that was pulled again can
+    be told apart from one that actually changed without reading the stored
+    row. Plain inserts leave it NULL, and the first upsert of the package
+    fills it in.
+    """
+    FIELDS = ()
+    __slots__ = ()
+
+    # The column the fingerprint is stored in.
+    FINGERPRINT = "fingerprint"
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+
+        # The names of the columns the summary fills in, leaving out
+        # lastModified, and then all of the columns, in order.
+        cls.CONTENT_COLUMNS = tuple(field[2] for field in cls.FIELDS[:-1])
+        cls.COLUMNS = cls.CONTENT_COLUMNS + (cls.FINGERPRINT,
+                                             cls.FIELDS[-1][2])
+
+        # The summary keys and converters paired up ahead of time so building
+        # a row is a single pass with no lookups.
+        cls._ROW_MAP = tuple((field[1], field[3]) for field in cls.FIELDS)
+
+    def __init__(self, digest: dict):
+        for attribute, key, _, _ in self.FIELDS:
+            setattr(self, attribute, digest.get(key))
+
+    def to_row(self) -> tuple:
+        """Return the values of the record as a row in the order of COLUMNS."""
+        values = [convert(getattr(self, attribute))
+                  for attribute, _, _, convert in self.FIELDS]
+        last_modified = values.pop()
+        return tuple(values + [self.fingerprint(values), last_modified])
+
+    @classmethod
+    def row_from_digest(cls, digest: dict, fingerprint: bool = True) -> tuple:
+        """
+        Turn a parsed summary straight into a row in the order of COLUMNS
+        without building an object.\n
+        digest      = The parsed summary.\n
+        fingerprint = Whether to work out the fingerprint. It's left as None
+                      otherwise, which is all a plain insert needs.
+        """
+        get = digest.get
+        values = [convert(get(key)) for key, convert in cls._ROW_MAP]
+        values.insert(-1, cls.fingerprint(values[:-1]) if fingerprint
+                      else None)
+        return tuple(values)
+
+    @staticmethod
+    def fingerprint(values: list) -> str:
+        """
+        Hash the values of a row that come from the summary. lastModified is
+        left out, so a package that was touched without anything in it
+        changing keeps the same fingerprint. The converters have already
+        turned every value into text, a number or None, so they are joined
+        as they are rather than serialised again.\n
+        values  = The values in the order of CONTENT_COLUMNS.
+        """
+        return blake2b("\x1f".join(map(str, values)).encode(),
+                       digest_size=16).hexdigest()
+
+    @classmethod
+    def changed_columns(cls, stored: tuple, row: tuple) -> tuple:
+        """
+        Return the positions of the columns whose values differ between a
+        stored row and a new one, leaving out packageId, the fingerprint and
+        lastModified.\n
+        stored  = The stored values in the order of CONTENT_COLUMNS, as the
+                  database hands them back.\n
+        row     = The new row, as built by row_from_digest().
+        """
+        return tuple(i for i in range(1, len(cls.CONTENT_COLUMNS))
+                     if comparable(stored[i]) != comparable(row[i]))
@@ -0,0 +1,181 @@
+import hashlib
+import json
+import os
+import time
+from threading import Lock
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+
+class ResponseCache:
+    """
+    An on-disk cache of API responses. Each response is stored under a hash of
+    its normalized URL, with the API key stripped out, alongside the headers
+    needed to revalidate it. Once the cache grows past its size limit the least
+    recently used responses are evicted.
+    """
+    def __init__(self, directory: str, max_bytes: int, ttls: dict,
+                 default_ttl: float = 0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttls = ttls
+        self.default_ttl = default_ttl
+        self.stats = {"hits": 0, "misses": 0, "revalidated": 0, "stored": 0,
+                      "evicted": 0}
+        self.lock = Lock()
+
+        # Create the cache directory if it doesn't exist yet.
+        os.makedirs(directory, exist_ok=True)
+
+        # Build the index of what's already on disk: key -> [last used, size].
+        self.index = {}
+        self.total_bytes = 0
+        for name in os.listdir(directory):
+            if name.endswith(".body"):
+                path = os.path.join(directory, name)
+                info = os.stat(path)
+                self.index[name[:-5]] = [info.st_atime, info.st_size]
+                self.total_bytes = self.total_bytes + info.st_size
+
+    @staticmethod
+    def normalize(url: str) -> str:
+        """
+        Return the URL with the API key removed and the query parameters
+        sorted, so the same request always maps to the same entry.\n
+        url = The full URL of the request.
+        """
+        parts = urlsplit(url)
+        query = sorted((key, value) for key, value in parse_qsl(parts.query)
+                       if key != "api_key")
+
+        return urlunsplit((parts.scheme, parts.netloc.lower(), parts.path,
+                           urlencode(query), ""))
+
+    def key(self, url: str) -> str:
+        """
+        Return the name the response for a URL is stored under.\n
+        url = The full URL of the request.
+        """
+        return hashlib.sha256(self.normalize(url).encode()).hexdigest()
+
+    def _path(self, key: str, extension: str) -> str:
+        return os.path.join(self.directory, key + extension)
+
+    def get(self, url: str, endpoint: str):
+        """
+        Look up a URL in the cache. Returns a (body, meta, fresh) tuple where
+        fresh is whether it is still within its TTL, or None if the URL isn't
+        cached.\n
+        url         = The full URL of the request.\n
+        endpoint    = The name of the endpoint, used to look up its TTL.
+        """
+        key = self.key(url)
+
+        # Try to read the stored response and its headers.
+        try:
+            with open(self._path(key, ".meta"), 'rt') as meta_file:
+                meta = json.load(meta_file)
+            with open(self._path(key, ".body"), 'rb') as body_file:
+                body = body_file.read()
+
+        # If either is missing or damaged, treat it as not cached. It's
+        # counted as a miss once the response is downloaded and stored.
+        except (OSError, ValueError):
+            return None
+
+        # Mark it as recently used.
+        with self.lock:
+            if key in self.index:
+                self.index[key][0] = time.time()
+
+        ttl = self.ttls.get(endpoint, self.default_ttl)
+        fresh = time.time() - meta.get("stored_at", 0) < ttl
+
+        # Only count it as a hit if it can be used without going to the
+        # server. Stale entries are counted once they're revalidated, or as a
+        # miss if they have to be downloaded again.
+        if fresh:
+            with self.lock:
+                self.stats["hits"] = self.stats["hits"] + 1
+
+        return (body, meta, fresh)
+
+    def put(self, url: str, body: bytes, headers):
+        """
+        Store a response, replacing any older copy, then evict the least
+        recently used responses if the cache is too large.\n
+        url     = The full URL of the request.\n
+        body    = The body of the response.\n
+        headers = The headers of the response, used to revalidate it later.
+        """
+        key = self.key(url)
+        meta = {"url": self.normalize(url), "stored_at": time.time(),
+                "etag": headers.get("ETag"),
+                "last_modified": headers.get("Last-Modified")}
+
+        # Write to temporary files first so a crash never leaves a half
+        # written entry behind.
+        for extension, data in ((".body", body),
+                                (".meta", json.dumps(meta).encode())):
+            path = self._path(key, extension)
+            with open(path + ".tmp", 'wb') as temp_file:
+                temp_file.write(data)
+            os.replace(path + ".tmp", path)
+
+        with self.lock:
+            self.stats["misses"] = self.stats["misses"] + 1
+            self.stats["stored"] = self.stats["stored"] + 1
+
+            # Update the index and the running size.
+            old = self.index.get(key)
+            if old:
+                self.total_bytes = self.total_bytes - old[1]
+            self.index[key] = [time.time(), len(body)]
+            self.total_bytes = self.total_bytes + len(body)
+
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def revalidated(self, url: str):
+        """
+        Mark a stale response as fresh again after the server said it hasn't
+        changed.\n
+        url = The full URL of the request.
+        """
+        path = self._path(self.key(url), ".meta")
+
+        try:
+            with open(path, 'rt') as meta_file:
+                meta = json.load(meta_file)
+            meta["stored_at"] = time.time()
+            with open(path + ".tmp", 'wt') as meta_file:
+                json.dump(meta, meta_file)
+            os.replace(path + ".tmp", path)
+
+        except (OSError, ValueError):
+            return
+
+        with self.lock:
+            self.stats["hits"] = self.stats["hits"] + 1
+            self.stats["revalidated"] = self.stats["revalidated"] + 1
+
+    def _evict(self):
+        """
+        Remove the least recently used responses until the cache is back under
+        90% of its size limit. Must be called with the lock held.
+        """
+        target = self.max_bytes * 0.9
+
+        for key, (used, size) in sorted(self.index.items(),
+                                        key=lambda item: item[1][0]):
+            if self.total_bytes <= target:
+                break
+
+            for extension in (".body", ".meta"):
+                try:
+                    os.remove(self._path(key, extension))
+                except FileNotFoundError:
+                    pass
+
+            del self.index[key]
+            self.total_bytes = self.total_bytes - size
+            self.stats["evicted"] = self.stats["evicted"] + 1
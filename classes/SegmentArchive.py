@@ -0,0 +1,433 @@
+import mmap
+import os
+import struct
+import zlib
+from hashlib import blake2b
+from threading import RLock
+
+
+class SegmentArchive:
+    """
+    An append-only store of raw API payloads keyed by packageId. Payloads are
+    compressed one at a time and packed into segment files of a fixed maximum
+    size, so hundreds of thousands of summaries take a handful of files
+    instead of one each. Each payload can still be read on its own through an
+    index of where it is, which is a sorted file of fixed size entries that is
+    memory-mapped and binary searched. Payloads appended since the index was
+    last written are held in memory and folded into it by write_index().
+
+    Storing a packageId again supersedes the old copy. compact() rewrites the
+    segments that are mostly superseded copies. If the program dies before
+    the index is written, the records past the point it covers are found again
+    by scanning the segments the next time the archive is opened.\n
+    directory           = Where the segments and the index are kept.\n
+    max_segment_bytes   = The size a segment can reach before a new one is
+                          started.\n
+    level               = The zlib compression level.
+    """
+    # The header of each record: the length of the packageId, the length of
+    # the compressed payload, and the CRC32 of the compressed payload. The
+    # packageId and then the payload follow it.
+    record_header = struct.Struct(">HII")
+
+    # The header of the index: a marker, the segment and offset the index
+    # covers up to, and the number of entries.
+    index_header = struct.Struct(">8sIQQ")
+    index_marker = b"BILLIDX1"
+
+    # Each entry of the index: a hash of the packageId, then the segment,
+    # offset and length of its record. The entries are sorted by the hash.
+    index_entry = struct.Struct(">16sIQI")
+
+    def __init__(self, directory: str,
+                 max_segment_bytes: int = 64 * 1024 * 1024, level: int = 6):
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        self.level = level
+        self.lock = RLock()
+        self.stats = {"appended": 0, "read": 0, "compacted": 0, "recovered": 0}
+
+        os.makedirs(directory, exist_ok=True)
+
+        # The records appended since the index was written, keyed by the hash
+        # of their packageId, and the open file of each segment being read.
+        self.tail = {}
+        self._readers = {}
+
+        # Map the index, if there is one.
+        self._index_file = None
+        self._index_map = None
+        self._entries = 0
+        self.covered = (0, 0)
+        self._open_index()
+
+        # Find the segments and continue writing to the last one.
+        self.segments = sorted(int(name[8:14]) for name in os.listdir(directory)
+                               if name.startswith("segment-") and
+                               name.endswith(".dat"))
+        if not self.segments:
+            self.segments = [1]
+        self.active = self.segments[-1]
+
+        self._recover()
+        self._writer = open(self._segment_path(self.active), 'ab')
+
+    @staticmethod
+    def _hash(package_id: str) -> bytes:
+        """
+        A helper definition that returns the hash a packageId is indexed by.\n
+        package_id  = The packageId.
+        """
+        return blake2b(package_id.encode(), digest_size=16).digest()
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"segment-{segment:06d}.dat")
+
+    def _index_path(self) -> str:
+        return os.path.join(self.directory, "index.dat")
+
+    def _open_index(self):
+        """
+        A helper definition that maps the index file and reads how far it
+        covers. A missing or damaged index is treated as empty, so everything
+        is found again by scanning the segments.
+        """
+        self._close_index()
+
+        path = self._index_path()
+        if not os.path.isfile(path):
+            return
+
+        index_file = open(path, 'rb')
+        header = index_file.read(self.index_header.size)
+
+        if len(header) == self.index_header.size:
+            marker, segment, offset, entries = self.index_header.unpack(header)
+            size = self.index_header.size + entries * self.index_entry.size
+
+            if (marker == self.index_marker and
+                    os.fstat(index_file.fileno()).st_size == size):
+                self._index_file = index_file
+                self._index_map = mmap.mmap(index_file.fileno(), 0,
+                                            access=mmap.ACCESS_READ)
+                self._entries = entries
+                self.covered = (segment, offset)
+                return
+
+        index_file.close()
+
+    def _close_index(self):
+        """A helper definition that unmaps the index."""
+        if self._index_map is not None:
+            self._index_map.close()
+            self._index_map = None
+        if self._index_file is not None:
+            self._index_file.close()
+            self._index_file = None
+        self._entries = 0
+        self.covered = (0, 0)
+
+    def _scan(self, segment: int, start: int = 0):
+        """
+        A helper definition that reads the records of a segment in order.
+        Yields an (offset, length, packageId, compressed payload) tuple for
+        each one, stopping at the first record that is cut short or damaged.\n
+        segment = The number of the segment.\n
+        start   = The offset to start reading from.
+        """
+        with open(self._segment_path(segment), 'rb') as segment_file:
+            segment_file.seek(start)
+            offset = start
+
+            while True:
+                header = segment_file.read(self.record_header.size)
+                if len(header) < self.record_header.size:
+                    return
+
+                key_length, data_length, crc = self.record_header.unpack(
+                    header)
+                key = segment_file.read(key_length)
+                data = segment_file.read(data_length)
+                if (len(key) < key_length or len(data) < data_length or
+                        zlib.crc32(data) != crc):
+                    return
+
+                length = self.record_header.size + key_length + data_length
+                yield offset, length, key.decode(), data
+                offset = offset + length
+
+    def _recover(self):
+        """
+        A helper definition that puts every record written after the point
+        the index covers into the tail. A record cut short at the end of the
+        last segment by a crash is cut off so new records follow the good ones.
+        """
+        for segment in self.segments:
+            if segment < self.covered[0]:
+                continue
+
+            start = self.covered[1] if segment == self.covered[0] else 0
+            end = start
+
+            if os.path.isfile(self._segment_path(segment)):
+                for offset, length, key, _ in self._scan(segment, start):
+                    self.tail[self._hash(key)] = (segment, offset, length)
+                    self.stats["recovered"] = self.stats["recovered"] + 1
+                    end = offset + length
+
+                if (segment == self.active and
+                        os.path.getsize(self._segment_path(segment)) > end):
+                    os.truncate(self._segment_path(segment), end)
+
+    def _find(self, key_hash: bytes):
+        """
+        A helper definition that returns the (segment, offset, length) of the
+        newest record of a packageId, or None if it isn't in the archive.\n
+        key_hash    = The hash of the packageId.
+        """
+        location = self.tail.get(key_hash)
+        if location is not None:
+            return location
+
+        # Binary search the sorted entries of the index.
+        low = 0
+        high = self._entries
+        while low < high:
+            middle = (low + high) // 2
+            position = self.index_header.size + middle * self.index_entry.size
+            found = self._index_map[position:position + 16]
+
+            if found < key_hash:
+                low = middle + 1
+            elif found > key_hash:
+                high = middle
+            else:
+                return self.index_entry.unpack_from(self._index_map,
+                                                    position)[1:]
+
+        return None
+
+    def _write_record(self, key_hash: bytes, record: bytes):
+        """
+        A helper definition that appends a whole record to the active segment,
+        starting a new segment first if it would go over the maximum size.\n
+        key_hash    = The hash of the record's packageId.\n
+        record      = The record, header and all.
+        """
+        offset = self._writer.tell()
+
+        if offset and offset + len(record) > self.max_segment_bytes:
+            self._writer.close()
+            self.active = self.active + 1
+            self.segments.append(self.active)
+            self._writer = open(self._segment_path(self.active), 'ab')
+            offset = 0
+
+        self._writer.write(record)
+        self.tail[key_hash] = (self.active, offset, len(record))
+
+    def append(self, package_id: str, payload: bytes):
+        """
+        Store a payload, superseding any earlier copy of the same packageId.\n
+        package_id  = The packageId. E.g. BILLS-116hr1ih\n
+        payload     = The raw payload as it came from the API.
+        """
+        key = package_id.encode()
+        data = zlib.compress(payload, self.level)
+        record = (self.record_header.pack(len(key), len(data), zlib.crc32(data))
+                  + key + data)
+
+        with self.lock:
+            self._write_record(self._hash(package_id), record)
+            self.stats["appended"] = self.stats["appended"] + 1
+
+    def _read(self, segment: int, offset: int, length: int) -> bytes:
+        """
+        A helper definition that reads a whole record from a segment.\n
+        segment = The number of the segment.\n
+        offset  = Where the record starts.\n
+        length  = The length of the record.
+        """
+        # Anything still in the write buffer has to be on disk to be read.
+        if segment == self.active:
+            self._writer.flush()
+
+        reader = self._readers.get(segment)
+        if reader is None:
+            reader = os.open(self._segment_path(segment), os.O_RDONLY)
+            self._readers[segment] = reader
+
+        return os.pread(reader, length, offset)
+
+    def get(self, package_id: str) -> bytes:
+        """
+        Return the newest payload stored for a packageId, or None if there
+        isn't one.\n
+        package_id  = The packageId. E.g. BILLS-116hr1ih
+        """
+        with self.lock:
+            location = self._find(self._hash(package_id))
+            if location is None:
+                return None
+
+            record = self._read(*location)
+            self.stats["read"] = self.stats["read"] + 1
+
+        key_length, data_length, crc = self.record_header.unpack_from(record)
+        start = self.record_header.size
+        data = record[start + key_length:start + key_length + data_length]
+
+        # The hash matched, but make sure it really is the same packageId.
+        if (record[start:start + key_length].decode() != package_id or
+                zlib.crc32(data) != crc):
+            return None
+
+        return zlib.decompress(data)
+
+    def __contains__(self, package_id: str) -> bool:
+        with self.lock:
+            return self._find(self._hash(package_id)) is not None
+
+    def replay(self):
+        """
+        Yield a (packageId, payload) tuple for the newest copy of every
+        payload, reading the segments from start to end. Copies that were
+        superseded are skipped.
+        """
+        with self.lock:
+            self._writer.flush()
+            segments = list(self.segments)
+
+        for segment in segments:
+            # A segment can be compacted away while the others are replayed,
+            # in which case its records have moved to a later one.
+            if not os.path.isfile(self._segment_path(segment)):
+                continue
+
+            for offset, length, key, data in self._scan(segment):
+                with self.lock:
+                    live = (self._find(self._hash(key)) ==
+                            (segment, offset, length))
+
+                if live:
+                    yield key, zlib.decompress(data)
+
+    def _iter_entries(self):
+        """
+        A helper definition that yields every (hash, segment, offset, length)
+        entry of the mapped index in order.
+        """
+        # Each entry is unpacked straight from the map rather than through a
+        # view of it, which would stop the map from being closed.
+        unpack_from = self.index_entry.unpack_from
+        for i in range(self._entries):
+            yield unpack_from(self._index_map, self.index_header.size +
+                              i * self.index_entry.size)
+
+    def write_index(self):
+        """
+        Fold the records appended since the last time into the index and
+        write it out. The old index and the new records are both sorted, so
+        they're merged in one pass without loading the index into memory.
+        """
+        with self.lock:
+            self._writer.flush()
+            os.fsync(self._writer.fileno())
+
+            tail = sorted((key_hash,) + location
+                          for key_hash, location in self.tail.items())
+            covered = (self.active, self._writer.tell())
+            path = self._index_path()
+            entries = 0
+
+            with open(path + ".tmp", 'wb') as index_file:
+                index_file.write(self.index_header.pack(self.index_marker,
+                                                        0, 0, 0))
+                pack = self.index_entry.pack
+                old = self._iter_entries()
+                entry = next(old, None)
+
+                # Merge the two, with a new record winning over an old one.
+                for new in tail:
+                    while entry is not None and entry[0] < new[0]:
+                        index_file.write(pack(*entry))
+                        entries = entries + 1
+                        entry = next(old, None)
+                    if entry is not None and entry[0] == new[0]:
+                        entry = next(old, None)
+                    index_file.write(pack(*new))
+                    entries = entries + 1
+
+                while entry is not None:
+                    index_file.write(pack(*entry))
+                    entries = entries + 1
+                    entry = next(old, None)
+
+                # Fill in the header now that the count is known.
+                index_file.seek(0)
+                index_file.write(self.index_header.pack(self.index_marker,
+                                                        *covered, entries))
+                index_file.flush()
+                os.fsync(index_file.fileno())
+
+            self._close_index()
+            os.replace(path + ".tmp", path)
+            self._open_index()
+            self.tail.clear()
+
+    def compact(self, min_live: float = 0.5) -> int:
+        """
+        Rewrite the full segments where less than min_live of the bytes are
+        still the newest copy of their packageId. The live records are copied
+        to the end of the archive as they are, without recompressing them, and
+        the old segments are deleted once the index points at the copies.
+        Returns the number of bytes that were freed.\n
+        min_live    = The fraction of a segment that has to be live for it to
+                      be left alone.
+        """
+        with self.lock:
+            self.write_index()
+
+            # Add up the live bytes of each segment.
+            live = {}
+            for _, segment, _, length in self._iter_entries():
+                live[segment] = live.get(segment, 0) + length
+
+            sizes = {segment: os.path.getsize(self._segment_path(segment))
+                     for segment in self.segments if segment != self.active}
+            targets = [segment for segment, size in sizes.items()
+                       if size and live.get(segment, 0) / size < min_live]
+            if not targets:
+                return 0
+
+            # Copy the live records forward.
+            for segment in targets:
+                for offset, length, key, data in self._scan(segment):
+                    key_hash = self._hash(key)
+                    if self._find(key_hash) == (segment, offset, length):
+                        self._write_record(key_hash, self._read(
+                            segment, offset, length))
+                        self.stats["compacted"] = self.stats["compacted"] + 1
+
+            # Point the index at the copies before the old ones are removed.
+            self.write_index()
+
+            for segment in targets:
+                reader = self._readers.pop(segment, None)
+                if reader is not None:
+                    os.close(reader)
+                os.remove(self._segment_path(segment))
+                self.segments.remove(segment)
+
+            return sum(sizes[segment] - live.get(segment, 0)
+                       for segment in targets)
+
+    def close(self):
+        """Write the index and close every file."""
+        with self.lock:
+            self.write_index()
+            self._writer.close()
+            for reader in self._readers.values():
+                os.close(reader)
+            self._readers.clear()
+            self._close_index()
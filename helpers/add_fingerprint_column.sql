@@ -0,0 +1,5 @@
+ALTER TABLE bills ADD COLUMN fingerprint char(32) AFTER docReferences;
+ALTER TABLE crec ADD COLUMN fingerprint char(32) AFTER otherIdentifier;
+ALTER TABLE fr ADD COLUMN fingerprint char(32) AFTER otherIdentifier;
+ALTER TABLE cfr ADD COLUMN fingerprint char(32) AFTER otherIdentifier;
+ALTER TABLE plaw ADD COLUMN fingerprint char(32) AFTER otherIdentifier;
@@ -28,6 +28,7 @@ CREATE TABLE bills (
 	members mediumtext,
 	otherIdentifier mediumtext,
 	docReferences mediumtext,
+	fingerprint char(32),
 	lastModified datetime,
 	PRIMARY KEY(packageId)
 );
\ No newline at end of file
@@ -0,0 +1,12 @@
+CREATE TABLE IF NOT EXISTS bill_versions (
+	packageId varchar(100) NOT NULL,
+	congress int,
+	billType varchar(20),
+	billNumber int,
+	billVersion varchar(20),
+	stage tinyint,
+	dateIssued date,
+	PRIMARY KEY (packageId),
+	KEY idx_versions_bill (congress, billType, billNumber, stage, dateIssued),
+	FOREIGN KEY (packageId) REFERENCES bills(packageId) ON DELETE CASCADE
+);
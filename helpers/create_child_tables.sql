@@ -0,0 +1,43 @@
+CREATE TABLE bill_members (
+	packageId varchar(100) NOT NULL,
+	role varchar(50),
+	bioGuideId varchar(20),
+	memberName varchar(255),
+	chamber varchar(50),
+	congress int,
+	state varchar(10),
+	party varchar(10),
+	KEY idx_members_package (packageId),
+	KEY idx_members_bioguide (bioGuideId, congress, role),
+	KEY idx_members_name (memberName, congress, role),
+	FOREIGN KEY (packageId) REFERENCES bills(packageId) ON DELETE CASCADE
+);
+
+CREATE TABLE bill_committees (
+	packageId varchar(100) NOT NULL,
+	committeeName varchar(255),
+	chamber varchar(50),
+	committeeType varchar(50),
+	KEY idx_committees_package (packageId),
+	KEY idx_committees_name (committeeName),
+	FOREIGN KEY (packageId) REFERENCES bills(packageId) ON DELETE CASCADE
+);
+
+CREATE TABLE bill_references (
+	packageId varchar(100) NOT NULL,
+	collectionName varchar(150),
+	title varchar(100),
+	label varchar(100),
+	section varchar(100),
+	KEY idx_references_package (packageId),
+	KEY idx_references_target (collectionName, title, section),
+	FOREIGN KEY (packageId) REFERENCES bills(packageId) ON DELETE CASCADE
+);
+
+CREATE INDEX idx_bills_congress ON bills (congress, billType, billNumber);
+CREATE INDEX idx_bills_billtype ON bills (billType);
+CREATE INDEX idx_bills_dateissued ON bills (dateIssued);
+CREATE INDEX idx_bills_lastmodified ON bills (lastModified);
+
+-- bill_versions is in create_bill_versions_table.sql, which also adds it to
+-- a database made before it existed.
@@ -0,0 +1,28 @@
+CREATE TABLE crec (
+	packageId varchar(100) NOT NULL,
+	title mediumtext,
+	collectionCode varchar(100),
+	collectionName varchar(150),
+	category varchar(100),
+	dateIssued date,
+	detailsLink mediumtext,
+	download mediumtext,
+	related mediumtext,
+	branch varchar(100),
+	pages int,
+	governmentAuthor1 mediumtext,
+	governmentAuthor2 mediumtext,
+	suDocClassNumber varchar(100),
+	congress int,
+	publisher varchar(255),
+	otherIdentifier mediumtext,
+	fingerprint char(32),
+	lastModified datetime,
+	PRIMARY KEY(packageId),
+	KEY idx_crec_dateissued (dateIssued),
+	KEY idx_crec_lastmodified (lastModified)
+);
+
+CREATE TABLE fr LIKE crec;
+CREATE TABLE cfr LIKE crec;
+CREATE TABLE plaw LIKE crec;
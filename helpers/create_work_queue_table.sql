@@ -0,0 +1,10 @@
+CREATE TABLE IF NOT EXISTS work_queue (
+	collection varchar(50) NOT NULL,
+	packageId varchar(100) NOT NULL,
+	status tinyint NOT NULL DEFAULT 0,
+	worker varchar(255),
+	lease_expires datetime NOT NULL DEFAULT '1970-01-01 00:00:01',
+	attempts int NOT NULL DEFAULT 0,
+	PRIMARY KEY(collection, packageId),
+	KEY idx_work_queue_claim (collection, status, lease_expires)
+);
@@ -1,23 +1,26 @@
+import gzip
+import io
 import json
 import logging
 import os
-import urllib.request
-from http.client import IncompleteRead
-from urllib.error import HTTPError
-
-# Create custom logger and set the level.
+import random
+import time
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from http.client import (
+    HTTPConnection, HTTPResponse, HTTPSConnection, IncompleteRead,
+    RemoteDisconnected)
+from threading import Lock, local
+from urllib.error import HTTPError, URLError
+from urllib.parse import urljoin, urlsplit
+
+from classes.RateLimiter import RateLimiter
+from classes.ResponseCache import ResponseCache
+from interfaces.metrics_interface import count, log_sampled, timed
+
+# Create the logger for this module. Where it goes and at what level is set
+# up by whatever runs the program, see interfaces/logging_interface.py.
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-
-# Create formatter, create handler, and assign the format to the handler.
-# TODO: Add an option to have a config file for the logger.
-formatter = logging.Formatter('%(asctime)s; %(levelname)s; %(filename)s; '+
-                                '%(funcName)s; %(message)s')
-handler = logging.FileHandler('Bill_The.log', 'w')
-handler.setFormatter(formatter)
-
-# Add the handler to the logger.
-logger.addHandler(handler)
 
 # Set the site base. It should never change..
 site_base = "https://api.govinfo.gov/"
@@ -26,39 +29,450 @@ site_base = "https://api.govinfo.gov/"
 # TODO: Set as an optional passable variable from commandline.
 save_location = "content/"
 
-def get_page(link: str) -> bytes:
+# The timeout, in seconds, for connecting to and reading from the API.
+request_timeout = 30
+
+# The headers sent with every request unless they're overridden.
+default_headers = {"Accept-Encoding": "gzip", "Connection": "keep-alive",
+                   "User-Agent": "BillMe"}
+
+# The open keep-alive connections. Each thread keeps one connection per host
+# so they can be reused without any locking. Every connection is also kept in
+# _all_connections so they can be closed at the end of the run.
+_session = local()
+_all_connections = []
+_connections_lock = Lock()
+
+
+def set_timeout(seconds: float):
     """
-    A helper definition to gather the web page and return it as a bytes stream
+    Set the timeout used by new connections to the API.\n
+    seconds = The number of seconds to wait to connect or read before failing.
     """
-    # Inform the logger that the page is being retrieved.
-    logger.debug(f"Getting page {link}")
+    global request_timeout
+
+    logger.info(f"Setting the request timeout to {seconds}s")
+    request_timeout = seconds
+
+
+def _get_connection(scheme: str, host: str) -> HTTPConnection:
+    """
+    A helper definition to get this thread's open connection to a host, or
+    open a new one if there isn't one yet.\n
+    scheme  = Either http or https.\n
+    host    = The host and, optionally, the port.
+    """
+    # Get this thread's connections, creating the dictionary the first time.
+    connections = getattr(_session, "connections", None)
+    if connections is None:
+        connections = _session.connections = {}
+
+    connection = connections.get((scheme, host))
+
+    # If there isn't a connection to the host yet, open one.
+    if connection is None:
+        if scheme == "https":
+            connection = HTTPSConnection(host, timeout=request_timeout)
+        else:
+            connection = HTTPConnection(host, timeout=request_timeout)
+
+        connections[(scheme, host)] = connection
+
+        with _connections_lock:
+            _all_connections.append(connection)
+
+    return connection
+
+
+def _drop_connection(scheme: str, host: str):
+    """
+    A helper definition to close this thread's connection to a host so the
+    next request opens a fresh one.\n
+    scheme  = Either http or https.\n
+    host    = The host and, optionally, the port.
+    """
+    connection = getattr(_session, "connections", {}).pop((scheme, host), None)
+
+    if connection is not None:
+        connection.close()
+
+        with _connections_lock:
+            if connection in _all_connections:
+                _all_connections.remove(connection)
+
+
+def close_sessions():
+    """Close every keep-alive connection that has been opened."""
+    with _connections_lock:
+        logger.info(f"Closing {len(_all_connections)} HTTP connections")
+
+        for connection in _all_connections:
+            connection.close()
+
+        _all_connections.clear()
+
+
+def open_url(link: str, headers: dict = None,
+             method: str = "GET") -> HTTPResponse:
+    """
+    Send a request over this thread's keep-alive connection to the host
+    and return the response so it can be read. Redirects are followed and any
+    error status is raised as an HTTPError. The response must be read to the
+    end before the next request is made on the same thread.\n
+    link    = The full URL being requested.\n
+    headers = Any headers to add to or override the default ones.\n
+    method  = The HTTP method. E.g. GET or HEAD
+    """
+    # Build the headers for the request.
+    request_headers = dict(default_headers)
+    if headers:
+        request_headers.update(headers)
+
+    # Follow up to five redirects.
+    for redirect in range(6):
+        # Split the link into the parts the connection needs.
+        parts = urlsplit(link)
+        path = parts.path or "/"
+        if parts.query:
+            path = path + "?" + parts.query
+
+        # Try the request. If the server already closed the kept-alive
+        # connection, try once more on a brand new one.
+        for retry in (False, True):
+            connection = _get_connection(parts.scheme, parts.netloc)
+
+            try:
+                connection.request(method, path, headers=request_headers)
+                response = connection.getresponse()
+                break
+
+            except (RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                _drop_connection(parts.scheme, parts.netloc)
+                if retry:
+                    raise
+
+            # Anything else leaves the connection in an unknown state.
+            except Exception:
+                _drop_connection(parts.scheme, parts.netloc)
+                raise
+
+        # If the server closes the connection after this response, close it
+        # and forget it so it isn't reused or kept until the end of the run.
+        # http.client has already handed the socket to the response, so the
+        # body can still be read.
+        if response.will_close:
+            _drop_connection(parts.scheme, parts.netloc)
+
+        # If the page has moved, follow it.
+        location = response.getheader("Location")
+        if response.status in (301, 302, 303, 307, 308) and location:
+            response.read()
+            link = urljoin(link, location)
+            continue
+
+        # If the server returned an error, raise it the same way urllib does.
+        if response.status >= 400:
+            body = read_body(response, parts.scheme, parts.netloc)
+            raise HTTPError(link, response.status, response.reason,
+                            response.headers, io.BytesIO(body))
+
+        return response
+
+    raise HTTPError(link, 310, "Too many redirects", response.headers, None)
+
+
+def read_body(response: HTTPResponse, scheme: str, host: str) -> bytes:
+    """
+    Read the rest of a response and decompress it if it was gzipped. If the
+    read fails the connection is dropped since it can't be reused.\n
+    response    = The response returned by open_url().\n
+    scheme      = Either http or https.\n
+    host        = The host the response came from.
+    """
+    try:
+        body = response.read()
+
+    except Exception:
+        _drop_connection(scheme, host)
+        raise
+
+    # Decompress the body if the server gzipped it.
+    if response.getheader("Content-Encoding", "").lower() == "gzip":
+        body = gzip.decompress(body)
+
+    return body
+
+
+def fetch(link: str, headers: dict = None) -> bytes:
+    """
+    Request a URL over a keep-alive connection and return the whole body.\n
+    link    = The full URL being requested.\n
+    headers = Any headers to add to or override the default ones.
+    """
+    parts = urlsplit(link)
+
+    return read_body(open_url(link, headers), parts.scheme, parts.netloc)
+
+
+# The maximum number of times a request will be retried before giving up.
+max_retries = 5
+
+# The base and the cap, in seconds, of the exponential backoff between retries.
+backoff_base = 1.0
+backoff_cap = 60.0
+
+# The rate limiter that is shared by every request made to the API. Allows 10
+# requests per second with bursts of up to 20 by default.
+rate_limiter = RateLimiter(10, 20)
+
+# Counters for how many requests were made, retried and throttled, and the lock
+# that guards them since requests can come from several threads.
+request_stats = {"requests": 0, "retries": 0, "throttled": 0,
+                 "seconds_waited": 0.0}
+_stats_lock = Lock()
+
+
+def set_rate_limit(rate: float, burst: int):
+    """
+    Replace the shared rate limiter.\n
+    rate    = The maximum number of requests per second.\n
+    burst   = The maximum number of requests that can be made at once after
+              being idle.
+    """
+    global rate_limiter
+
+    logger.info(f"Setting the rate limit to {rate}/s with bursts of {burst}")
+    rate_limiter = RateLimiter(rate, burst)
+
+
+def _count(stat: str, amount=1):
+    """
+    A helper definition to add to one of the request_stats counters.\n
+    stat    = The name of the counter.\n
+    amount  = How much to add to it.
+    """
+    with _stats_lock:
+        request_stats[stat] = request_stats[stat] + amount
+
+
+def wait_for_rate_limit():
+    """
+    Wait until the shared rate limiter allows another request and count it.
+    Every request made to the API should call this first.
+    """
+    _count("seconds_waited", rate_limiter.acquire())
+    _count("requests")
 
-    # Get the site passed in from the link.
-    site = urllib.request.urlopen(link)
 
-    # Read the site.
+def get_request_stats() -> dict:
+    """Return a copy of the request counters."""
+    with _stats_lock:
+        return dict(request_stats)
+
+
+def _retry_after(error: HTTPError) -> float:
+    """
+    A helper definition to read the Retry-After header of a response. Returns
+    the number of seconds to wait, or None if there isn't a usable header.\n
+    error   = The HTTPError the server returned.
+    """
+    value = error.headers.get("Retry-After") if error.headers else None
+
+    if not value:
+        return None
+
+    # The header is either a number of seconds.
     try:
-        response = site.read()
-    
-    except IncompleteRead as error:
-        logger.error("There was an incomplete read, retrying.")
-        site = urllib.request.urlopen(link)
-        response = site.read()
-
-    # If the site isn't loading for any reason.
-    # TODO: Set a finite amount of retries before failing.
-    while not site:
-        # Warn the logger.
-        logger.warning("Need to repull the page")
-
-        # Attempt to retrieve the site again.
-        site = urllib.request.urlopen(link)
-
-        # Read the site.
-        response = site.read()
-
-    # If the API returns the website successfully, but there is no data.
-    if json.loads(response).get('message') == "No results found":
+        return max(0.0, float(value))
+
+    # Or a date to wait until.
+    except ValueError:
+        try:
+            retry_at = parsedate_to_datetime(value)
+            return max(0.0, (retry_at -
+                             datetime.now(timezone.utc)).total_seconds())
+
+        except (TypeError, ValueError):
+            return None
+
+
+def _backoff(attempt: int) -> float:
+    """
+    A helper definition that returns how long to wait before the next retry,
+    using exponential backoff with full jitter.\n
+    attempt = The number of the attempt that just failed, starting at 0.
+    """
+    return random.uniform(0, min(backoff_cap, backoff_base * 2 ** attempt))
+
+
+# How long, in seconds, a cached response from each endpoint is used before it
+# is revalidated with the server.
+cache_ttls = {"collections": 86400, "collection": 3600, "published": 3600,
+              "summary": 86400}
+
+# The cache of responses. None until enable_cache() is called.
+response_cache = None
+
+
+def enable_cache(max_mb: int = 512, ttls: dict = None):
+    """
+    Start caching API responses under the save location.\n
+    max_mb  = The size, in megabytes, the cache can grow to before the least
+              recently used responses are evicted.\n
+    ttls    = Any TTLs, in seconds, to override in cache_ttls, keyed by the
+              endpoint name.
+    """
+    global response_cache
+
+    if ttls:
+        cache_ttls.update(ttls)
+
+    logger.info(f"Caching responses in \'{save_location}cache/\' up to "+
+                f"{max_mb}MB")
+    response_cache = ResponseCache(save_location + "cache/",
+                                   max_mb * 1024 * 1024, cache_ttls)
+
+
+def get_cache_stats() -> dict:
+    """Return a copy of the cache hit and miss counters."""
+    if response_cache is None:
+        return {}
+
+    with response_cache.lock:
+        return dict(response_cache.stats)
+
+
+def endpoint_of(link: str) -> str:
+    """
+    Return the name of the API endpoint a link is for, used to pick its TTL.\n
+    link    = The full URL of the request.
+    """
+    path = urlsplit(link).path.strip("/").split("/")
+
+    # packages/{packageId}/summary and the other package formats.
+    if path[0] == "packages" and len(path) >= 3:
+        return path[2]
+
+    # collections on its own, or collections/{code}/{dates}.
+    if path[0] == "collections":
+        return "collections" if len(path) == 1 else "collection"
+
+    return path[0]
+
+
+def get_page(link: str, stale_before: float = None) -> bytes:
+    """
+    A helper definition to gather the web page and return it as a bytes stream.
+    Every request waits on the shared rate limiter. Throttling (429), server
+    errors (5xx) and dropped connections are retried up to max_retries times
+    with backoff before the error is raised. If the cache is enabled, fresh
+    responses are served from it and stale ones are revalidated.\n
+    link            = The full URL of the page.\n
+    stale_before    = A time, in seconds since the epoch, that a cached copy
+                      has to have been stored after to be used without
+                      revalidating it, even within its TTL. None to only go by
+                      the TTL.
+    """
+    # Inform the logger that the page is being retrieved.
+    logger.debug(f"Getting page {link}")
+
+    # The endpoint the page is from, used to pick its TTL and to label its
+    # metrics.
+    endpoint = endpoint_of(link)
+
+    # Look the page up in the cache.
+    cached = None
+    if response_cache is not None:
+        cached = response_cache.get(link, endpoint)
+
+    # If it's cached and still fresh, don't go to the server at all.
+    if cached and cached[2] and (stale_before is None or
+                                 cached[1].get("stored_at", 0) >= stale_before):
+        count("cache_hits", endpoint=endpoint)
+        return cached[0]
+
+    # If there's a stale copy, ask the server to only send the page if it has
+    # changed since.
+    headers = {}
+    if cached and cached[1].get("etag"):
+        headers["If-None-Match"] = cached[1]["etag"]
+    if cached and cached[1].get("last_modified"):
+        headers["If-Modified-Since"] = cached[1]["last_modified"]
+
+    parts = urlsplit(link)
+    attempt = 0
+
+    while True:
+        # Wait for the rate limiter to allow the request.
+        wait_for_rate_limit()
+
+        # Get and read the site passed in from the link, timing how long the
+        # server takes.
+        try:
+            count("http_requests", endpoint=endpoint)
+            with timed("http_fetch", endpoint=endpoint):
+                site = open_url(link, headers)
+                response = read_body(site, parts.scheme, parts.netloc)
+            rate_limiter.speed_up()
+            break
+
+        # If the server returned an error, only retry the ones that might go
+        # away on their own.
+        except HTTPError as error:
+            if error.code != 429 and error.code < 500:
+                raise
+
+            if attempt >= max_retries:
+                logger.error(f"Giving up after {attempt} retries. {error}")
+                raise
+
+            # If the server is throttling, slow every thread down and wait as
+            # long as the server asked.
+            if error.code == 429:
+                _count("throttled")
+                rate_limiter.slow_down()
+
+            delay = _retry_after(error)
+            if delay is None:
+                delay = _backoff(attempt)
+
+            # Stop every thread from making requests while backing off.
+            rate_limiter.pause(delay)
+            count("http_retries", endpoint=endpoint, reason=str(error.code))
+            log_sampled(logger, logging.WARNING, f"retry {error.code}",
+                        f"Got {error.code}, retrying in {delay:.1f}s.")
+
+        # If the connection dropped or the read was cut short.
+        except (IncompleteRead, URLError, ConnectionError,
+                TimeoutError) as error:
+            if attempt >= max_retries:
+                logger.error(f"Giving up after {attempt} retries. {error}")
+                raise
+
+            delay = _backoff(attempt)
+            count("http_retries", endpoint=endpoint, reason="connection")
+            log_sampled(logger, logging.WARNING, "retry connection",
+                        f"Need to repull the page, retrying in "+
+                        f"{delay:.1f}s. {error}")
+            time.sleep(delay)
+
+        attempt = attempt + 1
+        _count("retries")
+
+    # If the page hasn't changed, use the cached copy.
+    if site.status == 304 and cached:
+        response_cache.revalidated(link)
+        response = cached[0]
+
+    # Otherwise store the new copy.
+    elif response_cache is not None:
+        response_cache.put(link, response, site.headers)
+
+    # If the API returns the website successfully, but there is no data. The
+    # page is only parsed if it might be the message, since the caller parses
+    # it again anyway.
+    if (b"No results found" in response and
+            json.loads(response).get('message') == "No results found"):
         # Inform the logger that there is no data.
         logger.debug("The page requested is empty")
 
@@ -179,11 +593,13 @@ def get_collection(collection: str, start_date: str, end_date: str = 'none',
     return get_page(site)
 
 
-def get_package_summary(pkgID: str) -> bytes:
+def get_package_summary(pkgID: str, stale_before: float = None) -> bytes:
     """
     Get package summary.\n
-    pkgID   = The specific ID of the item you're looking for,
-              e.g. BILLS-116s3398is
+    pkgID           = The specific ID of the item you're looking for,
+                      e.g. BILLS-116s3398is\n
+    stale_before    = Revalidate a cached copy stored before this time. See
+                      get_page().
     """
     # Build the site URL.  Simple for this one as its only variables are
     # required.
@@ -196,33 +612,25 @@ def get_package_summary(pkgID: str) -> bytes:
     siteTemp = site
     site = site + "?api_key=" + get_API_key()
 
-    return get_page(site)
+    return get_page(site, stale_before)
 
 
-def get_package(pkgID: str, content_type: str):
+def get_package(pkgID: str, content_type: str) -> bool:
     """
-    Get the specific package in the specified format.\n
+    Get the specific package in the specified format. It's streamed to a
+    .part file that is renamed into place once it's complete, resumed if it
+    was cut short, and skipped if it's already there. See
+    download_interface.download_file(). Returns True if the file was
+    downloaded and False if it was already there.\n
     pkgID       = The specific ID of the itme you're looking for,
                   e.g. BILLS-116s3398is.\n
     contentType = The specific format for the content that you're looking for,
                   e.g. pdf, xml, htm, xls, mods, premis, zip.
     """
-    # Build the site URL.  Simple for this one as its only variables are
-    # required.
-    site = site_base + "packages/" + pkgID + "/" + content_type
-
-    # Inform the logger that the site is being accessed.
-    logger.debug(f"Accessing {site}")
-
-    # Append the API key after the logger call so it isn't leaked into the logs.
-    site = site + "?api_key=" + get_API_key()
-
-    # Inform the logger that the file is being downloaded.
-    logger.info(f"Saving to \'{save_location}{pkgID}.{content_type}\'")
+    # Imported here since the download interface is built on this one.
+    from interfaces.download_interface import download_file
 
-    # Download the file with the specified name and type.
-    urllib.request.urlretrieve(
-        site, save_location + pkgID + "." + content_type)
+    return download_file(pkgID, content_type)
 
 
 def get_published(date_issued_start: str, collection: str,
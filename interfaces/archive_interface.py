@@ -0,0 +1,191 @@
+import logging
+from threading import Event, Lock, Thread
+
+from classes.SegmentArchive import SegmentArchive
+from interfaces.api_interface import save_location
+from interfaces.metrics_interface import count, timed
+
+# Create the logger for this module.
+logger = logging.getLogger(__name__)
+
+# Where the archives are kept, and the size each segment can grow to. The
+# archive is off until enable_archive() is called.
+archive_directory = None
+segment_bytes = 64 * 1024 * 1024
+
+# The open archive of each collection, and the lock that guards opening them.
+_archives = {}
+_archives_lock = Lock()
+
+# The background thread that compacts the archives, and the event that stops
+# it.
+_compactor = None
+_stop_compactor = Event()
+
+
+def enable_archive(directory: str = None, max_segment_mb: int = 64):
+    """
+    Keep the raw summary of every package that is pulled, packed into
+    compressed segment files with one archive per collection, so they can be
+    audited and replayed into the database later without the API.\n
+    directory       = Where the archives are kept. Defaults to
+                      content/archive/\n
+    max_segment_mb  = The size, in megabytes, each segment can grow to.
+    """
+    global archive_directory, segment_bytes
+
+    archive_directory = directory or save_location + "archive/"
+    segment_bytes = max_segment_mb * 1024 * 1024
+
+    logger.info(f"Archiving the raw summaries in \'{archive_directory}\'")
+
+
+def get_archive(doc_type: str) -> SegmentArchive:
+    """
+    Return the archive of a collection, opening it the first time. Returns
+    None if archiving isn't turned on.\n
+    doc_type    = The collectionCode. E.g. BILLS
+    """
+    if archive_directory is None:
+        return None
+
+    with _archives_lock:
+        if doc_type not in _archives:
+            _archives[doc_type] = SegmentArchive(
+                f"{archive_directory}{doc_type}/", segment_bytes)
+
+        return _archives[doc_type]
+
+
+def archive_summary(doc_type: str, package_id: str, summary: bytes):
+    """
+    Add a raw summary to its collection's archive. Does nothing if archiving
+    isn't turned on.\n
+    doc_type    = The collectionCode. E.g. BILLS\n
+    package_id  = The packageId of the summary.\n
+    summary     = The summary as it came from the API.
+    """
+    archive = get_archive(doc_type)
+
+    if archive is not None:
+        archive.append(package_id, summary)
+        count("archive_appends", collection=doc_type)
+
+
+def replay_archive(doc_type: str, write_batch=None,
+                   batch_size: int = 500) -> int:
+    """
+    Write every summary in a collection's archive to the database, in the
+    order they were archived, without touching the API. Only the newest copy
+    of each package is replayed. By default the batches go through the
+    collection's upsert, so packages whose fingerprint hasn't changed aren't
+    written again. Returns the number of summaries replayed.\n
+    doc_type    = The collectionCode. E.g. BILLS\n
+    write_batch = A function that takes a list of summaries and writes them,
+                  or None to use the collection's upsert.\n
+    batch_size  = The number of summaries written at once.
+    """
+    if write_batch is None:
+        # Imported here so reading the archive doesn't need a database.
+        from interfaces.collection_registry import upsert_batch
+
+        def write_batch(summaries: list):
+            upsert_batch(doc_type, summaries, batch_size)
+
+    archive = get_archive(doc_type)
+    if archive is None:
+        raise ValueError("Archiving is not turned on. Call enable_archive() "+
+                         "first.")
+
+    logger.info(f"{doc_type}: Replaying the archive")
+
+    pending = []
+    replayed = 0
+
+    for _, summary in archive.replay():
+        pending.append(summary)
+
+        if len(pending) >= batch_size:
+            with timed("archive_replay", collection=doc_type):
+                write_batch(pending)
+            replayed = replayed + len(pending)
+            pending = []
+
+    if pending:
+        with timed("archive_replay", collection=doc_type):
+            write_batch(pending)
+        replayed = replayed + len(pending)
+
+    logger.info(f"{doc_type}: Replayed {replayed} summaries from the archive")
+
+    return replayed
+
+
+def compact_archives(min_live: float = 0.5) -> int:
+    """
+    Compact every open archive. See SegmentArchive.compact(). Returns the
+    number of bytes freed.\n
+    min_live    = The fraction of a segment that has to be live for it to be
+                  left alone.
+    """
+    with _archives_lock:
+        archives = dict(_archives)
+
+    freed = 0
+    for doc_type, archive in archives.items():
+        with timed("archive_compaction", collection=doc_type):
+            reclaimed = archive.compact(min_live)
+        if reclaimed:
+            logger.info(f"{doc_type}: Compacted the archive, freeing "+
+                        f"{reclaimed} bytes")
+        freed = freed + reclaimed
+
+    return freed
+
+
+def _compact(interval: float, min_live: float):
+    """
+    A helper function that runs on the compactor thread, compacting the
+    archives every interval seconds until stop_compactor() is called.\n
+    interval    = The number of seconds between compactions.\n
+    min_live    = See compact_archives().
+    """
+    while not _stop_compactor.wait(interval):
+        try:
+            compact_archives(min_live)
+
+        # A failed compaction leaves the archive as it was, so keep going.
+        except OSError as err:
+            logger.error(f"Compacting the archives failed. {err}")
+
+
+def start_compactor(interval: float = 600, min_live: float = 0.5):
+    """
+    Compact the archives in the background every interval seconds.\n
+    interval    = The number of seconds between compactions.\n
+    min_live    = See compact_archives().
+    """
+    global _compactor
+
+    _stop_compactor.clear()
+    _compactor = Thread(target=_compact, args=(interval, min_live),
+                        daemon=True)
+    _compactor.start()
+
+
+def stop_compactor():
+    """Stop the background compactor, waiting for it to finish."""
+    global _compactor
+
+    _stop_compactor.set()
+    if _compactor is not None:
+        _compactor.join()
+        _compactor = None
+
+
+def close_archives():
+    """Write the index of every open archive and close it."""
+    with _archives_lock:
+        for archive in _archives.values():
+            archive.close()
+        _archives.clear()
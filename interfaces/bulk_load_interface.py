@@ -0,0 +1,211 @@
+import json
+import logging
+import os
+
+from interfaces.api_interface import save_location
+from interfaces.metrics_interface import count, timed
+from interfaces.sql_interface import build_merge_sql, get_credentials
+
+# Create the logger for this module.
+logger = logging.getLogger(__name__)
+
+# How the characters that would break up a line of the staging file are
+# written, the same way MySQL's LOAD DATA reads them back with its default
+# escape character.
+_escapes = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n",
+                          "\r": "\\r", "\0": "\\0"})
+
+
+def tsv_value(value) -> str:
+    """
+    Write one value the way LOAD DATA expects it in a tab separated file.
+    None is written as \\N so it's loaded as NULL, booleans as 1 or 0, and
+    datetimes as YYYY-MM-DD HH:MM:SS.\n
+    value   = The value from a row, as built by the Record class.
+    """
+    if value is None:
+        return "\\N"
+
+    if type(value) is str:
+        return value.translate(_escapes)
+
+    if type(value) is bool:
+        return "1" if value else "0"
+
+    return str(value).translate(_escapes)
+
+
+def build_load_sql(table: str, columns: tuple) -> str:
+    """
+    Create the statement that loads a staging file into a table. The file name
+    is passed as the parameter.\n
+    table   = The name of the table.\n
+    columns = The columns in the order they are written in the file.
+    """
+    return (f"LOAD DATA LOCAL INFILE %s INTO TABLE {table} "+
+            "CHARACTER SET utf8mb4 FIELDS TERMINATED BY '\\t' "+
+            "ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' "+
+            f"({','.join(columns)})")
+
+
+class BulkLoader:
+    """
+    Loads a large number of summaries into a table much faster than INSERTs,
+    for the first load of a whole collection. The rows are written to tab
+    separated files as they come in, loaded into staging tables with
+    LOAD DATA LOCAL INFILE, and then merged into the real tables so a row is
+    only replaced if the new copy was modified more recently. The child rows
+    of every package that was added or replaced are swapped in along with it.
+    The server has to allow local_infile.\n
+    table           = The name of the table. E.g. bills\n
+    record_class    = The Record class of the collection. E.g. Bills\n
+    child_builder   = The function that builds the rows of the table's child
+                      tables, or None if it doesn't have any.\n
+    child_columns   = The columns of each child table, keyed by its name.\n
+    directory       = Where the staging files are written.
+    """
+    def __init__(self, table: str, record_class, child_builder=None,
+                 child_columns: dict = None, directory: str = None):
+        self.table = table
+        self.record_class = record_class
+        self.child_builder = child_builder
+        self.child_columns = child_columns or {}
+        self.directory = directory or save_location + "staging/"
+        self.rows = 0
+
+        # Open one file for the table and one for each of its child tables.
+        os.makedirs(self.directory, exist_ok=True)
+        self.paths = {name: os.path.abspath(os.path.join(
+                          self.directory, f"{name}.tsv"))
+                      for name in [table] + list(self.child_columns)}
+        self.files = {name: open(path, 'wt', encoding="utf-8", newline="")
+                      for name, path in self.paths.items()}
+
+    def add(self, digests: list):
+        """
+        Parse some summaries and write their rows to the staging files.\n
+        digests = A list of documents in a bytes format as they are directly
+                  from the web page.
+        """
+        table_file = self.files[self.table]
+        row_from_digest = self.record_class.row_from_digest
+
+        for digest in digests:
+            with timed("json_parse", endpoint="summary"):
+                summary = json.loads(digest)
+
+            table_file.write("\t".join(map(tsv_value,
+                                           row_from_digest(summary))) + "\n")
+
+            if self.child_builder:
+                for name, rows in self.child_builder(summary).items():
+                    self.files[name].writelines(
+                        "\t".join(map(tsv_value, row)) + "\n"
+                        for row in rows)
+
+        self.rows = self.rows + len(digests)
+
+    def load(self) -> int:
+        """
+        Load the staging files and merge them into the real tables, then
+        remove the files and the staging tables. Returns the number of rows
+        MySQL reports as affected by the merge.
+        """
+        if not self.rows:
+            self.discard()
+            return 0
+
+        for staged in self.files.values():
+            staged.close()
+
+        logger.info(f"Bulk loading {self.rows} rows into {self.table}")
+
+        tables = {self.table: self.record_class.COLUMNS}
+        tables.update(self.child_columns)
+        changed = f"{self.table}_changed"
+
+        # LOAD DATA LOCAL has to be turned on for the connection, so this
+        # doesn't use the pool.
+        mydb = get_credentials(allow_local_infile=True)
+        cursor = mydb.cursor()
+
+        try:
+            # Load every file into an empty copy of its table.
+            with timed("db_bulk_load", table=self.table):
+                for name, columns in tables.items():
+                    cursor.execute(f"DROP TABLE IF EXISTS {name}_staging")
+                    cursor.execute(f"CREATE TABLE {name}_staging LIKE {name}")
+                    cursor.execute(build_load_sql(f"{name}_staging", columns),
+                                   (self.paths[name],))
+                mydb.commit()
+
+            with timed("db_merge", table=self.table):
+                # Find the packages that are new, or newer than the copy in the
+                # table with a different fingerprint. A stored copy without a
+                # lastModified counts as older, the same as in the upsert.
+                # Nothing else is touched.
+                cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS {changed}")
+                cursor.execute(
+                    f"CREATE TEMPORARY TABLE {changed} "+
+                    "(packageId varchar(100) NOT NULL PRIMARY KEY) "+
+                    f"SELECT s.packageId FROM {self.table}_staging s "+
+                    f"LEFT JOIN {self.table} t ON t.packageId=s.packageId "+
+                    "WHERE t.packageId IS NULL OR "+
+                    "(s.lastModified IS NOT NULL AND "+
+                    "(t.lastModified IS NULL OR "+
+                    "s.lastModified>t.lastModified) AND "+
+                    "NOT s.fingerprint<=>t.fingerprint)")
+
+                # Those are the rows that are actually written.
+                cursor.execute(f"SELECT COUNT(*) FROM {changed}")
+                written = cursor.fetchone()[0]
+
+                # Merge those rows, only replacing the ones that are older.
+                cursor.execute(build_merge_sql(self.table,
+                                               f"{self.table}_staging",
+                                               self.record_class.COLUMNS,
+                                               changed))
+                affected = cursor.rowcount
+
+                # Swap in the child rows of the packages that changed.
+                for name, columns in self.child_columns.items():
+                    selected = ",".join(f"s.{column}" for column in columns)
+                    cursor.execute(f"DELETE c FROM {name} c JOIN {changed} "+
+                                   "USING (packageId)")
+                    cursor.execute(f"INSERT INTO {name} ({','.join(columns)})"+
+                                   f" SELECT {selected} FROM {name}_staging s"+
+                                   f" JOIN {changed} ch "+
+                                   "ON ch.packageId=s.packageId")
+                mydb.commit()
+
+        except Exception:
+            mydb.rollback()
+            raise
+
+        finally:
+            # Clean up the staging tables whether or not it worked. The files
+            # are left behind if it failed so the load can be looked at.
+            for name in tables:
+                cursor.execute(f"DROP TABLE IF EXISTS {name}_staging")
+            cursor.close()
+            mydb.close()
+
+        count("db_rows_written", written, table=self.table)
+        logger.info(f"Merged {written} of {self.rows} rows into "+
+                    f"{self.table}, {affected} rows affected")
+        self._remove_files()
+
+        return affected
+
+    def discard(self):
+        """Close and delete the staging files without loading anything."""
+        for staged in self.files.values():
+            staged.close()
+
+        self._remove_files()
+
+    def _remove_files(self):
+        """Delete the staging files."""
+        for path in self.paths.values():
+            if os.path.isfile(path):
+                os.remove(path)
@@ -0,0 +1,135 @@
+import json
+import logging
+import sqlite3
+
+# Create the logger for this module.
+logger = logging.getLogger(__name__)
+
+
+class Checkpoint:
+    """
+    A journal of the progress of one collection's run. The journal is a local
+    SQLite database that records how far the enumeration got, every packageId
+    it found, and every package that has been finished. Each collection has its
+    own journal, used only by the thread running that collection.
+    """
+    def __init__(self, path: str, flush_every: int = 1000):
+        """
+        Open the checkpoint journal, creating it if it doesn't exist.\n
+        path        = The location of the journal file.\n
+        flush_every = How many finished packages are held in memory before
+                      they're written to the journal.
+        """
+        # Inform the logger of where the journal is.
+        logger.info(f"Opening the checkpoint journal \'{path}\'")
+
+        self.flush_every = flush_every
+
+        # The packageId's that have been finished but not yet written.
+        self.pending_done = []
+
+        self.journal = sqlite3.connect(path)
+
+        # Write ahead logging keeps the writes cheap, and losing the last few
+        # records in a power cut only means redoing a few packages.
+        self.journal.execute("PRAGMA journal_mode=WAL")
+        self.journal.execute("PRAGMA synchronous=NORMAL")
+
+        # Create the tables if this is a new journal.
+        self.journal.execute("CREATE TABLE IF NOT EXISTS cursors "+
+                             "(name TEXT PRIMARY KEY, value TEXT)")
+        self.journal.execute("CREATE TABLE IF NOT EXISTS docs "+
+                             "(seq INTEGER PRIMARY KEY, packageId TEXT UNIQUE)")
+        self.journal.execute("CREATE TABLE IF NOT EXISTS done "+
+                             "(packageId TEXT PRIMARY KEY)")
+        self.journal.commit()
+
+    def get_cursor(self, name: str):
+        """
+        Return the value saved under a name, or None if there isn't one.\n
+        name    = The name of the cursor. E.g. enumeration
+        """
+        row = self.journal.execute("SELECT value FROM cursors WHERE name=?",
+                                   (name,)).fetchone()
+
+        return json.loads(row[0]) if row else None
+
+    def save_cursor(self, name: str, value):
+        """
+        Save a value under a name, replacing the old one.\n
+        name    = The name of the cursor. E.g. enumeration\n
+        value   = Anything that can be written as JSON.
+        """
+        with self.journal:
+            self.journal.execute("INSERT OR REPLACE INTO cursors VALUES (?,?)",
+                                 (name, json.dumps(value)))
+
+    def save_enumeration(self, items: list, name: str, value):
+        """
+        Record a batch of enumerated packageId's and the cursor that says where
+        the enumeration will continue from, in one transaction so they always
+        match.\n
+        items   = The packageId's found in the batch.\n
+        name    = The name of the cursor.\n
+        value   = The cursor to continue from.
+        """
+        with self.journal:
+            self.journal.executemany("INSERT OR IGNORE INTO docs (packageId) "+
+                                     "VALUES (?)", ((item,) for item in items))
+            self.journal.execute("INSERT OR REPLACE INTO cursors VALUES (?,?)",
+                                 (name, json.dumps(value)))
+
+    def get_enumerated(self) -> list:
+        """Return every packageId recorded so far in the order it was found."""
+        return [row[0] for row in
+                self.journal.execute("SELECT packageId FROM docs ORDER BY seq")]
+
+    def get_remaining(self) -> list:
+        """
+        Return the packageId's that have been enumerated but not finished, in
+        the order they were found.
+        """
+        self.flush()
+
+        return [row[0] for row in self.journal.execute(
+            "SELECT packageId FROM docs WHERE packageId NOT IN "+
+            "(SELECT packageId FROM done) ORDER BY seq")]
+
+    def mark_done(self, items: list):
+        """
+        Record that packages have been finished. The records are held in memory
+        and written together once flush_every of them have built up.\n
+        items   = The packageId's that were finished.
+        """
+        self.pending_done.extend(items)
+
+        if len(self.pending_done) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        """Write any finished packages that are still held in memory."""
+        if not self.pending_done:
+            return
+
+        with self.journal:
+            self.journal.executemany("INSERT OR IGNORE INTO done VALUES (?)",
+                                     ((item,) for item in self.pending_done))
+
+        logger.debug(f"Checkpointed {len(self.pending_done)} finished packages")
+        self.pending_done.clear()
+
+    def clear(self):
+        """Empty the journal once a run has finished successfully."""
+        self.pending_done.clear()
+
+        with self.journal:
+            self.journal.execute("DELETE FROM cursors")
+            self.journal.execute("DELETE FROM docs")
+            self.journal.execute("DELETE FROM done")
+
+        logger.info("Run finished, cleared the checkpoint journal")
+
+    def close(self):
+        """Write anything still held in memory and close the journal."""
+        self.flush()
+        self.journal.close()
@@ -0,0 +1,94 @@
+from classes.Bills import Bills
+from classes.Packages import Packages
+from interfaces.storage_interface import get_backend
+
+# Every collection that can be synced, keyed by its collectionCode. Each entry
+# has the Record class that holds its summaries, the table they go in, and the
+# function that builds the rows of its child tables along with their columns,
+# if it has any.
+collection_registry = {}
+
+
+def register_collection(code: str, record_class, table: str,
+                        child_builder=None, child_tables: dict = None):
+    """
+    Add a collection to the registry, replacing it if it's already there.\n
+    code            = The collectionCode. E.g. BILLS\n
+    record_class    = The Record class that holds its summaries.\n
+    table           = The table the summaries are inserted into.\n
+    child_builder   = The function that builds the rows of the table's child
+                      tables. Not necessary to run.\n
+    child_tables    = The columns of each of the child tables, keyed by the
+                      name of the table. Needed with child_builder.
+    """
+    collection_registry[code] = {"record_class": record_class, "table": table,
+                                 "child_builder": child_builder,
+                                 "child_tables": child_tables}
+
+
+def get_registered(code: str) -> dict:
+    """
+    Return the registry entry of a collection.\n
+    code    = The collectionCode. E.g. BILLS
+    """
+    if code not in collection_registry:
+        raise ValueError(f"{code} is not a registered collection. Known "+
+                         f"collections are {sorted(collection_registry)}")
+
+    return collection_registry[code]
+
+
+def insert_batch(code: str, digests: list, chunk_size: int = 500) -> list:
+    """
+    Insert many summaries of a collection into its table with the storage
+    backend in use. See StorageBackend.insert_batch().\n
+    code        = The collectionCode. E.g. BILLS\n
+    digests     = A list of documents in a bytes format as they are directly
+                  from the web page.\n
+    chunk_size  = The number of rows to write in each transaction.
+    """
+    entry = get_registered(code)
+
+    return get_backend().insert_batch(digests, entry["table"],
+                                      entry["record_class"], chunk_size,
+                                      entry["child_builder"])
+
+
+def upsert_batch(code: str, digests: list, chunk_size: int = 500) -> int:
+    """
+    Insert or update many summaries of a collection in its table with the
+    storage backend in use. See StorageBackend.upsert_batch().\n
+    code        = The collectionCode. E.g. BILLS\n
+    digests     = A list of documents in a bytes format as they are directly
+                  from the web page.\n
+    chunk_size  = The number of rows to write in each transaction.
+    """
+    entry = get_registered(code)
+
+    return get_backend().upsert_batch(digests, entry["table"],
+                                      entry["record_class"], chunk_size,
+                                      entry["child_builder"])
+
+
+def bulk_loader(code: str):
+    """
+    Create a BulkLoader for the first load of a whole collection. Only works
+    with MySQL. See interfaces/bulk_load_interface.py.\n
+    code    = The collectionCode. E.g. BILLS
+    """
+    from interfaces.bulk_load_interface import BulkLoader
+
+    entry = get_registered(code)
+
+    return BulkLoader(entry["table"], entry["record_class"],
+                      entry["child_builder"], entry["child_tables"])
+
+
+# The collections that are supported out of the box. Their MySQL tables are
+# created by the files in helpers/, and the SQLite backend creates its own.
+register_collection("BILLS", Bills, "bills", Bills.child_rows,
+                    Bills.CHILD_TABLES)
+register_collection("CREC", Packages, "crec")
+register_collection("FR", Packages, "fr")
+register_collection("CFR", Packages, "cfr")
+register_collection("PLAW", Packages, "plaw")
@@ -0,0 +1,276 @@
+import hashlib
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from http.client import HTTPException, IncompleteRead
+from threading import Lock
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlsplit
+
+import interfaces.api_interface as api_interface
+from interfaces.api_interface import (
+    _backoff, _drop_connection, get_API_key, open_url, read_body,
+    save_location, wait_for_rate_limit)
+from interfaces.metrics_interface import count, log_sampled
+
+# Create the logger for this module.
+logger = logging.getLogger(__name__)
+
+# The number of bytes read from the connection and written to disk at a time.
+chunk_size = 1024 * 1024
+
+# How often, in seconds, the combined throughput is reported while downloading.
+report_every = 30
+
+# Counters for the whole bulk download and the lock that guards them.
+download_stats = {"files": 0, "skipped": 0, "resumed": 0, "failed": 0,
+                  "bytes": 0}
+_stats_lock = Lock()
+
+
+def _count(stat: str, amount: int = 1):
+    """
+    A helper definition to add to one of the download_stats counters.\n
+    stat    = The name of the counter.\n
+    amount  = How much to add to it.
+    """
+    with _stats_lock:
+        download_stats[stat] = download_stats[stat] + amount
+
+
+def _sha256(path: str) -> str:
+    """
+    A helper definition that returns the SHA-256 of a file without reading it
+    all into memory.\n
+    path    = The location of the file.
+    """
+    digest = hashlib.sha256()
+
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def _with_retries(action, site: str, path: str, content_type: str):
+    """
+    A helper definition that waits for the rate limiter and runs a request,
+    retrying the errors that might go away on their own with backoff, the same
+    as get_page(). Returns whatever the request returns.\n
+    action          = A function that makes the request.\n
+    site            = The full URL being requested.\n
+    path            = Where the file is saved, for the logs.\n
+    content_type    = The format of the file, used to label the metrics.
+    """
+    parts = urlsplit(site)
+    attempt = 0
+
+    while True:
+        wait_for_rate_limit()
+
+        try:
+            return action()
+
+        # Retry errors that might go away on their own.
+        except (HTTPError, IncompleteRead, URLError, ConnectionError,
+                TimeoutError) as error:
+            _drop_connection(parts.scheme, parts.netloc)
+
+            retryable = (not isinstance(error, HTTPError) or
+                         error.code == 429 or error.code >= 500)
+            if not retryable or attempt >= api_interface.max_retries:
+                raise
+
+            delay = _backoff(attempt)
+            count("http_retries", endpoint=content_type, reason=str(
+                getattr(error, "code", "connection")))
+            log_sampled(logger, logging.WARNING, "download retry",
+                        f"Request for \'{path}\' failed, retrying in "+
+                        f"{delay:.1f}s. {error}")
+            time.sleep(delay)
+            attempt = attempt + 1
+
+
+def _is_complete(link: str, path: str, content_type: str,
+                 checksum: str = None) -> bool:
+    """
+    A helper definition that checks whether a file has already been
+    downloaded. If a checksum is known the file has to match it, otherwise its
+    size has to match the Content-Length the server reports.\n
+    link            = The full URL of the file.\n
+    path            = Where the file is saved.\n
+    content_type    = The format of the file, used to label the metrics.\n
+    checksum        = The expected SHA-256 of the file, if it's known.
+    """
+    if not os.path.isfile(path):
+        return False
+
+    if checksum:
+        return _sha256(path) == checksum
+
+    def head() -> str:
+        """Ask the server for the size without downloading the body."""
+        parts = urlsplit(link)
+        response = open_url(link, {"Accept-Encoding": "identity"}, "HEAD")
+        read_body(response, parts.scheme, parts.netloc)
+        return response.getheader("Content-Length")
+
+    length = _with_retries(head, link, path, content_type)
+
+    return length is not None and int(length) == os.path.getsize(path)
+
+
+def download_file(pkgID: str, content_type: str, checksum: str = None) -> bool:
+    """
+    Download one package in one format. The body is streamed in chunks to a
+    .part file that is renamed into place once it's complete, so a half
+    finished file never has the real name. If a .part file is left over from
+    an earlier attempt, only the rest of it is requested. Returns True if the
+    file was downloaded and False if it was already there.\n
+    pkgID           = The specific ID of the item you're looking for,
+                      e.g. BILLS-116s3398is.\n
+    content_type    = The specific format for the content that you're looking
+                      for, e.g. pdf, xml, htm, xls, mods, premis, zip.\n
+    checksum        = The expected SHA-256 of the file, if it's known.
+    """
+    # Build the site URL and where the file will be saved.
+    site = api_interface.site_base + "packages/" + pkgID + "/" + content_type
+    path = save_location + pkgID + "." + content_type
+    part_path = path + ".part"
+
+    # Inform the logger that the site is being accessed.
+    logger.debug(f"Accessing {site}")
+
+    # Append the API key after the logger call so it isn't leaked into the logs.
+    site = site + "?api_key=" + get_API_key()
+
+    # If the file is already there, don't download it again.
+    if _is_complete(site, path, content_type, checksum):
+        logger.debug(f"\'{path}\' is already downloaded, skipping.")
+        _count("skipped")
+        return False
+
+    def download():
+        """
+        Download whatever isn't in the .part file yet. What was already
+        written stays there and is resumed if this has to be tried again.
+        """
+        # Work out how much of the file is already on disk.
+        have = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+        headers = {"Accept-Encoding": "identity"}
+        if have:
+            headers["Range"] = f"bytes={have}-"
+
+        try:
+            response = open_url(site, headers)
+
+        # If the server says the range is past the end, the .part file is
+        # already the whole file.
+        except HTTPError as error:
+            if error.code != 416 or not have:
+                raise
+            return
+
+        # A 206 means the server is sending the rest of the file. Anything
+        # else means it's sending the whole thing, so start over.
+        if response.status == 206:
+            logger.debug(f"Resuming \'{path}\' from byte {have}")
+            _count("resumed")
+            mode = 'ab'
+        else:
+            mode = 'wb'
+
+        with open(part_path, mode) as file:
+            while True:
+                chunk = response.read(chunk_size)
+                if not chunk:
+                    break
+                file.write(chunk)
+                _count("bytes", len(chunk))
+
+    _with_retries(download, site, path, content_type)
+
+    # Make sure the download matches the checksum before giving it the real
+    # name.
+    if checksum and _sha256(part_path) != checksum:
+        os.remove(part_path)
+        raise ValueError(f"\'{path}\' does not match its checksum")
+
+    # Give the file its real name in one step.
+    os.replace(part_path, path)
+    log_sampled(logger, logging.INFO, "saved", f"Saved \'{path}\'")
+    _count("files")
+
+    return True
+
+
+def download_packages(packages: list, max_workers: int = 4,
+                      checksums: dict = None) -> list:
+    """
+    Download many packages at once. Each one is streamed to disk, resumed if
+    a partial download exists, and skipped if it's already complete. The
+    combined throughput is logged every report_every seconds. Returns the
+    (pkgID, content_type) pairs that could not be downloaded.\n
+    packages    = A list of (pkgID, content_type) pairs.\n
+    max_workers = The maximum number of files being downloaded at once.\n
+    checksums   = An optional dictionary of the expected SHA-256 of each file,
+                  keyed by its (pkgID, content_type) pair.
+    """
+    checksums = checksums or {}
+
+    # A list of the packages that could not be downloaded.
+    failed = []
+
+    # Make sure the save location exists.
+    os.makedirs(save_location, exist_ok=True)
+
+    # Inform the logger of the size of the job.
+    logger.info(f"Downloading {len(packages)} files with {max_workers} "+
+                "workers")
+
+    start = time.monotonic()
+    start_bytes = download_stats["bytes"]
+    last_report = start
+    last_bytes = start_bytes
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(download_file, pkgID, content_type,
+                                   checksums.get((pkgID, content_type))):
+                   (pkgID, content_type)
+                   for pkgID, content_type in packages}
+
+        # Wait for the downloads, reporting the throughput as they go.
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=report_every,
+                                 return_when=FIRST_COMPLETED)
+
+            for future in done:
+                try:
+                    future.result()
+
+                except (HTTPException, HTTPError, URLError, OSError,
+                        ValueError) as error:
+                    logger.critical(f"{futures[future]} could not be "+
+                                    f"downloaded. {error}")
+                    _count("failed")
+                    failed.append(futures[future])
+
+            now = time.monotonic()
+            if now - last_report >= report_every:
+                rate = (download_stats["bytes"] - last_bytes) / (
+                    now - last_report)
+                logger.info(f"Downloading at {rate / 1048576:.2f}MB/s, "+
+                            f"{len(pending)} files left")
+                last_report = now
+                last_bytes = download_stats["bytes"]
+
+    # Report the overall results.
+    elapsed = max(time.monotonic() - start, 0.001)
+    rate = (download_stats["bytes"] - start_bytes) / elapsed
+    logger.info(f"Downloads finished in {elapsed:.1f}s at "+
+                f"{rate / 1048576:.2f}MB/s. {download_stats}")
+
+    return failed
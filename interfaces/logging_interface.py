@@ -0,0 +1,87 @@
+import atexit
+import logging
+import os
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from queue import SimpleQueue
+
+from classes.JsonFormatter import JsonFormatter
+
+# The format of each line when the log is written as plain text.
+text_format = ('%(asctime)s; %(levelname)s; %(name)s; %(funcName)s; '+
+               '%(message)s')
+
+# The handler every logger hands its records to and the listener that writes
+# them out on its own thread. None until setup_logging() is called.
+_queue_handler = None
+_listener = None
+
+
+def setup_logging(path: str = "Bill_The.log", level: str = "INFO",
+                  levels: dict = None, max_mb: int = 10, backups: int = 5,
+                  json_lines: bool = False):
+    """
+    Send every log record to a queue that is written to a rotating file on a
+    background thread, so logging never blocks the threads doing the work.
+    The last run's log is rotated out when this is called instead of being
+    overwritten. Calling it again replaces the earlier setup.\n
+    path        = The file to log to.\n
+    level       = The level for everything that isn't in levels. E.g. INFO\n
+    levels      = The levels of specific modules, keyed by the name of the
+                  logger. E.g. {"interfaces.sql_interface": "DEBUG"}\n
+    max_mb      = The size, in megabytes, the file can reach before it is
+                  rotated.\n
+    backups     = The number of rotated files to keep.\n
+    json_lines  = Whether to write each record as a line of JSON instead of
+                  plain text.
+    """
+    global _queue_handler, _listener
+
+    # Stop whatever was set up before.
+    shutdown_logging()
+
+    # Write to the file. The last run's log is rotated out of the way so each
+    # run starts a new file without losing the old one.
+    handler = RotatingFileHandler(path, maxBytes=max_mb * 1024 * 1024,
+                                  backupCount=backups, delay=True)
+    if backups and os.path.isfile(path) and os.path.getsize(path):
+        handler.doRollover()
+    handler.setFormatter(JsonFormatter() if json_lines else
+                         logging.Formatter(text_format))
+
+    # Every logger passes its records up to the root, which puts them on the
+    # queue without formatting or writing anything on the calling thread.
+    queue = SimpleQueue()
+    _queue_handler = QueueHandler(queue)
+    root = logging.getLogger()
+    root.addHandler(_queue_handler)
+    root.setLevel(level)
+
+    # Set the levels of the modules that need their own.
+    for name, module_level in (levels or {}).items():
+        logging.getLogger(name).setLevel(module_level)
+
+    # Write the records out on the listener's thread.
+    _listener = QueueListener(queue, handler)
+    _listener.start()
+
+
+def shutdown_logging():
+    """
+    Write out everything still on the queue, stop the listener and close the
+    file. Called automatically when the program exits.
+    """
+    global _queue_handler, _listener
+
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+    if _queue_handler is not None:
+        logging.getLogger().removeHandler(_queue_handler)
+        _queue_handler = None
+
+
+# Make sure the queue is written out even if the caller forgets.
+atexit.register(shutdown_logging)
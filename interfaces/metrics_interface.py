@@ -0,0 +1,283 @@
+import logging
+import math
+import os
+import time
+from contextlib import contextmanager
+from threading import Event, Lock, Thread
+
+from classes.Histogram import Histogram
+
+# Every exported metric name starts with this.
+metric_prefix = "billme"
+
+# The counters and the latency histograms, keyed by the name of the metric and
+# its sorted labels, and the lock that guards them since they're updated from
+# every worker thread.
+_counters = {}
+_histograms = {}
+_metrics_lock = Lock()
+
+# The minimum number of seconds between two messages logged with the same key
+# by log_sampled(), and when each key was last logged along with how many
+# messages were dropped since.
+log_interval = 10.0
+_log_state = {}
+
+# The background thread that reports the metrics and the event that stops it.
+_reporter = None
+_stop_reporter = Event()
+
+
+def _key(name: str, labels: dict) -> tuple:
+    """
+    A helper definition that turns a metric name and its labels into the key
+    it is stored under.\n
+    name    = The name of the metric. E.g. http_fetch\n
+    labels  = The labels of the metric. E.g. {"endpoint": "summary"}
+    """
+    return (name, tuple(sorted(labels.items())))
+
+
+def count(name: str, amount: int = 1, **labels):
+    """
+    Add to a counter.\n
+    name    = The name of the counter. E.g. http_retries\n
+    amount  = How much to add to it.\n
+    labels  = Any labels to tell the counters apart. E.g. endpoint="summary"
+    """
+    key = _key(name, labels)
+
+    with _metrics_lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def observe(name: str, seconds: float, **labels):
+    """
+    Record how long something took.\n
+    name    = The name of the histogram. E.g. db_insert\n
+    seconds = How long it took.\n
+    labels  = Any labels to tell the histograms apart. E.g. table="bills"
+    """
+    key = _key(name, labels)
+
+    with _metrics_lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram()
+        histogram.observe(seconds)
+
+
+@contextmanager
+def timed(name: str, **labels):
+    """
+    Time the body of a with statement and record it in a histogram, whether
+    or not it raises.\n
+    name    = The name of the histogram. E.g. http_fetch\n
+    labels  = Any labels to tell the histograms apart. E.g. endpoint="summary"
+    """
+    start = time.perf_counter()
+
+    try:
+        yield
+
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def _format_name(name: str, labels: tuple, extra: tuple = ()) -> str:
+    """
+    A helper definition that formats a metric the way Prometheus does, e.g.
+    http_fetch{endpoint="summary"}.\n
+    name    = The name of the metric.\n
+    labels  = The sorted (label, value) pairs.\n
+    extra   = Any more pairs to add at the end, like the bucket bound.
+    """
+    pairs = labels + extra
+    if not pairs:
+        return name
+
+    return name + "{" + ",".join(f'{label}="{value}"'
+                                 for label, value in pairs) + "}"
+
+
+def get_metrics() -> dict:
+    """
+    Return a copy of every counter and a summary of every histogram, keyed by
+    the formatted name of the metric.
+    """
+    with _metrics_lock:
+        counters = {_format_name(name, labels): value
+                    for (name, labels), value in _counters.items()}
+        histograms = {_format_name(name, labels): {
+            "count": histogram.count,
+            "sum": round(histogram.sum, 6),
+            "mean": round(histogram.sum / histogram.count, 6),
+            "p50": round(histogram.quantile(0.5), 6),
+            "p95": round(histogram.quantile(0.95), 6),
+            "max": round(histogram.max, 6)}
+            for (name, labels), histogram in _histograms.items()
+            if histogram.count}
+
+    return {"counters": counters, "histograms": histograms}
+
+
+def reset_metrics():
+    """Clear every counter and histogram."""
+    with _metrics_lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def format_summary() -> str:
+    """
+    Return the metrics as a short block of text for the log, one line per
+    metric.
+    """
+    metrics = get_metrics()
+    lines = []
+
+    for name, value in sorted(metrics["counters"].items()):
+        lines.append(f"{name} = {value}")
+
+    for name, summary in sorted(metrics["histograms"].items()):
+        lines.append(f"{name} count={summary['count']} "+
+                     f"mean={summary['mean'] * 1000:.2f}ms "+
+                     f"p50<={summary['p50'] * 1000:.0f}ms "+
+                     f"p95<={summary['p95'] * 1000:.0f}ms "+
+                     f"max={summary['max'] * 1000:.2f}ms")
+
+    return "\n".join(lines)
+
+
+def to_prometheus() -> str:
+    """
+    Return the metrics in the Prometheus text format. Counters are exported as
+    <prefix>_<name>_total and histograms as <prefix>_<name>_seconds. Each
+    metric's samples come after a # TYPE line saying which it is.
+    """
+    lines = []
+
+    with _metrics_lock:
+        # The samples are sorted by name, so every sample of a metric is
+        # together and the # TYPE line only has to be written when the name
+        # changes.
+        last_name = None
+        for (name, labels), value in sorted(_counters.items()):
+            full_name = f"{metric_prefix}_{name}_total"
+            if full_name != last_name:
+                lines.append(f"# TYPE {full_name} counter")
+                last_name = full_name
+            lines.append(f"{_format_name(full_name, labels)} {value}")
+
+        for (name, labels), histogram in sorted(_histograms.items()):
+            full_name = f"{metric_prefix}_{name}_seconds"
+            if full_name != last_name:
+                lines.append(f"# TYPE {full_name} histogram")
+                last_name = full_name
+            for bound, seen in histogram.cumulative():
+                bound = "+Inf" if math.isinf(bound) else repr(bound)
+                lines.append(_format_name(full_name + "_bucket", labels,
+                                          (("le", bound),)) + f" {seen}")
+            lines.append(f"{_format_name(full_name + '_sum', labels)} "+
+                         f"{histogram.sum}")
+            lines.append(f"{_format_name(full_name + '_count', labels)} "+
+                         f"{histogram.count}")
+
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path: str):
+    """
+    Write the metrics to a file in the Prometheus text format, e.g. for the
+    node exporter's textfile collector. The file is replaced in one step so a
+    scrape never sees half of it.\n
+    path    = Where to write the file.
+    """
+    temp_path = path + ".tmp"
+
+    with open(temp_path, 'wt') as metrics_file:
+        metrics_file.write(to_prometheus())
+
+    os.replace(temp_path, path)
+
+
+def log_sampled(logger: logging.Logger, level: int, key: str, message: str):
+    """
+    Log a message unless another with the same key was logged in the last
+    log_interval seconds. Used for the messages that are logged once per
+    package so they don't slow down a large run. The next message that does
+    get logged says how many were dropped.\n
+    logger  = The logger to log to.\n
+    level   = The level to log at. E.g. logging.INFO\n
+    key     = What the message is about. E.g. "inserted"\n
+    message = The message.
+    """
+    # Skip the work entirely if the level is turned off.
+    if not logger.isEnabledFor(level):
+        return
+
+    now = time.monotonic()
+
+    with _metrics_lock:
+        last, dropped = _log_state.get(key, (-math.inf, 0))
+
+        if now - last < log_interval:
+            _log_state[key] = (last, dropped + 1)
+            return
+
+        _log_state[key] = (now, 0)
+
+    if dropped:
+        message = f"{message} ({dropped} similar messages dropped)"
+
+    logger.log(level, message)
+
+
+def _report(logger: logging.Logger, interval: float, path: str):
+    """
+    A helper definition that logs the metrics and writes them to the file
+    every interval seconds until stop_reporter() is called.\n
+    logger      = The logger to log the summary to.\n
+    interval    = The number of seconds between reports.\n
+    path        = Where to write the Prometheus file, or None.
+    """
+    while not _stop_reporter.wait(interval):
+        logger.info(f"Metrics:\n{format_summary()}")
+        if path:
+            write_prometheus(path)
+
+
+def start_reporter(logger: logging.Logger, interval: float = 60,
+                   path: str = None):
+    """
+    Start logging a summary of the metrics, and writing them to a Prometheus
+    text file, every interval seconds on a background thread.\n
+    logger      = The logger to log the summary to.\n
+    interval    = The number of seconds between reports.\n
+    path        = Where to write the Prometheus file, or None to only log.
+    """
+    global _reporter
+
+    _stop_reporter.clear()
+    _reporter = Thread(target=_report, args=(logger, interval, path),
+                       daemon=True)
+    _reporter.start()
+
+
+def stop_reporter(logger: logging.Logger, path: str = None):
+    """
+    Stop the background reporter and make one last report so the final
+    numbers are always recorded.\n
+    logger  = The logger to log the summary to.\n
+    path    = Where to write the Prometheus file, or None to only log.
+    """
+    global _reporter
+
+    _stop_reporter.set()
+    if _reporter is not None:
+        _reporter.join()
+        _reporter = None
+
+    logger.info(f"Metrics:\n{format_summary()}")
+    if path:
+        write_prometheus(path)
@@ -1,24 +1,51 @@
-from datetime import datetime
+import atexit
+from contextlib import contextmanager
 import json
+import logging
+import os
+from queue import Empty, Queue
+from threading import Lock
 
 from mysql.connector import (
-    IntegrityError, MySQLConnection, ProgrammingError, connect)
+    IntegrityError, InterfaceError, MySQLConnection, ProgrammingError, connect)
 
 from classes.Bills import Bills
-from interfaces.api_interface import logger
+from interfaces.metrics_interface import count, log_sampled, timed
+from interfaces.storage_interface import parse_records
 
+# Create the logger for this module.
+logger = logging.getLogger(__name__)
 
-def get_credentials() -> MySQLConnection:
+# The maximum number of connections the pool will hold open at once. Can be
+# changed with init_pool() before the first connection is handed out.
+pool_size = 5
+
+# The credentials for the server. Read from the file once and reused for every
+# connection afterwards.
+_credentials = []
+
+# The idle connections that are ready to be handed out, every connection the
+# pool has opened, and the lock that guards creating new ones.
+_idle_connections = Queue()
+_open_connections = []
+_pool_lock = Lock()
+
+
+def read_credentials() -> list:
     """
-    A helper function used to get the credentials for the server, simplifying
-    the process.
+    A helper function used to read the credentials for the server from their
+    file. The file is only read the first time and the values are kept for
+    every call after that.
     """
+    # If the credentials have already been read, return them.
+    if _credentials:
+        return _credentials
+
     # Try to get the credentials for the server.
-    credentials = []
     try:
         with open("sensitive/database_credentials", 'rt') as key:
             for item in key:
-                credentials.append(str(item).strip())
+                _credentials.append(str(item).strip())
     
     # If the file isn't there, exit.
     # TODO: If exception is raised, revert to manual input from user and save
@@ -28,13 +55,27 @@ def get_credentials() -> MySQLConnection:
         logger.error(file_err)
         exit()
 
+    return _credentials
+
+
+def get_credentials(**options) -> MySQLConnection:
+    """
+    A helper function used to open a new connection to the server, simplifying
+    the process. Most callers should use pooled_connection() instead so the
+    connection gets reused.\n
+    options = Any other connection options. E.g. allow_local_infile=True
+    """
+    # Get the credentials for the server.
+    credentials = read_credentials()
+
     # Try the connection.
     try:
         mydb = connect(
             host=credentials[0],
             user=credentials[1],
             password=credentials[2],
-            database=credentials[3])
+            database=credentials[3],
+            **options)
         
         return mydb
 
@@ -44,137 +85,996 @@ def get_credentials() -> MySQLConnection:
         logger.critical(prog_err)
         exit()
 
+
+def init_pool(size: int = 5):
+    """
+    Set the size of the connection pool. Should be called before the first
+    connection is taken from the pool.\n
+    size    = The maximum number of connections to keep open at once.
+    """
+    global pool_size
+
+    # Make sure the pool can hold at least one connection.
+    if size < 1:
+        raise ValueError("The pool size must be at least 1")
+
+    logger.info(f"Setting the connection pool size to {size}")
+    pool_size = size
+
+
+def get_connection() -> MySQLConnection:
+    """
+    Take a connection from the pool. If none are idle and the pool isn't full
+    a new one is opened, otherwise this waits until one is released. The
+    connection is checked before it is handed out and reconnected if the server
+    dropped it.
+    """
+    # Try to take an idle connection without waiting.
+    try:
+        mydb = _idle_connections.get_nowait()
+
+    except Empty:
+        # If there is room in the pool, open a new connection.
+        with _pool_lock:
+            if len(_open_connections) < pool_size:
+                mydb = get_credentials()
+                _open_connections.append(mydb)
+                logger.debug("Opened connection "+
+                             f"{len(_open_connections)}/{pool_size}")
+                return mydb
+
+        # Otherwise wait for another caller to release one.
+        mydb = _idle_connections.get()
+
+    # Make sure the connection is still alive before handing it out.
+    try:
+        mydb.ping(reconnect=True, attempts=3, delay=1)
+
+    # If it can't be revived, replace it with a brand new connection.
+    except InterfaceError as inter_err:
+        logger.warning(f"Pooled connection is dead, replacing it. {inter_err}")
+        with _pool_lock:
+            _open_connections.remove(mydb)
+            mydb = get_credentials()
+            _open_connections.append(mydb)
+
+    return mydb
+
+
+def release_connection(mydb: MySQLConnection):
+    """
+    Hand a connection back to the pool so it can be reused.\n
+    mydb    = The connection that was taken with get_connection().
+    """
+    # Throw away anything that was left uncommitted so the next user of the
+    # connection starts clean.
+    try:
+        if mydb.in_transaction:
+            mydb.rollback()
+
+    except InterfaceError:
+        pass
+
+    _idle_connections.put(mydb)
+
+
+@contextmanager
+def pooled_connection():
+    """
+    A context manager that takes a connection from the pool and releases it
+    when the block is done, whether or not it raised.
+    """
+    mydb = get_connection()
+
+    try:
+        yield mydb
+
+    finally:
+        release_connection(mydb)
+
+
+def close_pool():
+    """
+    Close every connection the pool has opened. The pool can still be used
+    afterwards, it will simply open new connections.
+    """
+    with _pool_lock:
+        # Inform the logger how many connections are being closed.
+        logger.info(f"Closing {len(_open_connections)} pooled connections")
+
+        # Close each of the connections, ignoring any that already dropped.
+        for mydb in _open_connections:
+            try:
+                mydb.close()
+
+            except InterfaceError:
+                pass
+
+        # Empty out the pool.
+        _open_connections.clear()
+        while not _idle_connections.empty():
+            _idle_connections.get_nowait()
+
+
+# Make sure the connections are closed when the program exits.
+atexit.register(close_pool)
+
+# The columns of the bills table in the order the values are built in.
+bill_columns = Bills.COLUMNS
+
+
+
+def build_insert_sql(table: str, columns: tuple) -> str:
+    """
+    Create the prepared statement for an INSERT. The same statement is used for
+    single rows and for executemany(), which turns it into a multi-row INSERT.\n
+    table   = The name of the table.\n
+    columns = The columns in the order the values are built in.
+    """
+    # I hate SQL.
+    return (f"INSERT INTO {table} ({','.join(columns)}) "+
+            f"VALUES ({','.join(['%s'] * len(columns))})")
+
+
+def _update_if_newer(table: str, columns: tuple) -> str:
+    """
+    A helper function that builds the ON DUPLICATE KEY UPDATE clause shared by
+    the upsert and the merge. When the packageId already exists, each column is
+    only replaced if the new row's lastModified is newer, the same as
+    _is_newer(): a missing one is never newer, but anything is newer than a
+    missing stored one. lastModified has to
+    be assigned last since MySQL applies the assignments in order and the
+    comparisons need the old value. The columns of the table are qualified so
+    they can't be mistaken for the columns of a table being selected from.\n
+    table   = The name of the table.\n
+    columns = The columns in the order the values are built in, starting with
+              packageId and ending with lastModified.
+    """
+    newer = (f"VALUES(lastModified) IS NOT NULL AND ({table}.lastModified "+
+             f"IS NULL OR VALUES(lastModified)>{table}.lastModified)")
+
+    return (" ON DUPLICATE KEY UPDATE " +
+            ",".join(f"{table}.{column}=IF({newer},VALUES({column}),"+
+                     f"{table}.{column})"
+                     for column in columns[1:]))
+
+
+def build_upsert_sql(table: str, columns: tuple) -> str:
+    """
+    Create the statement used to insert or update rows. See
+    _update_if_newer().\n
+    table   = The name of the table.\n
+    columns = The columns in the order the values are built in, starting with
+              packageId and ending with lastModified.
+    """
+    return build_insert_sql(table, columns) + _update_if_newer(table, columns)
+
+
+def build_merge_sql(table: str, staging: str, columns: tuple,
+                    only: str = None) -> str:
+    """
+    Create the statement that merges the rows of a staging table into the
+    real one, the same way build_upsert_sql() does for a batch of values.\n
+    table   = The name of the table.\n
+    staging = The name of the staging table, which has the same columns.\n
+    columns = The columns, starting with packageId and ending with
+              lastModified.\n
+    only    = A table of packageId's to limit the merge to, or None to merge
+              every row.
+    """
+    selected = ",".join(f"s.{column}" for column in columns)
+    join = f" JOIN {only} USING (packageId)" if only else ""
+
+    return (f"INSERT INTO {table} ({','.join(columns)}) "+
+            f"SELECT {selected} FROM {staging} s{join}" +
+            _update_if_newer(table, columns))
+
+
+def build_update_sql(table: str, columns: list) -> str:
+    """
+    Create the statement that writes only some of the columns of a row, if the
+    new copy was modified more recently. The values are the columns in order,
+    then the packageId, then lastModified again for the check.\n
+    table   = The name of the table.\n
+    columns = The columns to write, ending with lastModified.
+    """
+    assignments = ",".join(f"{column}=%s" for column in columns)
+
+    return (f"UPDATE {table} SET {assignments} WHERE packageId=%s AND "+
+            "(lastModified IS NULL OR lastModified<%s)")
+
+
+# The statements used for the bills table.
+insert_bill_sql = build_insert_sql("bills", bill_columns)
+upsert_bill_sql = build_upsert_sql("bills", bill_columns)
+
+
+# The columns of the child tables, which hold the members, committees,
+# references and version links of each bill in a form that can be indexed,
+# the function that builds their rows, and the statements used to insert
+# them. See helpers/create_child_tables.sql and
+# helpers/create_bill_versions_table.sql.
+child_columns = Bills.CHILD_TABLES
+build_child_rows = Bills.child_rows
+child_insert_sql = {table: build_insert_sql(table, columns)
+                    for table, columns in child_columns.items()}
+
+
+def parse_summary(digest: bytes) -> tuple:
+    """
+    Parse a package summary once and build both the row for the bills table
+    and the rows for the child tables.\n
+    digest  = The document that is going to be placed into the table in a bytes
+              format as it is directly from the web page.
+    """
+    summary = json.loads(digest)
+
+    # The row is only inserted, so it doesn't need a fingerprint.
+    return (Bills.row_from_digest(summary, False), build_child_rows(summary))
+
+
+def _write_child_rows(cursor, package_ids: list, children: list,
+                      replace: bool = False):
+    """
+    A helper function that inserts the child rows of some bills. Must be called
+    inside the same transaction as the bills themselves.\n
+    cursor      = The cursor to write with.\n
+    package_ids = The packageId's of the bills.\n
+    children    = The dictionaries from build_child_rows() for each bill.\n
+    replace     = Whether to delete the existing child rows of the bills first.
+    """
+    if not package_ids:
+        return
+
+    for table, sql in child_insert_sql.items():
+        # Clear out the old rows so updated bills don't keep stale ones.
+        if replace:
+            cursor.execute(f"DELETE FROM {table} WHERE packageId IN "+
+                           f"({','.join(['%s'] * len(package_ids))})",
+                           tuple(package_ids))
+
+        # Insert all of the new rows for the table at once.
+        rows = [row for child in children for row in child[table]]
+        if rows:
+            cursor.executemany(sql, rows)
+
+
 def insert_bill_values(digest: bytes):
     """
     First checks if the specified bill is in the table, theninserts the values
-    for it into the database if it isn't.\n
+    for it into the database if it isn't. If it is, it's checked for changes
+    and only updated if its fingerprint changed.\n
     digest  = The document that is going to be placed into the table in a bytes
               format as it is directly from the web page.
     """
+    # Build the row that will be inserted and the rows of the child tables.
+    values, children = parse_summary(digest)
 
-    # Digest the bill so it can be parsed easily.
-    vals = Bills(json.loads(digest))
-    
-    # Separate the vals in the last_modified date to comply with SQL standards.
-    vals.last_modified = str(vals.last_modified).replace("T", " ")
-    vals.last_modified = str(vals.last_modified).replace("Z","")
+    # Whether the bill turned out to be in the table already.
+    exists = False
 
-    # TODO: Test if this line is necessary.
-    vals.last_modified = datetime.strptime(vals.last_modified,
-                                                    '%Y-%m-%d %H:%M:%S')
+    # Take a connection to the database from the pool.
+    with pooled_connection() as mydb:
+        # Set the cursor.
+        mycursor = mydb.cursor(buffered=True)
 
-    # I hate SQL.
-    # Create the prepared statement for the INSERT.
-    sql = ("INSERT INTO bills (packageId,title,shortTitle,collectionCode,"+
-           "collectionName,category,dateIssued,detailsLink,download,related,"+
-           "branch,pages,governmentAuthor1,governmentAuthor2,suDocClassNumber,"+
-           "billtype,congress,originChamber,currentChamber,docSession,"+
-           "billNumber,billVersion,isAppropriation,isPrivate,publisher,"+
-           "committees,members,otherIdentifier,docReferences,lastModified) "+
-           "VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,"+
-           "%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)")
-
-    # Create the values that will be inserted into the table.
-    values = (str(vals.package_ID),str(vals.title),str(vals.short_title),
-              str(vals.collection_code),str(vals.collection_name),
-              str(vals.category),vals.date_issued,str(vals.details_link),
-              str(vals.download),str(vals.related),str(vals.branch),
-              int(vals.pages),str(vals.government_author_1),
-              str(vals.government_author_2),str(vals.SuDoc_class_number),
-              str(vals.bill_type),int(vals.congress),str(vals.origin_chamber),
-              str(vals.current_chamber),str(vals.session),int(vals.bill_number),
-              str(vals.bill_version),bool(vals.is_appropriation),
-              bool(vals.is_private),str(vals.publisher),str(vals.committees),
-              str(vals.members),str(vals.other_identifier),str(vals.references),
-              str(vals.last_modified))
-
-    # Get the connection to the database.
-    mydb = get_credentials()
-
-    # Set the cursor.
-    mycursor = mydb.cursor(buffered=True)
-
-    # Try to execute the insert command.
-    # TODO: After the existance check, if it exists, check it for changes.
-    try:
-        mycursor.execute(sql, values)
-        mydb.commit()
-        logger.info(f"{vals.package_ID} successfully inserted")
+        # Try to execute the insert command.
+        try:
+            with timed("db_insert", table="bills"):
+                mycursor.execute(insert_bill_sql, values)
+                _write_child_rows(mycursor, [values[0]], [children])
+                mydb.commit()
+            count("db_rows_written", table="bills")
+            log_sampled(logger, logging.INFO, "inserted",
+                        f"{values[0]} successfully inserted")
+
+        # If it fails, log that the entry already exists.
+        except IntegrityError:
+            mydb.rollback()
+            count("db_duplicates", table="bills")
+            log_sampled(logger, logging.INFO, "duplicate",
+                        f"{values[0]} is already in the database, checking "+
+                        "it for changes")
+            exists = True
 
-    # If it fails, log that the entry already exists and move on.
-    except IntegrityError as integ_err:
-        logger.info(f"{vals.package_ID} is already in the database")
+        finally:
+            mycursor.close()
 
-def check_if_exists(Id: str) -> bool:
+    # Check the stored copy for changes once the connection is back in the
+    # pool, since the upsert takes its own.
+    if exists:
+        upsert_record_batch([digest], "bills", Bills, 1, build_child_rows)
+
+
+def insert_record_batch(digests: list, table: str, record_class,
+                        chunk_size: int = 500, child_builder=None,
+                        on_written=None) -> list:
     """
-    A function that will check to see whether a specified document exists within
-    a table.\n
-    Id  = The packageId of the document to be checked.
+    Insert many packages at once. The rows are written in chunks with a
+    multi-row INSERT and one commit per chunk. If a chunk contains a row that
+    is already in the table, that chunk is replayed one row at a time inside a
+    single transaction so only the duplicate rows are skipped.\n
+    digests         = A list of documents in a bytes format as they are directly
+                      from the web page.\n
+    table           = The name of the table. E.g. bills\n
+    record_class    = The Record class of the collection. E.g. Bills\n
+    chunk_size      = The number of rows to write in each transaction.\n
+    child_builder   = The function that builds the rows of the table's child
+                      tables, or None if it doesn't have any.\n
+    on_written      = A function that is handed the packageId's of each chunk
+                      once it's committed, or None.\n
+    Returns the packageId's of the rows that raised an IntegrityError.
     """
-    # Try to get the credentials for the server.
-    credentials = []
-    try:
-        with open("sensitive/database_credentials", 'rt') as key:
-            for item in key:
-                credentials.append(str(item).strip())
-    
-    # If the file isn't there, exit.
-    # TODO: If exception is raised, revert to manual input from user and save
-    # output to the file.
-    except FileNotFoundError as file_err:
-        logger.error("database_credentials does not exist. ")
-        logger.error(file_err)
-        exit()
+    # Build all of the rows up front. Nothing compares them yet, so they're
+    # built without a fingerprint.
+    parsed = parse_records(digests, record_class, child_builder, False)
+    sql = build_insert_sql(table, record_class.COLUMNS)
 
-    # Connect to the server
-    mydb = get_credentials()
+    # A list of the packageId's that could not be inserted.
+    failed = []
 
-    # Set the cursor to the beginning.
-    mycursor = mydb.cursor(buffered=True)
+    # Take a connection to the database from the pool.
+    with pooled_connection() as mydb:
+        mycursor = mydb.cursor()
 
-    # Notify the logger.
-    logger.debug(f"Trying {Id}")
+        # Work through the rows one chunk at a time.
+        for i in range(0, len(parsed), chunk_size):
+            chunk = [row for row, _ in parsed[i:i + chunk_size]]
+            children = [child for _, child in parsed[i:i + chunk_size]]
 
-    # Execute the command.
-    mycursor.execute(f"SELECT * FROM bills WHERE packageId=\"{Id}\";")
+            # Try to write the whole chunk with one statement.
+            try:
+                with timed("db_insert", table=table):
+                    mycursor.executemany(sql, chunk)
+                    if child_builder:
+                        _write_child_rows(mycursor, [row[0] for row in chunk],
+                                          children)
+                    mydb.commit()
+                count("db_rows_written", len(chunk), table=table)
+                logger.info(f"{len(chunk)} rows successfully inserted into "+
+                            f"{table}")
+                if on_written:
+                    on_written([row[0] for row in chunk])
+                continue
 
-    # Get the value, if any.
-    myresult = mycursor.fetchone()
+            # If any row already exists, the whole statement is rejected.
+            except IntegrityError as integ_err:
+                mydb.rollback()
+                logger.debug(f"Chunk hit an IntegrityError, replaying rows. "+
+                             f"{integ_err}")
+
+            # Replay the chunk row by row so only the bad rows are left out.
+            # A failed row doesn't end the transaction, so it's still only one
+            # commit for the chunk.
+            inserted = []
+            with timed("db_insert", table=table):
+                for row, child in zip(chunk, children):
+                    try:
+                        mycursor.execute(sql, row)
+                        inserted.append((row[0], child))
+
+                    except IntegrityError:
+                        log_sampled(logger, logging.INFO, "duplicate",
+                                    f"{row[0]} is already in the database")
+                        failed.append(row[0])
+
+                # Only the rows that went in get child rows.
+                if child_builder:
+                    _write_child_rows(mycursor,
+                                      [row_id for row_id, _ in inserted],
+                                      [child for _, child in inserted])
+                mydb.commit()
+            count("db_rows_written", len(inserted), table=table)
+            count("db_duplicates", len(chunk) - len(inserted), table=table)
+            logger.info(f"{len(inserted)} rows successfully inserted into "+
+                        f"{table}")
+            if on_written:
+                on_written([row_id for row_id, _ in inserted])
+
+        mycursor.close()
+
+    return failed
+
+
+def _is_newer(modified, stored) -> bool:
+    """
+    A helper function that checks whether a new lastModified is newer than
+    the stored one. A missing lastModified is never newer, but anything is
+    newer than a missing one.\n
+    modified    = The lastModified of the new row.\n
+    stored      = The lastModified of the stored row.
+    """
+    return modified is not None and (stored is None or modified > stored)
+
+
+def _stored_fingerprints(cursor, table: str, package_ids: list) -> dict:
+    """
+    A helper function that fetches the fingerprint and lastModified of every
+    package in a list that is already in the table, in one query.\n
+    cursor      = The cursor to read with.\n
+    table       = The name of the table. E.g. bills\n
+    package_ids = The packageId's to look up.
+    """
+    placeholders = ",".join(["%s"] * len(package_ids))
+    cursor.execute(f"SELECT packageId,fingerprint,lastModified FROM {table} "+
+                   f"WHERE packageId IN ({placeholders})", tuple(package_ids))
+
+    return {package_id: (fingerprint, modified)
+            for package_id, fingerprint, modified in cursor}
+
+
+def _update_changed(cursor, table: str, record_class, rows: list) -> int:
+    """
+    A helper function that writes only the columns that changed in rows that
+    are already in the table. The stored rows are read in one query, and the
+    rows that changed the same columns are written with one statement.\n
+    cursor          = The cursor to write with.\n
+    table           = The name of the table. E.g. bills\n
+    record_class    = The Record class of the collection. E.g. Bills\n
+    rows            = The new rows, as built by row_from_digest().\n
+    Returns the number of rows that were updated.
+    """
+    columns = record_class.CONTENT_COLUMNS
+    last = record_class.COLUMNS[-2:]
+
+    # Get what's stored now.
+    cursor.execute(f"SELECT {','.join(columns)} FROM {table} WHERE packageId "+
+                   f"IN ({','.join(['%s'] * len(rows))})",
+                   tuple(row[0] for row in rows))
+    stored = {row[0]: row for row in cursor}
+
+    # Group the rows by the columns that changed. The fingerprint and
+    # lastModified are always written.
+    groups = {}
+    for row in rows:
+        if row[0] not in stored:
+            continue
+        changed = record_class.changed_columns(stored[row[0]], row)
+        groups.setdefault(changed, []).append(
+            tuple(row[i] for i in changed) + row[-2:] + (row[0], row[-1]))
+
+    updated = 0
+    for changed, values in groups.items():
+        cursor.executemany(build_update_sql(
+            table, [columns[i] for i in changed] + list(last)), values)
+        updated = updated + cursor.rowcount
+
+    return updated
+
+
+def upsert_record_batch(digests: list, table: str, record_class,
+                        chunk_size: int = 500, child_builder=None,
+                        on_written=None) -> int:
+    """
+    Insert many packages at once, updating any that are already in the table
+    if the new copy was modified more recently and its fingerprint changed.
+    The stored fingerprints of each chunk are fetched in one query, so
+    packages that were pulled again without changing aren't written at all,
+    and the ones that did change only have their changed columns written.
+    The rows are written in chunks with one commit per chunk.\n
+    digests         = A list of documents in a bytes format as they are directly
+                      from the web page.\n
+    table           = The name of the table. E.g. bills\n
+    record_class    = The Record class of the collection. E.g. Bills\n
+    chunk_size      = The number of rows to write in each transaction.\n
+    child_builder   = The function that builds the rows of the table's child
+                      tables, or None if it doesn't have any.\n
+    on_written      = A function that is handed the packageId's of each chunk
+                      once it's committed, or None.\n
+    Returns the number of rows that were inserted or changed.
+    """
+    # Build all of the rows up front.
+    parsed = parse_records(digests, record_class, child_builder)
+    sql = build_upsert_sql(table, record_class.COLUMNS)
+
+    # The number of rows MySQL reports as affected, and the number that were
+    # left alone because nothing in them changed.
+    affected = 0
+    unchanged = 0
+
+    # Take a connection to the database from the pool.
+    with pooled_connection() as mydb:
+        mycursor = mydb.cursor()
+
+        # Write the rows one chunk at a time.
+        for i in range(0, len(parsed), chunk_size):
+            chunk = parsed[i:i + chunk_size]
+
+            with timed("db_insert", table=table):
+                stored = _stored_fingerprints(mycursor, table,
+                                              [row[0] for row, _ in chunk])
+
+                # Sort the chunk into new packages, changed packages, and
+                # packages that are older or the same as what's stored.
+                new = []
+                changed = []
+                for row, child in chunk:
+                    if row[0] not in stored:
+                        new.append((row, child))
+                    elif (_is_newer(row[-1], stored[row[0]][1]) and
+                          row[-2] != stored[row[0]][0]):
+                        changed.append((row, child))
+                unchanged = unchanged + len(chunk) - len(new) - len(changed)
+
+                # The new ones still go through the upsert in case another
+                # writer added them since the fingerprints were read.
+                if new:
+                    mycursor.executemany(sql, [row for row, _ in new])
+                    affected = affected + mycursor.rowcount
+                if changed:
+                    affected = affected + _update_changed(
+                        mycursor, table, record_class,
+                        [row for row, _ in changed])
+
+                # Only the packages that were written get new child rows.
+                if child_builder:
+                    _write_child_rows(mycursor,
+                                      [row[0] for row, _ in new + changed],
+                                      [child for _, child in new + changed],
+                                      replace=True)
+                mydb.commit()
+            count("db_rows_written", len(new) + len(changed), table=table)
+            if on_written:
+                on_written([row[0] for row, _ in chunk])
+
+        mycursor.close()
+
+    count("db_unchanged", unchanged, table=table)
+    logger.info(f"Upserted {len(parsed)} rows into {table}, {affected} rows "+
+                f"affected, {unchanged} unchanged")
+
+    return affected
+
+
+def insert_bill_batch(digests: list, chunk_size: int = 500) -> list:
+    """
+    Insert many bills at once along with their child rows. See
+    insert_record_batch().\n
+    digests     = A list of documents in a bytes format as they are directly
+                  from the web page.\n
+    chunk_size  = The number of rows to write in each transaction.\n
+    Returns the packageId's of the rows that raised an IntegrityError.
+    """
+    return insert_record_batch(digests, "bills", Bills, chunk_size,
+                               build_child_rows)
+
+
+def upsert_bill_batch(digests: list, chunk_size: int = 500) -> int:
+    """
+    Insert many bills at once, updating any that are already in the table if
+    the new copy was modified more recently. See upsert_record_batch().\n
+    digests     = A list of documents in a bytes format as they are directly
+                  from the web page.\n
+    chunk_size  = The number of rows to write in each transaction.\n
+    Returns the number of rows that were inserted or changed.
+    """
+    return upsert_record_batch(digests, "bills", Bills, chunk_size,
+                               build_child_rows)
+
+
+def check_if_exists(Id: str, table: str = "bills") -> bool:
+    """
+    A function that will check to see whether a specified document exists within
+    a table.\n
+    Id      = The packageId of the document to be checked.\n
+    table   = The table to check. E.g. bills
+    """
+    # Take a connection to the server from the pool.
+    with pooled_connection() as mydb:
+        # Set the cursor to the beginning.
+        mycursor = mydb.cursor(buffered=True)
+
+        # Notify the logger.
+        logger.debug(f"Trying {Id}")
+
+        # Execute the command. Only the primary key is looked at, so none of
+        # the row has to be read.
+        with timed("db_exists_check", table=table):
+            mycursor.execute(f"SELECT 1 FROM {table} WHERE packageId=%s "+
+                             "LIMIT 1", (Id,))
+
+            # Get the value, if any.
+            myresult = mycursor.fetchone()
+        mycursor.close()
 
     # If you get a result
     if(myresult):
         # Notify the logger that the document exists already and return true.
-        logger.warning(f"{Id} exists in the database. Skipping.")
+        log_sampled(logger, logging.WARNING, "exists",
+                    f"{Id} exists in the database. Skipping.")
         return True
     
     # Otherwise, return false.
     else:
         return False
 
-def check_all(doc_list: list, doc_type: str):
+def check_all(doc_list: list, doc_type: str) -> list:
     """
     Pulls the packageId's of all of the entries in the table specified by
     doc_type then compares them to the doc_list and removes any that are already
-    in the table.\n
+    in the table. The list is changed in place and also returned.\n
     doc_list    = A list of documents that are to be checked to see whether
                   they're in the table yet or not.\n
     doc_type    = The type of document that is being checked. E.g. BILLS
     """
-    # Get the credentials of the database.
-    mydb = get_credentials()
+    # Put the candidates into a set so each lookup is constant time.
+    candidates = set(doc_list)
+
+    # Only keep the packageId's that are actually being asked about, so
+    # memory is bounded by the size of doc_list rather than the table.
+    found = {package_id for package_id in iter_package_ids(doc_type.lower())
+             if package_id in candidates}
+
+    # Remove every document that is already in the table in one pass.
+    doc_list[:] = [item for item in doc_list if item not in found]
+
+    return doc_list
+
+
+def iter_package_ids(table: str):
+    """
+    Yield every packageId in a table. The rows are streamed from the server one
+    at a time instead of all being held in memory. The connection is given
+    back once the generator is used up or closed.\n
+    table   = The table to read. E.g. bills
+    """
+    # Take a connection to the database from the pool.
+    with pooled_connection() as mydb:
+        # Use an unbuffered cursor so the rows are streamed.
+        cursor = mydb.cursor(buffered=False)
+        cursor.execute(f"SELECT packageId FROM {table}")
+
+        try:
+            for (package_id,) in cursor:
+                yield package_id
+
+        # If the caller stopped early, read off the rest of the rows so the
+        # connection goes back to the pool ready for its next query.
+        finally:
+            mydb.consume_results()
+            cursor.close()
+
+
+def count_rows(table: str) -> int:
+    """
+    Return the number of rows in a table.\n
+    table   = The table to count. E.g. bills
+    """
+    with pooled_connection() as mydb:
+        cursor = mydb.cursor()
+        cursor.execute(f"SELECT COUNT(*) FROM {table}")
+        (rows,) = cursor.fetchone()
+        cursor.close()
+
+    return rows
+
+
+def iter_missing(doc_ids, doc_type: str, chunk_size: int = 500):
+    """
+    Yield the packageId's that aren't in the table yet. The input is read in
+    chunks and each chunk is checked with one indexed query, so it can be a
+    generator that is still being filled while earlier chunks are checked.\n
+    doc_ids     = Any iterable of packageId's.\n
+    doc_type    = The type of document that is being checked. E.g. BILLS\n
+    chunk_size  = The number of packageId's checked in each query.
+    """
+    chunk = []
+
+    for doc_id in doc_ids:
+        chunk.append(doc_id)
+
+        # Once the chunk is full, check it and hand out whatever is missing.
+        if len(chunk) >= chunk_size:
+            yield from _filter_missing(chunk, doc_type)
+            chunk = []
+
+    # Check whatever is left over.
+    if chunk:
+        yield from _filter_missing(chunk, doc_type)
+
+
+def _filter_missing(chunk: list, doc_type: str) -> list:
+    """
+    A helper function that returns the packageId's in a chunk that aren't in
+    the table, in the same order.\n
+    chunk       = A list of packageId's.\n
+    doc_type    = The type of document that is being checked. E.g. BILLS
+    """
+    # Take a connection to the database from the pool.
+    with pooled_connection() as mydb:
+        cursor = mydb.cursor()
+
+        # Look up every packageId in the chunk at once.
+        with timed("db_exists_check", table=doc_type.lower()):
+            cursor.execute(f"SELECT packageId FROM {doc_type.lower()} "+
+                           "WHERE packageId IN "+
+                           f"({','.join(['%s'] * len(chunk))})",
+                           tuple(chunk))
+            found = {row[0] for row in cursor}
+        cursor.close()
+
+    logger.debug(f"{len(found)} of {len(chunk)} are already in the database")
+
+    return [doc_id for doc_id in chunk if doc_id not in found]
+
+
+# The columns of the bills table the child rows are rebuilt from.
+stored_child_columns = [column for column, _ in Bills.STORED_CHILD_SOURCES]
+
+
+def backfill_child_tables(chunk_size: int = 1000) -> int:
+    """
+    Fill the child tables from the committees, members and docReferences text
+    and the version columns of every bill already in the table, e.g. after
+    running helpers/create_bill_versions_table.sql. Bills are read in
+    packageId order a chunk at a time, and each chunk's child rows are
+    replaced in one transaction, so it is safe to run again if it's stopped
+    partway through.\n
+    chunk_size  = The number of bills to migrate in each transaction.\n
+    Returns the number of bills migrated.
+    """
+    # The last packageId migrated, and the running total.
+    last_id = ""
+    total = 0
+
+    # Take a connection to the database from the pool.
+    with pooled_connection() as mydb:
+        cursor = mydb.cursor()
+
+        while True:
+            # Get the next chunk of bills after the last one migrated.
+            cursor.execute(f"SELECT {','.join(stored_child_columns)} "+
+                           "FROM bills WHERE packageId > %s "+
+                           "ORDER BY packageId LIMIT %s", (last_id, chunk_size))
+            rows = cursor.fetchall()
+
+            # If there are none left, it's done.
+            if not rows:
+                break
+
+            # Rebuild the child rows from the stored text.
+            children = [build_child_rows(Bills.summary_from_stored(row))
+                        for row in rows]
+
+            # Replace the child rows of the chunk.
+            _write_child_rows(cursor, [row[0] for row in rows], children,
+                              replace=True)
+            mydb.commit()
+
+            last_id = rows[-1][0]
+            total = total + len(rows)
+            logger.info(f"Migrated the child rows of {total} bills so far")
+
+        cursor.close()
+
+    return total
+
+
+def get_bills_by_member(member: str, congress: int = -1,
+                        role: str = "SPONSOR") -> list:
+    """
+    Get the packageId's of every bill a member is listed on, using the indexed
+    bill_members table.\n
+    member      = The bioGuideId or the memberName of the member.
+                  E.g. G000359 or "Graham, Lindsey"\n
+    congress    = The number of the congress to search in.  Not necessary to
+                  run.\n
+    role        = The role the member has on the bill. E.g. SPONSOR, COSPONSOR
+    """
+    # Search both of the indexed member columns.
+    sql = ("SELECT DISTINCT packageId FROM bill_members "+
+           "WHERE (bioGuideId = %s OR memberName = %s) AND role = %s")
+    values = [member, member, role]
+
+    # If there is a specific congress being searched for.
+    if congress != -1:
+        sql = sql + " AND congress = %s"
+        values.append(congress)
+
+    # Take a connection to the database from the pool.
+    with pooled_connection() as mydb:
+        cursor = mydb.cursor()
+        cursor.execute(sql, tuple(values))
+        result = [row[0] for row in cursor]
+        cursor.close()
+
+    return result
+
+
+def get_bill_versions(congress: int, bill_type: str,
+                      bill_number: int) -> list:
+    """
+    Get every version of a bill in the order it moved through Congress, using
+    the indexed bill_versions table. Returns (packageId, billVersion, stage,
+    dateIssued) for each one.\n
+    congress    = The number of the congress the bill is from. E.g. 116\n
+    bill_type   = The type of the bill. E.g. hr\n
+    bill_number = The number of the bill. E.g. 1234
+    """
+    # Take a connection to the database from the pool.
+    with pooled_connection() as mydb:
+        cursor = mydb.cursor()
+        cursor.execute("SELECT packageId,billVersion,stage,dateIssued "+
+                       "FROM bill_versions WHERE congress=%s AND "+
+                       "billType=%s AND billNumber=%s "+
+                       "ORDER BY stage,dateIssued,packageId",
+                       (congress, bill_type.lower(), bill_number))
+        result = cursor.fetchall()
+        cursor.close()
+
+    return result
+
+
+def get_versions_of(package_id: str) -> list:
+    """
+    Get every version of the bill a package is a version of, itself included,
+    in the order it moved through Congress. See get_bill_versions().\n
+    package_id  = The packageId of any version of the bill.
+                  E.g. BILLS-116hr1234ih
+    """
+    # Find the bill by the package's primary key and its versions by the bill
+    # index in the same query.
+    with pooled_connection() as mydb:
+        cursor = mydb.cursor()
+        cursor.execute("SELECT v.packageId,v.billVersion,v.stage,"+
+                       "v.dateIssued FROM bill_versions b "+
+                       "JOIN bill_versions v ON v.congress=b.congress AND "+
+                       "v.billType=b.billType AND v.billNumber=b.billNumber "+
+                       "WHERE b.packageId=%s "+
+                       "ORDER BY v.stage,v.dateIssued,v.packageId",
+                       (package_id,))
+        result = cursor.fetchall()
+        cursor.close()
+
+    return result
+
 
-    # Establish a cursor at the beginning of the database.
-    cursor = mydb.cursor()
+# The file with the statement that creates the work queue, found next to
+# this package rather than in the working directory.
+work_queue_ddl_path = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "helpers",
+    "create_work_queue_table.sql")
 
-    # Execute the command to select all of the packageId's from the table.
-    cursor.execute(f"SELECT packageId FROM {doc_type.lower()};")
+# Whether the work queue has been created by this process.
+_work_queue_ready = False
 
-    # Get the results of the search.
-    result = cursor.fetchall()
 
-    # Search through each item in the result.
-    for item in result:
-        # Compare each packageId to items in the list and remove it from the
-        # list if it does exist in the table already.
-        while item[0] in doc_list:
-            doc_list.remove(item[0])
+def _ensure_work_queue(cursor):
+    """
+    A helper function that creates the work queue the first time it's used.
+    The statement is only read from the helpers folder then, so nothing that
+    doesn't use the queue needs the file.\n
+    cursor  = The cursor to create it with.
+    """
+    global _work_queue_ready
+
+    if not _work_queue_ready:
+        with open(work_queue_ddl_path, 'rt') as ddl_file:
+            cursor.execute(ddl_file.read())
+        _work_queue_ready = True
+
+
+def enqueue_work(collection: str, package_ids: list,
+                 chunk_size: int = 1000) -> int:
+    """
+    Add packages to the work queue, skipping any that are already in it.\n
+    collection  = The collectionCode. E.g. BILLS\n
+    package_ids = The packageId's to add.\n
+    chunk_size  = The number of rows to write in each transaction.\n
+    Returns the number of packages that were added.
+    """
+    added = 0
+
+    with pooled_connection() as mydb:
+        cursor = mydb.cursor()
+        _ensure_work_queue(cursor)
+
+        for i in range(0, len(package_ids), chunk_size):
+            cursor.executemany("INSERT IGNORE INTO work_queue "+
+                               "(collection,packageId) VALUES (%s,%s)",
+                               [(collection, package_id) for package_id in
+                                package_ids[i:i + chunk_size]])
+            added = added + cursor.rowcount
+            mydb.commit()
+
+        cursor.close()
+
+    return added
+
+
+def claim_work(collection: str, worker: str, batch_size: int,
+               lease_seconds: int, max_attempts: int) -> list:
+    """
+    Lease a batch of packages from the work queue. The rows are locked with
+    SKIP LOCKED, so workers claiming at the same time each get different
+    packages instead of waiting on each other. Packages whose lease ran out
+    are claimed again. Needs MySQL 8.0 or newer.\n
+    collection      = The collectionCode. E.g. BILLS\n
+    worker          = The name of the worker claiming them.\n
+    batch_size      = The most packages to claim.\n
+    lease_seconds   = How long the worker has before they can be claimed by
+                      another.\n
+    max_attempts    = How many times a package can be claimed before it's
+                      given up on.\n
+    Returns the packageId's that were claimed.
+    """
+    with pooled_connection() as mydb:
+        cursor = mydb.cursor()
+        _ensure_work_queue(cursor)
+
+        try:
+            cursor.execute("SELECT packageId FROM work_queue WHERE "+
+                           "collection=%s AND status=0 AND "+
+                           "lease_expires<=NOW() AND attempts<%s "+
+                           "ORDER BY lease_expires LIMIT %s "+
+                           "FOR UPDATE SKIP LOCKED",
+                           (collection, max_attempts, batch_size))
+            claimed = [row[0] for row in cursor]
+
+            if claimed:
+                cursor.execute("UPDATE work_queue SET worker=%s,"+
+                               "lease_expires=NOW()+INTERVAL %s SECOND,"+
+                               "attempts=attempts+1 WHERE collection=%s AND "+
+                               "packageId IN "+
+                               f"({','.join(['%s'] * len(claimed))})",
+                               (worker, lease_seconds, collection, *claimed))
+            mydb.commit()
+
+        except Exception:
+            mydb.rollback()
+            raise
+
+        finally:
+            cursor.close()
+
+    return claimed
+
+
+def finish_work(collection: str, package_ids: list, worker: str,
+                status: int) -> int:
+    """
+    Record that a worker is done with some of the packages it claimed. A
+    package that another worker has claimed since is left alone.\n
+    collection  = The collectionCode. E.g. BILLS\n
+    package_ids = The packageId's that are done.\n
+    worker      = The name of the worker that claimed them.\n
+    status      = The status to give them. 0 puts them back in the queue
+                  straight away, 1 is done and 2 is failed.\n
+    Returns the number of packages that were updated.
+    """
+    if not package_ids:
+        return 0
+
+    with pooled_connection() as mydb:
+        cursor = mydb.cursor()
+        cursor.execute("UPDATE work_queue SET status=%s,worker=NULL,"+
+                       "lease_expires=NOW() WHERE collection=%s AND "+
+                       "worker=%s AND packageId IN "+
+                       f"({','.join(['%s'] * len(package_ids))})",
+                       (status, collection, worker, *package_ids))
+        updated = cursor.rowcount
+        mydb.commit()
+        cursor.close()
+
+    return updated
+
+
+def count_work(collection: str, max_attempts: int) -> list:
+    """
+    Count the packages in the work queue, grouped by their status, whether
+    they're leased right now, and whether they've run out of attempts.
+    Returns (status, leased, exhausted, count) rows.\n
+    collection      = The collectionCode. E.g. BILLS\n
+    max_attempts    = How many times a package can be claimed before it's
+                      given up on.
+    """
+    with pooled_connection() as mydb:
+        cursor = mydb.cursor()
+        _ensure_work_queue(cursor)
+        cursor.execute("SELECT status,lease_expires>NOW(),attempts>=%s,"+
+                       "COUNT(*) FROM work_queue WHERE collection=%s "+
+                       "GROUP BY 1,2,3", (max_attempts, collection))
+        rows = cursor.fetchall()
+        cursor.close()
+
+    return rows
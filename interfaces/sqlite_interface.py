@@ -0,0 +1,498 @@
+import logging
+import sqlite3
+import time
+from datetime import datetime
+from threading import Lock, local
+
+from classes.Bills import Bills
+from classes.Record import boolean, integer, text, timestamp
+from interfaces.metrics_interface import count, log_sampled, timed
+from interfaces.storage_interface import StorageBackend, parse_records
+
+# Create the logger for this module.
+logger = logging.getLogger(__name__)
+
+# The SQLite type of a column, picked from the converter its Record class uses.
+column_types = {text: "TEXT", integer: "INTEGER", boolean: "INTEGER",
+                timestamp: "TEXT"}
+
+# SQLite can't take more than this many parameters in one statement on older
+# versions, so the IN (...) checks are split up to stay under it.
+max_parameters = 900
+
+# Store datetimes the same way MySQL prints them so they sort and compare as
+# text. The built in adapter is deprecated.
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(" "))
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    An embedded SQLite database in a single file, so the pipeline can run
+    without a database server. The database is in WAL mode so the existence
+    checks can read while another thread writes, every chunk is written in one
+    transaction, and the statements are built once per table and reused from
+    SQLite's statement cache. The tables are created the first time they're
+    written to. Each thread gets its own connection.\n
+    path    = The location of the database file.
+    """
+    name = "sqlite"
+
+    def __init__(self, path: str = "content/billme.db"):
+        super().__init__()
+        self.path = path
+        self._local = local()
+        self._connections = []
+        self._lock = Lock()
+
+        # The tables that have been created, and the statements of each.
+        self._tables = set()
+        self._statements = {}
+
+        # Whether the work queue has been created.
+        self._queue_ready = False
+
+        logger.info(f"Opening the SQLite database \'{path}\'")
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        A helper definition that returns this thread's connection, opening
+        it the first time.
+        """
+        connection = getattr(self._local, "connection", None)
+
+        if connection is None:
+            # Wait up to 30 seconds for another thread's write to finish
+            # instead of failing straight away.
+            connection = sqlite3.connect(self.path, timeout=30,
+                                         check_same_thread=False,
+                                         cached_statements=256)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA foreign_keys=ON")
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+
+        return connection
+
+    def _prepare(self, table: str, record_class, child_builder=None) -> dict:
+        """
+        A helper definition that creates a table and its child tables if they
+        don't exist yet, and returns the statements used to write to them.\n
+        table           = The name of the table. E.g. bills\n
+        record_class    = The Record class of the collection. E.g. Bills\n
+        child_builder   = The function that builds the rows of the table's
+                          child tables, or None if it doesn't have any.
+        """
+        if table in self._tables:
+            return self._statements[table]
+
+        columns = record_class.COLUMNS
+        child_tables = getattr(record_class, "CHILD_TABLES", {}) \
+            if child_builder else {}
+        child_indexes = getattr(record_class, "CHILD_INDEXES", {})
+
+        # The columns after packageId, each with the type its converter makes.
+        types = {field[2]: column_types[field[3]]
+                 for field in record_class.FIELDS}
+        types[record_class.FINGERPRINT] = "TEXT"
+        definitions = ",".join(f"{column} {types[column]}"
+                               for column in columns[1:])
+
+        connection = self._connection()
+
+        with self._lock:
+            with connection:
+                connection.execute(f"CREATE TABLE IF NOT EXISTS {table} "+
+                                   "(packageId TEXT NOT NULL PRIMARY KEY,"+
+                                   f"{definitions})")
+
+                # Add any columns a table made by an older version is missing.
+                existing = {row[1] for row in connection.execute(
+                    f"PRAGMA table_info({table})")}
+                for column in columns[1:]:
+                    if column not in existing:
+                        connection.execute(f"ALTER TABLE {table} ADD COLUMN "+
+                                           f"{column} {types[column]}")
+                for name, child_columns in child_tables.items():
+                    connection.execute(
+                        f"CREATE TABLE IF NOT EXISTS {name} "+
+                        f"(packageId TEXT NOT NULL REFERENCES {table} "+
+                        "(packageId) ON DELETE CASCADE,"+
+                        f"{','.join(child_columns[1:])})")
+                    connection.execute(f"CREATE INDEX IF NOT EXISTS "+
+                                       f"idx_{name}_package ON {name} "+
+                                       "(packageId)")
+                    for index, index_columns in child_indexes.get(
+                            name, {}).items():
+                        connection.execute(
+                            f"CREATE INDEX IF NOT EXISTS {index} ON {name} "+
+                            f"({','.join(index_columns)})")
+
+            placeholders = ",".join(["?"] * len(columns))
+            insert = (f"INSERT INTO {table} ({','.join(columns)}) "+
+                      f"VALUES ({placeholders})")
+
+            # Only replace a row if the new copy was modified more recently
+            # and its fingerprint changed, the same as the MySQL upsert. A
+            # new copy without a lastModified is never newer, but a stored row
+            # without one counts as older. SQLite
+            # rewrites the whole row either way, so every column is set.
+            upsert = (insert + " ON CONFLICT(packageId) DO UPDATE SET " +
+                      ",".join(f"{column}=excluded.{column}"
+                               for column in columns[1:]) +
+                      " WHERE excluded.lastModified IS NOT NULL AND "+
+                      f"({table}.lastModified IS NULL OR "+
+                      f"excluded.lastModified>{table}.lastModified) " +
+                      f"AND excluded.{record_class.FINGERPRINT} IS NOT "+
+                      f"{table}.{record_class.FINGERPRINT}")
+
+            children = {name: (f"INSERT INTO {name} "+
+                               f"({','.join(child_columns)}) VALUES "+
+                               f"({','.join(['?'] * len(child_columns))})")
+                        for name, child_columns in child_tables.items()}
+
+            self._statements[table] = {"insert": insert, "upsert": upsert,
+                                       "children": children}
+            self._tables.add(table)
+
+        return self._statements[table]
+
+    def _write_children(self, connection: sqlite3.Connection,
+                        statements: dict, package_ids: list, children: list,
+                        replace: bool = False):
+        """
+        A helper definition that writes the child rows of some packages inside
+        the caller's transaction.\n
+        connection  = The connection the transaction is on.\n
+        statements  = The statements of the table from _prepare().\n
+        package_ids = The packageId's of the packages.\n
+        children    = The dictionaries from the child builder for each one.\n
+        replace     = Whether to delete the existing child rows first.
+        """
+        for name, sql in statements["children"].items():
+            if replace:
+                connection.executemany(f"DELETE FROM {name} WHERE "+
+                                       "packageId=?",
+                                       [(package_id,)
+                                        for package_id in package_ids])
+
+            connection.executemany(sql, [row for child in children
+                                         for row in child[name]])
+
+    def insert_batch(self, digests: list, table: str, record_class,
+                     chunk_size: int = 500, child_builder=None) -> list:
+        statements = self._prepare(table, record_class, child_builder)
+        parsed = parse_records(digests, record_class, child_builder, False)
+        connection = self._connection()
+        failed = []
+
+        for i in range(0, len(parsed), chunk_size):
+            chunk = parsed[i:i + chunk_size]
+
+            # Try to write the whole chunk with one statement.
+            try:
+                with timed("db_insert", table=table), connection:
+                    connection.executemany(statements["insert"],
+                                           [row for row, _ in chunk])
+                    if child_builder:
+                        self._write_children(connection, statements,
+                                             [row[0] for row, _ in chunk],
+                                             [child for _, child in chunk])
+                count("db_rows_written", len(chunk), table=table)
+                self.remember(table, [row[0] for row, _ in chunk])
+                continue
+
+            # If any row already exists, the whole chunk was rolled back.
+            except sqlite3.IntegrityError:
+                pass
+
+            # Replay the chunk row by row in one transaction so only the rows
+            # that are already there are left out.
+            inserted = []
+            with timed("db_insert", table=table), connection:
+                for row, child in chunk:
+                    try:
+                        connection.execute(statements["insert"], row)
+                        inserted.append((row[0], child))
+
+                    except sqlite3.IntegrityError:
+                        log_sampled(logger, logging.INFO, "duplicate",
+                                    f"{row[0]} is already in the database")
+                        failed.append(row[0])
+
+                if child_builder:
+                    self._write_children(connection, statements,
+                                         [row_id for row_id, _ in inserted],
+                                         [child for _, child in inserted])
+            count("db_rows_written", len(inserted), table=table)
+            count("db_duplicates", len(chunk) - len(inserted), table=table)
+            self.remember(table, [row_id for row_id, _ in inserted])
+
+        return failed
+
+    def upsert_batch(self, digests: list, table: str, record_class,
+                     chunk_size: int = 500, child_builder=None) -> int:
+        statements = self._prepare(table, record_class, child_builder)
+        parsed = parse_records(digests, record_class, child_builder)
+        connection = self._connection()
+
+        # The number of rows that were inserted or replaced, leaving out the
+        # child rows.
+        changed = 0
+
+        for i in range(0, len(parsed), chunk_size):
+            chunk = parsed[i:i + chunk_size]
+
+            # Write the rows one at a time, which costs next to nothing in
+            # SQLite, to find out which ones were written.
+            written = []
+            with timed("db_insert", table=table), connection:
+                for row, child in chunk:
+                    if connection.execute(statements["upsert"], row).rowcount:
+                        written.append((row[0], child))
+
+                # Only the packages that were written get new child rows.
+                if child_builder:
+                    self._write_children(connection, statements,
+                                         [row_id for row_id, _ in written],
+                                         [child for _, child in written],
+                                         replace=True)
+            changed = changed + len(written)
+            count("db_rows_written", len(written), table=table)
+            count("db_unchanged", len(chunk) - len(written), table=table)
+            self.remember(table, [row[0] for row, _ in chunk])
+
+        logger.info(f"Upserted {len(parsed)} rows into {table}, {changed} "+
+                    "rows changed")
+
+        return changed
+
+    def _lookup(self, package_id: str, table: str) -> bool:
+        if not self._table_exists(table):
+            return False
+
+        with timed("db_exists_check", table=table):
+            found = self._connection().execute(
+                f"SELECT 1 FROM {table} WHERE packageId=? LIMIT 1",
+                (package_id,)).fetchone()
+
+        return found is not None
+
+    def _filter_missing(self, chunk: list, table: str) -> list:
+        if not self._table_exists(table):
+            return chunk
+
+        connection = self._connection()
+        found = set()
+
+        with timed("db_exists_check", table=table):
+            for i in range(0, len(chunk), max_parameters):
+                part = chunk[i:i + max_parameters]
+                found.update(row[0] for row in connection.execute(
+                    f"SELECT packageId FROM {table} WHERE packageId IN "+
+                    f"({','.join(['?'] * len(part))})", part))
+
+        return [doc_id for doc_id in chunk if doc_id not in found]
+
+    def _count_rows(self, table: str) -> int:
+        if not self._table_exists(table):
+            return 0
+
+        return self._connection().execute(
+            f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    def _iter_ids(self, table: str):
+        if not self._table_exists(table):
+            return
+
+        # Stream the packageId's out of the table.
+        for (package_id,) in self._connection().execute(
+                f"SELECT packageId FROM {table}"):
+            yield package_id
+
+    def backfill_child_tables(self, chunk_size: int = 1000) -> int:
+        if not self._table_exists("bills"):
+            return 0
+
+        # Make sure the child tables and their indexes are there.
+        statements = self._prepare("bills", Bills, Bills.child_rows)
+        connection = self._connection()
+        columns = ",".join(column for column, _ in
+                           Bills.STORED_CHILD_SOURCES)
+        select = (f"SELECT {columns} FROM bills WHERE packageId>? "+
+                  "ORDER BY packageId LIMIT ?")
+
+        # The last packageId migrated, and the running total.
+        last_id = ""
+        total = 0
+
+        while True:
+            # Get the next chunk of bills after the last one migrated.
+            rows = connection.execute(select, (last_id, chunk_size)).fetchall()
+            if not rows:
+                break
+
+            # Rebuild the child rows from the stored columns and swap them in.
+            with connection:
+                self._write_children(connection, statements,
+                                     [row[0] for row in rows],
+                                     [Bills.child_rows(
+                                         Bills.summary_from_stored(row))
+                                      for row in rows], replace=True)
+
+            last_id = rows[-1][0]
+            total = total + len(rows)
+            logger.info(f"Migrated the child rows of {total} bills so far")
+
+        return total
+
+    def get_bills_by_member(self, member: str, congress: int = -1,
+                            role: str = "SPONSOR") -> list:
+        if not self._table_exists("bill_members"):
+            return []
+
+        # Search both of the indexed member columns.
+        sql = ("SELECT DISTINCT packageId FROM bill_members "+
+               "WHERE (bioGuideId=? OR memberName=?) AND role=?")
+        values = [member, member, role]
+
+        # If there is a specific congress being searched for.
+        if congress != -1:
+            sql = sql + " AND congress=?"
+            values.append(congress)
+
+        return [row[0] for row in self._connection().execute(sql, values)]
+
+    def get_bill_versions(self, congress: int, bill_type: str,
+                          bill_number: int) -> list:
+        if not self._table_exists("bill_versions"):
+            return []
+
+        return self._connection().execute(
+            "SELECT packageId,billVersion,stage,dateIssued FROM "+
+            "bill_versions WHERE congress=? AND billType=? AND "+
+            "billNumber=? ORDER BY stage,dateIssued,packageId",
+            (congress, bill_type.lower(), bill_number)).fetchall()
+
+    def get_versions_of(self, package_id: str) -> list:
+        if not self._table_exists("bill_versions"):
+            return []
+
+        # Find the bill by the package and its versions by the bill index in
+        # the same query.
+        return self._connection().execute(
+            "SELECT v.packageId,v.billVersion,v.stage,v.dateIssued FROM "+
+            "bill_versions b JOIN bill_versions v ON v.congress=b.congress "+
+            "AND v.billType=b.billType AND v.billNumber=b.billNumber "+
+            "WHERE b.packageId=? ORDER BY v.stage,v.dateIssued,v.packageId",
+            (package_id,)).fetchall()
+
+    def _queue(self) -> sqlite3.Connection:
+        """
+        A helper definition that returns this thread's connection, creating
+        the work queue the first time. lease_expires is in seconds since the
+        epoch.
+        """
+        connection = self._connection()
+
+        if not self._queue_ready:
+            with connection:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS work_queue "+
+                    "(collection TEXT NOT NULL,packageId TEXT NOT NULL,"+
+                    "status INTEGER NOT NULL DEFAULT 0,worker TEXT,"+
+                    "lease_expires REAL NOT NULL DEFAULT 0,"+
+                    "attempts INTEGER NOT NULL DEFAULT 0,"+
+                    "PRIMARY KEY (collection,packageId))")
+                connection.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_work_queue_claim ON "+
+                    "work_queue (collection,status,lease_expires)")
+            self._queue_ready = True
+
+        return connection
+
+    def enqueue(self, collection: str, package_ids: list) -> int:
+        connection = self._queue()
+
+        with connection:
+            added = connection.executemany(
+                "INSERT OR IGNORE INTO work_queue (collection,packageId) "+
+                "VALUES (?,?)", [(collection, package_id)
+                                 for package_id in package_ids]).rowcount
+
+        return added
+
+    def claim(self, collection: str, worker: str, batch_size: int = 100,
+              lease_seconds: int = 600, max_attempts: int = 5) -> list:
+        connection = self._queue()
+        now = time.time()
+
+        # SQLite has no row locks to skip, so take the write lock before
+        # reading instead. Claims from other processes wait their turn, which
+        # only takes as long as the two statements.
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            claimed = [row[0] for row in connection.execute(
+                "SELECT packageId FROM work_queue WHERE collection=? AND "+
+                "status=0 AND lease_expires<=? AND attempts<? "+
+                "ORDER BY lease_expires LIMIT ?",
+                (collection, now, max_attempts, batch_size))]
+
+            connection.executemany(
+                "UPDATE work_queue SET worker=?,lease_expires=?,"+
+                "attempts=attempts+1 WHERE collection=? AND packageId=?",
+                [(worker, now + lease_seconds, collection, package_id)
+                 for package_id in claimed])
+            connection.commit()
+
+        except Exception:
+            connection.rollback()
+            raise
+
+        return claimed
+
+    def finish(self, collection: str, package_ids: list, worker: str,
+               status: int = 1) -> int:
+        connection = self._queue()
+        now = time.time()
+
+        with connection:
+            updated = connection.executemany(
+                "UPDATE work_queue SET status=?,worker=NULL,lease_expires=? "+
+                "WHERE collection=? AND worker=? AND packageId=?",
+                [(status, now, collection, worker, package_id)
+                 for package_id in package_ids]).rowcount
+
+        return updated
+
+    def _count_work(self, collection: str, max_attempts: int) -> list:
+        return self._queue().execute(
+            "SELECT status,lease_expires>?,attempts>=?,COUNT(*) FROM "+
+            "work_queue WHERE collection=? GROUP BY 1,2,3",
+            (time.time(), max_attempts, collection)).fetchall()
+
+    def _table_exists(self, table: str) -> bool:
+        """
+        A helper definition that checks whether a table has been created, so
+        nothing is reported as existing before the first write.\n
+        table   = The name of the table.
+        """
+        if table in self._tables:
+            return True
+
+        return self._connection().execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?",
+            (table,)).fetchone() is not None
+
+    def close(self):
+        super().close()
+
+        with self._lock:
+            logger.info(f"Closing {len(self._connections)} SQLite "+
+                        "connections")
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+
+        self._local = local()
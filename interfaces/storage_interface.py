@@ -0,0 +1,598 @@
+import json
+import logging
+import os
+import struct
+from abc import ABC, abstractmethod
+from threading import Lock
+
+from classes.BloomFilter import BloomFilter
+from interfaces.metrics_interface import count, timed
+
+# Create the logger for this module.
+logger = logging.getLogger(__name__)
+
+
+def parse_records(digests: list, record_class, child_builder,
+                  fingerprint: bool = True) -> list:
+    """
+    Parse each summary once and build its row and, if the table has child
+    tables, its child rows. Shared by the backends.\n
+    digests         = A list of documents in a bytes format as they are directly
+                      from the web page.\n
+    record_class    = The Record class of the collection. E.g. Bills\n
+    child_builder   = The function that builds the child rows, or None.\n
+    fingerprint     = Whether the rows need their fingerprint. See
+                      Record.row_from_digest().
+    """
+    parsed = []
+
+    for digest in digests:
+        with timed("json_parse", endpoint="summary"):
+            summary = json.loads(digest)
+        parsed.append((record_class.row_from_digest(summary, fingerprint),
+                       child_builder(summary) if child_builder else None))
+
+    return parsed
+
+
+class StorageBackend(ABC):
+    """
+    The operations the pipeline needs from a database. Each collection's
+    summaries go in the table named in its registry entry, and the rows are
+    built by its Record class. The MySQL backend is used by default, and the
+    SQLite backend needs no server at all.
+
+    With use_index(), each table also gets a membership index: a Bloom filter
+    of the packageId's in it, kept on disk between runs and added to on every
+    write. Existence checks for packages the filter has never seen are
+    answered without touching the database, and only the maybes are looked up.
+
+    Backends have to implement every abstract method, so one that is missing
+    any of them fails when it's created rather than partway through a run.
+    """
+    # The name used to pick the backend in the config.
+    name = None
+
+    # The smallest number of packageId's an index is sized for, so a new
+    # table doesn't need its index rebuilt straight away.
+    min_index_capacity = 100000
+
+    def __init__(self):
+        # Where the membership indexes are kept, and the index of each table.
+        # No indexes are used until use_index() is called.
+        self.index_directory = None
+        self.index_error_rate = 0.001
+        self._indexes = {}
+        self._index_lock = Lock()
+
+    @abstractmethod
+    def insert_batch(self, digests: list, table: str, record_class,
+                     chunk_size: int = 500, child_builder=None) -> list:
+        """
+        Insert many summaries, skipping the ones that are already in the
+        table. Returns the packageId's that were skipped.\n
+        digests         = A list of documents in a bytes format as they are
+                          directly from the web page.\n
+        table           = The name of the table. E.g. bills\n
+        record_class    = The Record class of the collection. E.g. Bills\n
+        chunk_size      = The number of rows to write in each transaction.\n
+        child_builder   = The function that builds the rows of the table's
+                          child tables, or None if it doesn't have any.
+        """
+
+    @abstractmethod
+    def upsert_batch(self, digests: list, table: str, record_class,
+                     chunk_size: int = 500, child_builder=None) -> int:
+        """
+        Insert many summaries, replacing the ones that are already in the
+        table if the new copy was modified more recently. Returns the number
+        of rows that changed. See insert_batch() for the arguments.
+        """
+
+    def insert_one(self, digest: bytes, table: str, record_class,
+                   child_builder=None) -> bool:
+        """
+        Insert a single summary if it isn't already in the table. Returns
+        whether it was inserted. See insert_batch() for the arguments.
+        """
+        return not self.insert_batch([digest], table, record_class, 1,
+                                     child_builder)
+
+    def exists(self, package_id: str, table: str) -> bool:
+        """
+        Check whether a package is in a table.\n
+        package_id  = The packageId of the document to be checked.\n
+        table       = The table to check. E.g. bills
+        """
+        index = self._index(table)
+
+        # The index has never seen it, so it can't be there.
+        if index is not None and package_id not in index:
+            count("index_lookups", table=table, result="absent")
+            return False
+
+        found = self._lookup(package_id, table)
+
+        if index is not None:
+            count("index_lookups", table=table,
+                  result="present" if found else "false_positive")
+
+        return found
+
+    def iter_missing(self, doc_ids, table: str, chunk_size: int = 500):
+        """
+        Yield the packageId's that aren't in the table yet, checking them a
+        chunk at a time.\n
+        doc_ids     = Any iterable of packageId's.\n
+        table       = The table to check. E.g. bills\n
+        chunk_size  = The number of packageId's checked in each query.
+        """
+        chunk = []
+
+        for doc_id in doc_ids:
+            chunk.append(doc_id)
+
+            # Once the chunk is full, check it and hand out whatever is
+            # missing.
+            if len(chunk) >= chunk_size:
+                yield from self._check_chunk(chunk, table)
+                chunk = []
+
+        # Check whatever is left over.
+        if chunk:
+            yield from self._check_chunk(chunk, table)
+
+    def _check_chunk(self, chunk: list, table: str) -> list:
+        """
+        A helper definition that returns the packageId's in a chunk that
+        aren't in the table, in the same order. Only the ones the index might
+        have seen are looked up.\n
+        chunk   = A list of packageId's.\n
+        table   = The table to check. E.g. bills
+        """
+        index = self._index(table)
+
+        if index is None:
+            return self._filter_missing(chunk, table)
+
+        maybe = [doc_id for doc_id in chunk if doc_id in index]
+        count("index_lookups", len(chunk) - len(maybe), table=table,
+              result="absent")
+
+        if not maybe:
+            return chunk
+
+        missing = set(self._filter_missing(maybe, table))
+        count("index_lookups", len(maybe) - len(missing), table=table,
+              result="present")
+        count("index_lookups", len(missing), table=table,
+              result="false_positive")
+        maybe = set(maybe)
+
+        return [doc_id for doc_id in chunk
+                if doc_id not in maybe or doc_id in missing]
+
+    def check_all(self, doc_list: list, table: str) -> list:
+        """
+        Remove every packageId that is already in the table from the list, in
+        place, and return it.\n
+        doc_list    = A list of packageId's.\n
+        table       = The table to check. E.g. bills
+        """
+        doc_list[:] = list(self.iter_missing(doc_list, table))
+
+        return doc_list
+
+    @abstractmethod
+    def _lookup(self, package_id: str, table: str) -> bool:
+        """
+        Look a single package up in the database itself.\n
+        package_id  = The packageId of the document to be checked.\n
+        table       = The table to check. E.g. bills
+        """
+
+    @abstractmethod
+    def _filter_missing(self, chunk: list, table: str) -> list:
+        """
+        Return the packageId's in a chunk that aren't in the table, in the
+        same order, by asking the database.\n
+        chunk   = A list of packageId's.\n
+        table   = The table to check. E.g. bills
+        """
+
+    @abstractmethod
+    def _count_rows(self, table: str) -> int:
+        """
+        Return the number of rows in a table, or 0 if it doesn't exist yet.\n
+        table   = The table to count. E.g. bills
+        """
+
+    @abstractmethod
+    def _iter_ids(self, table: str):
+        """
+        Yield every packageId in a table, or nothing if it doesn't exist yet.\n
+        table   = The table to read. E.g. bills
+        """
+
+    def use_index(self, directory: str, error_rate: float = 0.001):
+        """
+        Keep a membership index of every table in front of the existence
+        checks. Each index is read from the directory the first time its table
+        is checked, or built from the table if there isn't one, and written
+        back by close(). The file is removed while it's in use, so if the
+        program dies before close() the next run rebuilds it rather than
+        trusting one that's missing packages. The number of rows in the table
+        is saved next to it, and if the table has a different number when it's
+        read, something wrote to the table without the index, so it's rebuilt
+        too.\n
+        directory   = Where the index files are kept.\n
+        error_rate  = The fraction of missing packages that still get looked
+                      up in the database.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.index_directory = directory
+        self.index_error_rate = error_rate
+
+    def _index_path(self, table: str) -> str:
+        """
+        A helper definition that returns where a table's index is kept.\n
+        table   = The name of the table. E.g. bills
+        """
+        return os.path.join(self.index_directory, f"{self.name}_{table}.bloom")
+
+    def _read_index_rows(self, table: str) -> int:
+        """
+        A helper definition that reads the number of rows a table had when its
+        index was saved, and takes the file out of use along with the index.
+        Returns None if there isn't a usable one.\n
+        table   = The name of the table. E.g. bills
+        """
+        path = self._index_path(table) + ".rows"
+
+        try:
+            with open(path, 'rt') as rows_file:
+                rows = int(rows_file.read())
+
+        except (OSError, ValueError):
+            rows = None
+
+        if os.path.isfile(path):
+            os.remove(path)
+
+        return rows
+
+    def _index(self, table: str) -> BloomFilter:
+        """
+        A helper definition that returns a table's index, loading or building
+        it the first time. Returns None if indexes aren't being used.\n
+        table   = The name of the table. E.g. bills
+        """
+        if self.index_directory is None:
+            return None
+
+        index = self._indexes.get(table)
+        if index is not None:
+            return index
+
+        with self._index_lock:
+            # Another thread may have loaded it while this one waited.
+            if table not in self._indexes:
+                self._indexes[table] = self._load_index(table)
+
+        return self._indexes[table]
+
+    def _load_index(self, table: str) -> BloomFilter:
+        """
+        A helper definition that reads a table's index from its file, or
+        builds a new one from the table if there's no usable file.\n
+        table   = The name of the table. E.g. bills
+        """
+        path = self._index_path(table)
+        saved_rows = self._read_index_rows(table)
+        rows = self._count_rows(table)
+
+        if os.path.isfile(path):
+            try:
+                index = BloomFilter.load(path)
+
+            except (OSError, ValueError, struct.error) as err:
+                logger.warning(f"Could not read the index \'{path}\'. "+
+                               f"Rebuilding it. {err}")
+                index = None
+
+            # Take it out of use so a crash means a rebuild next time.
+            os.remove(path)
+
+            # If the table changed since the index was saved, something wrote
+            # to it without adding to the index, so it can't be trusted.
+            if index is not None and saved_rows != rows:
+                logger.info(f"The index of {table} was saved with "+
+                            f"{saved_rows} rows but the table has {rows}. "+
+                            "Rebuilding it.")
+                index = None
+
+            # Once it's holding more than it was sized for, the false
+            # positives climb, so build a bigger one instead.
+            if index is not None and len(index) <= index.capacity:
+                logger.info(f"Loaded the index of {table} with {len(index)} "+
+                            "packageId's")
+                return index
+
+        index = BloomFilter(max(rows * 2, self.min_index_capacity),
+                            self.index_error_rate)
+        index.update(self._iter_ids(table))
+
+        logger.info(f"Built the index of {table} from {len(index)} "+
+                    "packageId's")
+
+        return index
+
+    def remember(self, table: str, package_ids: list):
+        """
+        Add packages that were just written to a table's index. Does nothing
+        if the index hasn't been loaded yet, since it's built from the table
+        when it is.\n
+        table       = The name of the table. E.g. bills\n
+        package_ids = The packageId's that were written.
+        """
+        index = self._indexes.get(table)
+
+        if index is not None:
+            index.update(package_ids)
+
+    # The statuses of the packages in the work queue. A pending package is
+    # leased while its lease_expires is in the future.
+    queue_pending = 0
+    queue_done = 1
+    queue_failed = 2
+
+    @abstractmethod
+    def enqueue(self, collection: str, package_ids: list) -> int:
+        """
+        Add packages to the work queue that workers share, skipping any that
+        are already in it. Returns the number that were added.\n
+        collection  = The collectionCode. E.g. BILLS\n
+        package_ids = The packageId's to add.
+        """
+
+    @abstractmethod
+    def claim(self, collection: str, worker: str, batch_size: int = 100,
+              lease_seconds: int = 600, max_attempts: int = 5) -> list:
+        """
+        Lease a batch of pending packages from the work queue so no other
+        worker takes them until the lease runs out. Packages whose lease ran
+        out without being finished are claimed again, up to max_attempts
+        times. Returns the packageId's that were claimed, which is empty once
+        there's nothing left to claim.\n
+        collection      = The collectionCode. E.g. BILLS\n
+        worker          = The name of the worker claiming them.\n
+        batch_size      = The most packages to claim.\n
+        lease_seconds   = How long the worker has to finish them.\n
+        max_attempts    = How many times a package can be claimed before it's
+                          given up on.
+        """
+
+    @abstractmethod
+    def finish(self, collection: str, package_ids: list, worker: str,
+               status: int = 1) -> int:
+        """
+        Record that a worker is done with packages it claimed. A package that
+        another worker has claimed since is left alone. Returns the number of
+        packages updated.\n
+        collection  = The collectionCode. E.g. BILLS\n
+        package_ids = The packageId's that are done.\n
+        worker      = The name of the worker that claimed them.\n
+        status      = queue_done, queue_failed, or queue_pending to hand them
+                      back for another worker straight away.
+        """
+
+    def queue_counts(self, collection: str, max_attempts: int = 5) -> dict:
+        """
+        Count the packages in the work queue that are pending, leased, done,
+        failed, or exhausted because they ran out of attempts.\n
+        collection      = The collectionCode. E.g. BILLS\n
+        max_attempts    = See claim().
+        """
+        counts = {"pending": 0, "leased": 0, "done": 0, "failed": 0,
+                  "exhausted": 0}
+
+        for status, leased, exhausted, number in self._count_work(
+                collection, max_attempts):
+            if status == self.queue_done:
+                state = "done"
+            elif status == self.queue_failed:
+                state = "failed"
+            elif leased:
+                state = "leased"
+            elif exhausted:
+                state = "exhausted"
+            else:
+                state = "pending"
+            counts[state] = counts[state] + number
+
+        return counts
+
+    @abstractmethod
+    def _count_work(self, collection: str, max_attempts: int) -> list:
+        """
+        Return (status, leased, exhausted, count) rows for the work queue. See
+        queue_counts().
+        """
+
+    @abstractmethod
+    def backfill_child_tables(self, chunk_size: int = 1000) -> int:
+        """
+        Fill the child tables of the bills from the columns of every bill
+        already in the table, replacing any child rows they have. Bills are
+        migrated in packageId order a chunk at a time, one transaction each,
+        so it is safe to run again if it's stopped partway through. Returns
+        the number of bills migrated.\n
+        chunk_size  = The number of bills to migrate in each transaction.
+        """
+
+    @abstractmethod
+    def get_bills_by_member(self, member: str, congress: int = -1,
+                            role: str = "SPONSOR") -> list:
+        """
+        Get the packageId's of every bill a member is listed on, using the
+        indexed bill_members table.\n
+        member      = The bioGuideId or the memberName of the member.
+                      E.g. G000359 or "Graham, Lindsey"\n
+        congress    = The number of the congress to search in. Not necessary
+                      to run.\n
+        role        = The role the member has on the bill. E.g. SPONSOR,
+                      COSPONSOR
+        """
+
+    @abstractmethod
+    def get_bill_versions(self, congress: int, bill_type: str,
+                          bill_number: int) -> list:
+        """
+        Get every version of a bill in the order it moved through Congress
+        from the bill_versions table. Returns (packageId, billVersion, stage,
+        dateIssued) for each one.\n
+        congress    = The number of the congress the bill is from. E.g. 116\n
+        bill_type   = The type of the bill. E.g. hr\n
+        bill_number = The number of the bill. E.g. 1234
+        """
+
+    @abstractmethod
+    def get_versions_of(self, package_id: str) -> list:
+        """
+        Get every version of the bill a package is a version of, itself
+        included. See get_bill_versions().\n
+        package_id  = The packageId of any version of the bill.
+                      E.g. BILLS-116hr1234ih
+        """
+
+    def close(self):
+        """
+        Write out the membership indexes, each with the number of rows in its
+        table. Backends close their connections after calling this.
+        """
+        with self._index_lock:
+            for table, index in self._indexes.items():
+                path = self._index_path(table)
+                index.save(path)
+                with open(path + ".rows", 'wt') as rows_file:
+                    rows_file.write(str(self._count_rows(table)))
+                logger.info(f"Saved the index of {table} with {len(index)} "+
+                            "packageId's")
+            self._indexes.clear()
+
+
+class MySQLBackend(StorageBackend):
+    """
+    The MySQL server the credentials in sensitive/database_credentials point
+    to, reached through the connection pool in interfaces/sql_interface.py.\n
+    pool_size   = The maximum number of connections to keep open at once.
+    """
+    name = "mysql"
+
+    def __init__(self, pool_size: int = 5):
+        super().__init__()
+
+        # Only import the connector when MySQL is actually used, so the SQLite
+        # backend runs without it installed.
+        import interfaces.sql_interface as sql_interface
+
+        self.sql = sql_interface
+        self.sql.init_pool(pool_size)
+
+    def insert_batch(self, digests: list, table: str, record_class,
+                     chunk_size: int = 500, child_builder=None) -> list:
+        return self.sql.insert_record_batch(
+            digests, table, record_class, chunk_size, child_builder,
+            lambda package_ids: self.remember(table, package_ids))
+
+    def upsert_batch(self, digests: list, table: str, record_class,
+                     chunk_size: int = 500, child_builder=None) -> int:
+        return self.sql.upsert_record_batch(
+            digests, table, record_class, chunk_size, child_builder,
+            lambda package_ids: self.remember(table, package_ids))
+
+    def _lookup(self, package_id: str, table: str) -> bool:
+        return self.sql.check_if_exists(package_id, table)
+
+    def _filter_missing(self, chunk: list, table: str) -> list:
+        return list(self.sql.iter_missing(chunk, table, len(chunk)))
+
+    def _count_rows(self, table: str) -> int:
+        return self.sql.count_rows(table)
+
+    def _iter_ids(self, table: str):
+        return self.sql.iter_package_ids(table)
+
+    def enqueue(self, collection: str, package_ids: list) -> int:
+        return self.sql.enqueue_work(collection, package_ids)
+
+    def claim(self, collection: str, worker: str, batch_size: int = 100,
+              lease_seconds: int = 600, max_attempts: int = 5) -> list:
+        return self.sql.claim_work(collection, worker, batch_size,
+                                   lease_seconds, max_attempts)
+
+    def finish(self, collection: str, package_ids: list, worker: str,
+               status: int = 1) -> int:
+        return self.sql.finish_work(collection, package_ids, worker, status)
+
+    def _count_work(self, collection: str, max_attempts: int) -> list:
+        return self.sql.count_work(collection, max_attempts)
+
+    def backfill_child_tables(self, chunk_size: int = 1000) -> int:
+        return self.sql.backfill_child_tables(chunk_size)
+
+    def get_bills_by_member(self, member: str, congress: int = -1,
+                            role: str = "SPONSOR") -> list:
+        return self.sql.get_bills_by_member(member, congress, role)
+
+    def get_bill_versions(self, congress: int, bill_type: str,
+                          bill_number: int) -> list:
+        return self.sql.get_bill_versions(congress, bill_type, bill_number)
+
+    def get_versions_of(self, package_id: str) -> list:
+        return self.sql.get_versions_of(package_id)
+
+    def close(self):
+        super().close()
+        self.sql.close_pool()
+
+
+# The backend every collection is written to. None until set_backend() is
+# called.
+storage_backend = None
+
+
+def set_backend(name: str = "mysql", **options) -> StorageBackend:
+    """
+    Pick the database the pipeline writes to, closing the one used before.\n
+    name    = Either mysql or sqlite.\n
+    options = The options of the backend. E.g. pool_size=5 for mysql or
+              path="content/billme.db" for sqlite.
+    """
+    global storage_backend
+
+    if storage_backend is not None:
+        storage_backend.close()
+
+    if name == "mysql":
+        storage_backend = MySQLBackend(**options)
+
+    elif name == "sqlite":
+        from interfaces.sqlite_interface import SQLiteBackend
+        storage_backend = SQLiteBackend(**options)
+
+    else:
+        raise ValueError(f"{name} is not a storage backend. Use mysql or "+
+                         "sqlite.")
+
+    logger.info(f"Storing the packages with the {name} backend")
+
+    return storage_backend
+
+
+def get_backend() -> StorageBackend:
+    """Return the backend in use, starting the MySQL one if none is set."""
+    if storage_backend is None:
+        set_backend()
+
+    return storage_backend
@@ -0,0 +1,60 @@
+# Replays the raw summaries kept in the archives into the database without
+# touching the API, e.g. `python replay.py BILLS`. The archives are only kept
+# while archive_summaries is on in the config. Otherwise the sync_collections
+# list in the config is used, which defaults to just BILLS. See
+# interfaces/archive_interface.py.
+
+import json
+import logging
+import os
+import sys
+
+from interfaces.archive_interface import *
+from interfaces.collection_registry import *
+from interfaces.logging_interface import *
+from interfaces.storage_interface import *
+
+# Create the logger for the program.
+logger = logging.getLogger("replay")
+
+# Read the config, if there is one.
+config = {}
+if os.path.isfile("configs/config.json"):
+    with open("configs/config.json", 'rt') as config_file:
+        config = json.load(config_file)
+
+# Log to its own file so the last run's log isn't rotated out.
+setup_logging(config.get("replay_log_file", "Bill_The_replay.log"),
+              config.get("log_level", "INFO"), config.get("log_levels"),
+              config.get("log_max_mb", 10), config.get("log_backups", 5),
+              config.get("log_format", "text") == "json")
+
+# Work out which collections to replay.
+doc_types = sys.argv[1:] or config.get("sync_collections", ["BILLS"])
+
+# Make sure every collection is known before anything starts.
+for doc_type in doc_types:
+    get_registered(doc_type)
+
+# Open the same database run.py writes to.
+if config.get("backend", "mysql") == "sqlite":
+    set_backend("sqlite", path=config.get("sqlite_path",
+                                          f"{save_location}billme.db"))
+else:
+    set_backend("mysql", pool_size=config.get("pool_size", 5))
+
+# Open the archives where run.py keeps them.
+enable_archive(max_segment_mb=config.get("archive_segment_mb", 64))
+
+# Replay each collection in turn.
+for doc_type in doc_types:
+    replay_archive(doc_type, batch_size=config.get("batch_size", 500))
+
+# Close the archives and the database.
+close_archives()
+get_backend().close()
+
+logger.info("Replay complete.")
+
+# Write out whatever is still waiting to be logged.
+shutdown_logging()
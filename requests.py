@@ -1,105 +1,276 @@
 import json
+import logging
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timedelta
 from time import gmtime, strftime
 
 from interfaces.api_interface import *
+from interfaces.metrics_interface import timed
 
+# Create the logger for this module.
+logger = logging.getLogger(__name__)
 
-def get_list_of_type(doc_type: str, write_to_file: bool,
-                     num_entries: int) -> list:
+
+# The API won't page past this many items in one query, so every date window
+# has to hold fewer than this.
+max_query_items = 10000
+
+# The earliest date the crawler will walk back to.
+earliest_date = "1993-01-01T00:00:00Z"
+
+
+def _get_published_page(doc_type: str, start: datetime, end: datetime,
+                        offset: int, page_size: int) -> dict:
     """
-    Get all of the specified type of items. For example, "BILLS" will retrieve
-    the packageId of all bills.\n
+    A helper definition to get one page of published documents in a date
+    window and parse it.\n
+    doc_type    = The type of document you want to retrieve. E.g. BILLS\n
+    start       = The start of the window.\n
+    end         = The end of the window.\n
+    offset      = The number of items to skip.\n
+    page_size   = The number of items on the page.
+    """
+    # Set the current format to the ISO8601 format.
+    time_format = "%Y-%m-%dT%H:%M:%SZ"
+
+    page = get_published(start.strftime(time_format), doc_type,
+                         end.strftime(time_format), offset, page_size)
+
+    with timed("json_parse", endpoint="published"):
+        return json.loads(page)
+
+
+def _split_window(executor: ThreadPoolExecutor, doc_type: str,
+                  start: datetime, end: datetime, first_page: dict,
+                  page_size: int) -> list:
+    """
+    A helper definition that splits a date window in half, over and over, until
+    every piece holds fewer items than the API will page through. Returns a
+    list of (start, end, first_page) tuples, newest first.\n
+    executor    = The thread pool the requests are made on.\n
+    doc_type    = The type of document you want to retrieve. E.g. BILLS\n
+    start       = The start of the window.\n
+    end         = The end of the window.\n
+    first_page  = The already parsed first page of the window.\n
+    page_size   = The number of items on each page.
+    """
+    # If the window is small enough, or can't be split any further, keep it.
+    if (first_page.get('count', 0) < max_query_items or
+            end - start <= timedelta(seconds=1)):
+        return [(start, end, first_page)]
+
+    logger.debug(f"Window {start} to {end} has {first_page.get('count')} "+
+                 "entries, splitting it.")
+
+    # Split it into two halves that don't overlap and get both first pages.
+    middle = start + (end - start) / 2
+    halves = [(middle, end), (start, middle - timedelta(seconds=1))]
+    pages = executor.map(lambda half: _get_published_page(
+        doc_type, half[0], half[1], 0, page_size), halves)
+
+    # Split each of the halves again if they're still too big.
+    windows = []
+    for (half_start, half_end), page in zip(halves, pages):
+        windows.extend(_split_window(executor, doc_type, half_start,
+                                     half_end, page, page_size))
+
+    return windows
+
+
+def _windows_needed(counts: list, needed: int) -> int:
+    """
+    A helper definition that returns how many windows, newest first, it takes
+    for their entries to add up to the number still needed, or all of them if
+    they never do.\n
+    counts  = The number of entries in each window, newest first.\n
+    needed  = The number of entries still needed.
+    """
+    running = 0
+
+    for number, window_count in enumerate(counts, 1):
+        running = running + window_count
+        if running >= needed:
+            return number
+
+    return len(counts)
+
+
+def iter_list_of_type(doc_type: str, num_entries: int, max_workers: int = 8,
+                      page_size: int = 100, resume: dict = None,
+                      on_batch=None):
+    """
+    Yield the packageId of every item of the specified type as the pages come
+    in, newest first. Works backwards from now in date windows that are sized
+    from the counts the API returns so each stays under its 10,000 item limit.
+    The windows and the pages within them are fetched concurrently, and every
+    page is parsed exactly once. Only one batch of windows is held in memory at
+    a time.\n
     doc_type        = The type of document you want to retrieve. E.g. BILLS\n
-    write_to_file   = Whether or not you want to write the list to a file or
-                      have it returned as a list.
     num_entries     = The number of entries that need to be pulled. This ensures
                       that the program will not pull ALL of them every single
-                      time.
+                      time.\n
+    max_workers     = The maximum number of pages being fetched at once.\n
+    page_size       = The number of entries on each page.\n
+    resume          = A cursor passed to on_batch by an earlier call. The crawl
+                      continues from there and only yields the new entries.\n
+    on_batch        = Called with the packageId's and the cursor after each
+                      batch of windows so the progress can be recorded.
     """
-
     # Set the current format to the ISO8601 format.
     time_format = "%Y-%m-%dT%H:%M:%SZ"
 
-    # Set the end date to the current time.
-    end_date = datetime.strftime(datetime.now(), time_format)
+    # Set the end date to the current time, in UTC like the API and
+    # get_modified_since(), and work out how far back the crawler is allowed
+    # to go.
+    end_date = datetime.utcnow().replace(microsecond=0)
+    floor_date = datetime.strptime(earliest_date, time_format)
 
-    # Build an initially empty list to hold the packageId's.
-    item_list = []
+    # Start with windows one week long. This is adjusted as the counts come in.
+    window = timedelta(weeks=1)
 
     # Instantiate an initially empty integer to track the total number of
     # entries done.
     total_num = 0
 
-    # A short loop counter to ensure we're getting all of the entries we need
-    # before moving on.
-    j = 0
-
-    # The while loop where all of the logic is done.
-    while True:
-        # Set the start date to a time exactly one week prior to the end_date.
-        # Small intervals are used to ensure the program does not exceed the
-        # 10,000 item limit of the API.
-        start_date = (datetime.strptime(end_date, time_format)-
-                      timedelta(weeks=1)).__format__(time_format)
-
-        # Get the initial list of published documents.
-        pub_list = get_published(start_date, doc_type, end_date, page_size=100)
-
-        # Get the number of documents in the current listing. Will be the total
-        # number of entries in the current selection and is not necessarily
-        # equal to unit_count.
-        count = json.loads(pub_list).get('count')
-
-        # Get the next page from the listing.
-        next_page = json.loads(pub_list).get('nextPage')
-
-        # If the number of entries recorded, "j", is less than the total number
-        # of entries in the current selection, "count", then continue to iterate
-        # over it.
-        while j < count:
-            # Get the packageId's for each of the entries in the current
-            # selection.
-            for item in json.loads(pub_list).get('packages'):
-                item_list.append(item.get('packageId'))
-
-                # Iterate the small counter.
-                j = j + 1
-
-                # Iterate the overall counter.
-                total_num = total_num + 1
-
-            # If there is no next page, go on to the next list.
-            if next_page == None:
-                break
-
-            # If there is a next page, notify the logger, gather the page, and
-            # move on to it.
+    # If an earlier crawl was interrupted, continue from where it stopped.
+    if resume:
+        end_date = datetime.strptime(resume.get("end_date"), time_format)
+        window = timedelta(seconds=resume.get("window"))
+        total_num = resume.get("total")
+        logger.info(f"Resuming the crawl from {end_date} with {total_num} "+
+                    "entries gathered.")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Keep going until enough entries are gathered or there's nothing left.
+        while total_num < num_entries and end_date > floor_date:
+            # Build the next batch of windows, one per worker, walking back
+            # from the end date. The windows don't overlap so there are no gaps
+            # or double counts between them.
+            windows = []
+            while len(windows) < max_workers and end_date > floor_date:
+                start_date = max(end_date - window, floor_date)
+                windows.append((start_date, end_date))
+                end_date = start_date - timedelta(seconds=1)
+
+            # Get the first page of each of the windows at the same time. This
+            # also tells us how many entries are in each.
+            first_pages = list(executor.map(
+                lambda window_range: _get_published_page(
+                    doc_type, window_range[0], window_range[1], 0, page_size),
+                windows))
+
+            # Only keep the windows it takes to reach num_entries, so no more
+            # is fetched than the crawl did one window at a time. The next
+            # batch, or a resumed crawl, starts just before the last one kept.
+            keep = _windows_needed([page.get('count', 0)
+                                    for page in first_pages],
+                                   num_entries - total_num)
+            if keep < len(windows):
+                windows = windows[:keep]
+                first_pages = first_pages[:keep]
+                end_date = windows[-1][0] - timedelta(seconds=1)
+
+            # Split any of the windows that are too big for the API to page.
+            resolved = []
+            for (start_date, window_end), first_page in zip(windows,
+                                                            first_pages):
+                resolved.extend(_split_window(executor, doc_type, start_date,
+                                              window_end, first_page,
+                                              page_size))
+
+            # Splitting the last window can leave pieces that aren't needed
+            # either.
+            keep = _windows_needed([page.get('count', 0)
+                                    for _, _, page in resolved],
+                                   num_entries - total_num)
+            if keep < len(resolved):
+                resolved = resolved[:keep]
+                end_date = resolved[-1][0] - timedelta(seconds=1)
+
+            # Request the rest of the pages of every window at once.
+            rest = []
+            for start_date, window_end, first_page in resolved:
+                rest.append([executor.submit(_get_published_page, doc_type,
+                                             start_date, window_end, offset,
+                                             page_size)
+                             for offset in range(page_size,
+                                                 first_page.get('count', 0),
+                                                 page_size)])
+
+            # Hand out the packageId's in order, newest window first, as soon
+            # as each page is ready while the later pages are still loading.
+            # The windows don't overlap, so duplicates can only come from
+            # within the batch.
+            batch_items = []
+            seen = set()
+            for (start_date, window_end, first_page), pages in zip(resolved,
+                                                                   rest):
+                for page in [first_page] + pages:
+                    if isinstance(page, Future):
+                        page = page.result()
+
+                    for item in page.get('packages', []):
+                        package_id = item.get('packageId')
+
+                        # Iterate the overall counter.
+                        total_num = total_num + 1
+
+                        if package_id in seen:
+                            continue
+                        seen.add(package_id)
+                        batch_items.append(package_id)
+                        yield package_id
+
+            # Resize the windows so the next batch holds about half of what
+            # the API allows per window, between an hour and a year long.
+            batch_count = sum(page.get('count', 0) for _, _, page in resolved)
+            batch_span = sum(((window_end - start_date) for start_date,
+                              window_end, _ in resolved), timedelta())
+            if batch_count:
+                window = batch_span * (max_query_items / 2) / batch_count
             else:
-                logger.debug(f"Moving to page {next_page}")
-                link = next_page + "&api_key=" + get_API_key()
-                pub_list = get_page(link)
+                window = window * 2
+            window = min(max(window, timedelta(hours=1)), timedelta(days=365))
 
-                # Set the new nextPage so the program can gather the last page
-                # of entries within the set.
-                next_page = json.loads(pub_list).get('nextPage')
+            # Record the batch and where the next one starts.
+            if on_batch:
+                on_batch(batch_items, {"end_date": end_date.strftime(
+                    time_format), "window": window.total_seconds(),
+                    "total": total_num})
 
-        # Reset the inner counter so it can be used to track the current number
-        # of gathered entries.
-        j = 0
+            # Inform the logger of the number of entries gathered up to this
+            # point.
+            logger.info(f"Gathered {total_num} entries so far.")
 
-        # Set the new end date to be the old start date. This ensures there is
-        # no gaps in the data being gathered.
-        end_date = (datetime.strptime(start_date, time_format)-
-                    timedelta(seconds=-1)).__format__(time_format)
+    # if all of the entries have been gathered, the loop is done.
+    logger.info("Goal reached, exiting loop.")
 
-        # Inform the logger of the number of entries gathered up to this point.
-        logger.info(f"Gathered {total_num} entries so far.")
 
-        # if all of the entries have been gathered, break the loop. It's done.
-        if total_num >= num_entries:
-            logger.info("Goal reached, exiting loop.")
-            break
+def get_list_of_type(doc_type: str, write_to_file: bool,
+                     num_entries: int, max_workers: int = 8,
+                     page_size: int = 100, resume: dict = None,
+                     on_batch=None) -> list:
+    """
+    Get all of the specified type of items. For example, "BILLS" will retrieve
+    the packageId of all bills. Collects everything iter_list_of_type() yields,
+    newest first with duplicates removed.\n
+    doc_type        = The type of document you want to retrieve. E.g. BILLS\n
+    write_to_file   = Whether or not you want to write the list to a file or
+                      have it returned as a list.
+    num_entries     = The number of entries that need to be pulled. This ensures
+                      that the program will not pull ALL of them every single
+                      time.\n
+    max_workers     = The maximum number of pages being fetched at once.\n
+    page_size       = The number of entries on each page.\n
+    resume          = A cursor passed to on_batch by an earlier call. The crawl
+                      continues from there and only returns the new entries.\n
+    on_batch        = Called with the packageId's and the cursor after each
+                      batch of windows so the progress can be recorded.
+    """
+    # Gather every packageId, removing any duplicates while keeping the order.
+    item_list = list(dict.fromkeys(iter_list_of_type(
+        doc_type, num_entries, max_workers, page_size, resume, on_batch)))
 
     # Check whether the user wants to write the list to a file or simply return
     # it to be manipulated further.
@@ -112,3 +283,141 @@ def get_list_of_type(doc_type: str, write_to_file: bool,
     # If the user simply wants to return the list.
     else:
         return item_list
+
+
+def _get_collection_page(doc_type: str, start: datetime, end: datetime,
+                         offset: int, page_size: int) -> dict:
+    """
+    A helper definition to get one page of the documents modified in a date
+    window and parse it.\n
+    doc_type    = The type of document you want to retrieve. E.g. BILLS\n
+    start       = The start of the window.\n
+    end         = The end of the window.\n
+    offset      = The number of items to skip.\n
+    page_size   = The number of items on the page.
+    """
+    # Set the current format to the ISO8601 format.
+    time_format = "%Y-%m-%dT%H:%M:%SZ"
+
+    page = get_collection(doc_type, start.strftime(time_format),
+                          end.strftime(time_format), offset, page_size)
+
+    with timed("json_parse", endpoint="collection"):
+        return json.loads(page)
+
+
+def get_modified_since(doc_type: str, since: str, page_size: int = 1000,
+                       max_workers: int = 8) -> tuple:
+    """
+    Get the packageId's of every document of the specified type that has been
+    added or modified since a point in time, using the collections endpoint.
+    Returns a tuple of the list of packageId's, newest first, and the latest
+    lastModified that was seen so it can be used as the next high-water mark.\n
+    doc_type    = The type of document you want to retrieve. E.g. BILLS\n
+    since       = The high-water mark from the last run in the
+                  YYYY-MM-DD'T'HH:MM:SS'Z' format.\n
+    page_size   = The number of entries on each page.\n
+    max_workers = The maximum number of pages being fetched at once.
+    """
+    # Set the current format to the ISO8601 format.
+    time_format = "%Y-%m-%dT%H:%M:%SZ"
+
+    # Start with one window from the high-water mark up to now.
+    windows = [(datetime.strptime(since, time_format),
+                datetime.utcnow().replace(microsecond=0))]
+
+    # Build an initially empty list to hold the packageId's.
+    item_list = []
+
+    # The latest lastModified seen so far. ISO8601 strings sort by time.
+    high_water = since
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while windows:
+            start_date, end_date = windows.pop()
+
+            # Get the first page, which also says how many entries there are.
+            first_page = _get_collection_page(doc_type, start_date, end_date,
+                                              0, page_size)
+            count = first_page.get('count', 0)
+
+            # If there are too many for the API to page through, split the
+            # window in half. The newer half is pushed last so it's done first.
+            if (count >= max_query_items and
+                    end_date - start_date > timedelta(seconds=1)):
+                middle = start_date + (end_date - start_date) / 2
+                windows.append((start_date, middle))
+                windows.append((middle + timedelta(seconds=1), end_date))
+                continue
+
+            # Get the rest of the pages of the window at the same time.
+            rest = executor.map(lambda offset: _get_collection_page(
+                doc_type, start_date, end_date, offset, page_size),
+                range(page_size, count, page_size))
+
+            for page in [first_page] + list(rest):
+                for item in page.get('packages', []):
+                    item_list.append(item.get('packageId'))
+                    high_water = max(high_water,
+                                     item.get('lastModified') or high_water)
+
+    logger.info(f"{len(item_list)} entries modified since {since}.")
+
+    # Remove any duplicates while keeping the order.
+    return (list(dict.fromkeys(item_list)), high_water)
+
+
+def _collect_summary(pkgID: str, future: Future) -> tuple:
+    """
+    A helper definition that waits for a summary to finish downloading and
+    turns an error into part of the result instead of raising it, so one
+    package that can't be pulled doesn't stop the rest.\n
+    pkgID   = The packageId the future is downloading.\n
+    future  = The future returned by the thread pool.
+    """
+    try:
+        return (pkgID, future.result(), None)
+
+    # Some documents could not be pulled due to internal server error, or the
+    # connection kept failing after get_page() ran out of retries. Hand the
+    # error back so the caller can record it.
+    except (HTTPError, IncompleteRead, URLError, ConnectionError,
+            TimeoutError) as error:
+        return (pkgID, None, error)
+
+
+def fetch_summaries(pkg_ids, max_workers: int = 8,
+                    stale_before: float = None):
+    """
+    Download the summaries of many packages at once with a pool of threads.
+    Yields a (packageId, summary, error) tuple for each package in the same
+    order they were given. summary is None and error is the HTTPError or
+    connection error if the package couldn't be pulled.\n
+    pkg_ids         = Any iterable of packageId's. It is read lazily so it can
+                      be a generator.\n
+    max_workers     = The maximum number of summaries being downloaded at
+                      once.\n
+    stale_before    = Revalidate cached summaries stored before this time, in
+                      seconds since the epoch. See get_page().
+    """
+    # Inform the logger of the number of workers.
+    logger.info(f"Fetching summaries with {max_workers} workers")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # The downloads that have been started but not yet handed back, in the
+        # order they were started.
+        in_flight = deque()
+
+        for pkgID in pkg_ids:
+            # Start downloading the summary.
+            in_flight.append((pkgID, executor.submit(get_package_summary,
+                                                     pkgID, stale_before)))
+
+            # Keep enough work queued that the workers never sit idle, but
+            # don't read further ahead than that so memory stays bounded.
+            if len(in_flight) >= max_workers * 2:
+                yield _collect_summary(*in_flight.popleft())
+
+        # Hand back whatever is still left.
+        while in_flight:
+            yield _collect_summary(*in_flight.popleft())
@@ -1,136 +1,482 @@
-# TODO: Make system arguments that can be entered for what kind of documents
-#       to pull. E.g. BILLS, BUDGET, etc.
-# TODO: Make an if or case array when system args are implemented to allow for
-#       each different type.
+# The collections to sync can be given as system arguments, e.g.
+# `python run.py BILLS CREC`. Otherwise the sync_collections list in the config
+# is used, which defaults to just BILLS. See interfaces/collection_registry.py
+# for the collections that are supported.
 
 import json
-from datetime import datetime, timedelta
+import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from threading import Lock
 
 from interfaces.api_interface import *
-from interfaces.sql_interface import *
+from interfaces.archive_interface import *
+from interfaces.checkpoint_interface import *
+from interfaces.collection_registry import *
+from interfaces.download_interface import download_packages
+from interfaces.logging_interface import *
+from interfaces.metrics_interface import *
+from interfaces.storage_interface import *
 from requests import *
 
-# from sql_interface import *
+# Create the logger for the program.
+logger = logging.getLogger("run")
 
 # Set the time format. This is according to ISO8601 (yyyy-MM-dd'T'HH:mm:ss'Z').
 time_format = "%Y-%m-%dT%H:%M:%SZ"
 
-# Placeholder "sys.arg" that will be fully instantiated later.
-# TODO: Build this so it's real not just a variable.
-doc_type = "BILLS"
+# The progress every collection starts with before its first run.
+progress_template = {"last_pulled":"0001-01-01T00:00:01Z", "num_entries":0}
+
+# Guards the config so the collections can record their progress from
+# different threads.
+config_lock = Lock()
+
+
+def load_config() -> dict:
+    """
+    Read configs/config.json, creating the folder if it doesn't exist. Configs
+    from before each collection had its own progress have their progress moved
+    under collections/BILLS.
+    """
+    # Create a config variable to store the values pulled from the file.
+    config = {}
+
+    # Try to open the config file.
+    try:
+        with open("configs/config.json", 'rt') as config_file:
+            config = json.load(config_file)
+
+    # If the file doesn't exist for whatever reason.
+    except FileNotFoundError as error:
+        # Check if the configs/ folder exists.
+        if not os.path.isdir("configs/"):
+            # If it doesn't, create it.
+            os.mkdir("configs/")
+
+    # Move the old top level progress under BILLS, the only collection there
+    # used to be.
+    if "collections" not in config:
+        bills = dict(progress_template)
+        for key in ("last_pulled", "num_entries", "last_modified"):
+            if key in config:
+                bills[key] = config.pop(key)
+        config["collections"] = {"BILLS": bills}
+
+    return config
+
+
+def save_config(config: dict):
+    """
+    Write the config back to configs/config.json.\n
+    config  = The whole config.
+    """
+    with config_lock:
+        with open("configs/config.json", 'wt') as config_file:
+            json.dump(config, config_file, indent=4)
+
+
+def get_package_count(doc_type: str) -> int:
+    """
+    Get the number of packages the API says are in a collection, from the
+    list of collections saved at the start of the run.\n
+    doc_type    = The collectionCode. E.g. BILLS
+    """
+    # Find the specific collection that the user is searching for.
+    with open(f"{save_location}collections.json", 'rb') as collection:
+        collections = collection.read()
+
+    for item in json.loads(collections).get('collections'):
+        if item.get('collectionCode') == doc_type:
+            return item.get('packageCount')
+
+    return 0
+
+
+def run_collection(doc_type: str, config: dict, run_start: str) -> list:
+    """
+    Run the whole enumerate, fetch and insert pipeline for one collection and
+    record its progress in the config. Returns the packageId's that could not
+    be pulled.\n
+    doc_type    = The collectionCode. E.g. BILLS\n
+    config      = The whole config.\n
+    run_start   = The time the program started.
+    """
+    # Find the table and the loader for the collection.
+    entry = get_registered(doc_type)
+    table = entry["table"]
+
+    # Get the progress of the collection, starting it fresh if it's new.
+    with config_lock:
+        progress = config["collections"].setdefault(doc_type,
+                                                    dict(progress_template))
+
+    # Start from the number of entries recorded by the last run so it isn't
+    # lost if the collection isn't repulled.
+    current_entries = progress.get("num_entries", 0)
+
+    # Get the time, in UTC like the API, that will become the high-water mark
+    # if the run doesn't see anything newer.
+    run_start_utc = datetime.utcnow().strftime(time_format)
+
+    # Find out how much time has elapsed since the last run.
+    tdelta = (datetime.strptime(run_start, time_format)-
+              datetime.strptime(progress.get("last_pulled"), time_format))
+
+    # Open the checkpoint journal that records the progress of the run. How
+    # many finished packages to hold before writing them to the journal
+    # defaults to 1000 if the config doesn't say otherwise.
+    checkpoint = Checkpoint(f"configs/{doc_type}_checkpoint.db",
+                            config.get("checkpoint_every", 1000))
+
+    # If the last run didn't finish, carry on with it instead of starting over.
+    run_state = checkpoint.get_cursor("run")
+
+    if run_state:
+        logger.info(f"{doc_type}: Resuming the run that started "+
+                    f"{run_state.get('run_start')}.")
+        incremental = run_state.get("incremental")
+        high_water = run_state.get("high_water")
+
+    # Otherwise start a new run.
+    else:
+        # Once a high-water mark has been recorded, only fetch what changed
+        # since then unless the config asks for a full sync.
+        incremental = (config.get("sync_mode", "incremental") == "incremental"
+                       and progress.get("last_modified") is not None)
+
+        # The high-water mark that will be saved at the end of the run.
+        high_water = run_start_utc
+
+        # Record the run so it can be resumed.
+        checkpoint.save_cursor("run", {"run_start": run_start,
+                                       "incremental": incremental,
+                                       "high_water": high_water})
+
+    # Whether or not the enumeration already finished before the last run
+    # stopped.
+    enumerated = checkpoint.get_cursor("enumerated")
+
+    # The packageId's that will be pulled. Filled in below.
+    list_of_docs = None
+
+    # Get every package that was added or modified since the last run.
+    if incremental and not enumerated:
+        logger.info(f"{doc_type}: Syncing changes since "+
+                    f"{progress.get('last_modified')}.")
+
+        modified, high_water = get_modified_since(
+            doc_type, progress.get("last_modified"))
+
+        # Record the whole list at once along with the new high-water mark.
+        checkpoint.save_enumeration(modified, "enumerated", True)
+        checkpoint.save_cursor("run", {"run_start": run_start,
+                                       "incremental": incremental,
+                                       "high_water": high_water})
+
+    # Pull the most recent count of the collection if one or more days have
+    # elapsed since the last run, or if the last run stopped partway through
+    # the crawl.
+    elif not incremental and not enumerated and (tdelta.days >= 1 or
+                                                 run_state):
+        # Log the age in days.
+        logger.info(f"{doc_type}: Collection is {tdelta.days} days old. "+
+                    "Repulling.")
+
+        # Compute the number of documents that have been created since the
+        # last pull.
+        current_entries = get_package_count(doc_type)
+        entries_to_get = current_entries - progress.get("num_entries")
+        logger.info(f"{doc_type}: There are {entries_to_get} new entries.")
+
+        # Anything left over in the journal from the last attempt.
+        leftover = checkpoint.get_remaining()
+
+        def crawl():
+            """
+            Stream the document ID's of the specified type as the crawl finds
+            them, recording each batch and where the crawl is up to as it goes.
+            """
+            yield from leftover
+            yield from iter_list_of_type(
+                doc_type, entries_to_get,
+                resume=checkpoint.get_cursor("enumeration"),
+                on_batch=lambda items, cursor: checkpoint.save_enumeration(
+                    items, "enumeration", cursor))
+            checkpoint.save_cursor("enumerated", True)
+
+        # The crawl feeds straight into the rest of the pipeline so the first
+        # summaries are being pulled while later pages are still loading.
+        list_of_docs = crawl()
+
+    # Otherwise get everything that was enumerated, this run or the last, minus
+    # whatever was already finished.
+    if list_of_docs is None:
+        list_of_docs = checkpoint.get_remaining()
+
+    # A temporary list for any documents that aren't pullable for whatever
+    # reason.
+    list_of_unpullable = []
+
+    # The number of summaries to gather before writing them to the database in
+    # one batch. Defaults to 500 if the config doesn't say otherwise.
+    batch_size = config.get("batch_size", 500)
+
+    # The summaries that have been pulled but not yet written to the database,
+    # and their packageId's so they can be checkpointed once they are.
+    pending_summaries = []
+    pending_ids = []
+
+    # The formats to download each pulled package in, if the config asks for
+    # any, e.g. ["pdf", "xml"], and the packages pulled so far.
+    download_formats = config.get("download_formats", [])
+    list_of_pulled = []
+
+    # The first load of a whole collection can be staged in files and loaded
+    # all at once with LOAD DATA instead, if the config asks for it. Nothing is
+    # in the table until the end, so nothing is checkpointed until then.
+    loader = None
+    staged_ids = []
+    # Only MySQL can bulk load.
+    if (not incremental and config.get("load_mode", "batch") == "bulk" and
+            get_backend().name == "mysql"):
+        logger.info(f"{doc_type}: Staging the rows for a bulk load.")
+        loader = bulk_loader(doc_type)
+
+    # Check to see what values from the list are currently in the database so
+    # as to not end up performing double duty, a chunk at a time as they come
+    # in. Each item is also checked on its own as a backup in case the check
+    # missed some. An incremental sync fetches everything and upserts it
+    # instead.
+    if incremental:
+        items_to_fetch = list_of_docs
+        write_batch = upsert_batch
+
+        # Every package on the list changed after the last high-water mark,
+        # so a cached summary from before then is revalidated with the server.
+        # Ones cached since, e.g. by an attempt at this run that stopped, are
+        # used as they are.
+        stale_before = datetime.strptime(
+            progress.get("last_modified"), time_format).replace(
+            tzinfo=timezone.utc).timestamp()
+    else:
+        backend = get_backend()
+        items_to_fetch = (item for item in backend.iter_missing(list_of_docs,
+                                                                table,
+                                                                batch_size)
+                          if not backend.exists(item, table))
+        write_batch = insert_batch
+        stale_before = None
+
+    # Download the summaries concurrently. They come back in the same order as
+    # list_of_docs. The number downloaded at the same time defaults to 8 if
+    # the config doesn't say otherwise.
+    for item, summary, error in fetch_summaries(
+            items_to_fetch, config.get("fetch_workers", 8), stale_before):
+        # Some documents could not be pulled due to internal server error. This
+        # is here to catch those problems and report them.
+        if error:
+            logger.critical(f"{item} could not be pulled. {error}")
+            list_of_unpullable.append(item)
+            continue
+
+        pending_summaries.append(summary)
+        pending_ids.append(item)
+        if download_formats:
+            list_of_pulled.append(item)
+
+        # Keep the raw summary, if the config asks for it.
+        archive_summary(doc_type, item, summary)
+
+        # Once enough summaries have been gathered, write them all at once and
+        # record that they're done, or stage them for the bulk load.
+        if len(pending_summaries) >= batch_size:
+            if loader:
+                loader.add(pending_summaries)
+                staged_ids.extend(pending_ids)
+            else:
+                write_batch(doc_type, pending_summaries, batch_size)
+                checkpoint.mark_done(pending_ids)
+            pending_summaries = []
+            pending_ids = []
+
+    # Write whatever is left over.
+    if loader:
+        loader.add(pending_summaries)
+        staged_ids.extend(pending_ids)
+
+        # Only load if anything was staged. Otherwise just clean up the files.
+        if staged_ids:
+            loader.load()
+            get_backend().remember(table, staged_ids)
+            checkpoint.mark_done(staged_ids)
+        else:
+            loader.discard()
+    elif pending_summaries:
+        write_batch(doc_type, pending_summaries, batch_size)
+        checkpoint.mark_done(pending_ids)
+
+    # Update both the last_pulled and the num_entries fields of the
+    # collection, and move the high-water mark forward so the next run only
+    # syncs what changed. If anything couldn't be pulled, keep the old mark so
+    # it's tried again.
+    with config_lock:
+        progress.update({"last_pulled":run_start})
+        progress.update({"num_entries":current_entries})
+        if not list_of_unpullable:
+            progress.update({"last_modified":high_water})
+
+    # Write the changes to the config file.
+    save_config(config)
+
+    # Write the list of unpullable documents to a file.
+    with open(f"{save_location}{doc_type}_unpullable.txt", 'wt') as unpullable:
+        for item in list_of_unpullable:
+            unpullable.write(f"{item}\n")
+
+    # The run finished, so the next one starts fresh.
+    checkpoint.clear()
+    checkpoint.close()
+
+    # Download the packages that were pulled in each of the formats. This is
+    # done after the progress is saved so a failure here can't lose the sync.
+    # Each file is streamed to a .part file that is resumed if it's cut short,
+    # and skipped if it's already complete. The number downloaded at the same
+    # time defaults to 4 if the config doesn't say otherwise.
+    if list_of_pulled:
+        undownloaded = download_packages(
+            [(item, content_type) for item in list_of_pulled
+             for content_type in download_formats],
+            config.get("download_workers", 4))
+
+        # Write the list of files that couldn't be downloaded to a file.
+        with open(f"{save_location}{doc_type}_undownloaded.txt",
+                  'wt') as undownloaded_file:
+            for item, content_type in undownloaded:
+                undownloaded_file.write(f"{item}.{content_type}\n")
+
+    logger.info(f"{doc_type}: Done, {len(list_of_unpullable)} unpullable.")
+
+    return list_of_unpullable
 
-# An initialized base value for current_entries. Used to see how many need to be
-# pulled.
-current_entries = 0
 
 # Get the time that the program starts.
 run_start = datetime.now().strftime(time_format)
 
-# Create a config variable to store the values pulled from the file.
-config = {}
+# Read the config.
+config_exists = os.path.isfile("configs/config.json")
+config = load_config()
 
-# Try to open the config file.
-try:
-    with open("configs/config.json", 'rt') as config_file:
-        config = json.load(config_file)
+# Start logging. The records are written to a rotating file on a background
+# thread. Everything is logged at INFO and as plain text unless the config says
+# otherwise.
+setup_logging(config.get("log_file", "Bill_The.log"),
+              config.get("log_level", "INFO"), config.get("log_levels"),
+              config.get("log_max_mb", 10), config.get("log_backups", 5),
+              config.get("log_format", "text") == "json")
 
-# If the file doesn't exist for whatever reason.
-except FileNotFoundError as error:
-    # Check if the configs/ folder exists.
-    if not os.path.isdir("configs/"):
-        # If it doesn't, create it.
-        os.mkdir("configs/")
-
-    # Log that the config file does not exist.
+# Log that the config file did not exist.
+if not config_exists:
     logger.info("config.json does not exist. Creating.")
-    
-    # Create an empty set for the data.
-    data = {}
 
-    # Insert the appropriate template data.
-    data.update({"last_pulled":"0001-01-01T00:00:01Z"})
-    data.update({"num_entries":0})
+# Work out which collections to sync.
+doc_types = sys.argv[1:] or config.get("sync_collections", ["BILLS"])
+
+# Make sure every collection is known before anything starts.
+for doc_type in doc_types:
+    get_registered(doc_type)
+
+# Open the database. It is shared by every collection. Defaults to MySQL with a
+# pool of 5 connections if the config doesn't say otherwise. The SQLite backend
+# needs no server and keeps everything in one file.
+if config.get("backend", "mysql") == "sqlite":
+    set_backend("sqlite", path=config.get("sqlite_path",
+                                          f"{save_location}billme.db"))
+else:
+    set_backend("mysql", pool_size=config.get("pool_size", 5))
+
+# Keep an index of the packageId's in each table on disk so most existence
+# checks never reach the database. On unless the config turns it off.
+if config.get("membership_index", True):
+    get_backend().use_index(f"{save_location}index/",
+                            config.get("index_error_rate", 0.001))
 
-    # Write it to the config.json file.
-    with open("configs/config.json", 'w') as config_file:
-        json.dump(data, config_file, indent=4)
+# Set the timeout for requests to the API. Defaults to 30 seconds if the config
+# doesn't say otherwise.
+set_timeout(config.get("request_timeout", 30))
 
-    # Use the templated data for the rest of the program.
-    config = data
+# Set the rate limit for the API. It is shared by every collection. Defaults to
+# 10 requests per second with bursts of 20 if the config doesn't say otherwise.
+set_rate_limit(config.get("requests_per_second", 10),
+               config.get("request_burst", 20))
 
-# Find out how much time has elapsed since the last run.
-tdelta = (datetime.strptime(run_start, time_format)-
-          datetime.strptime(config.get("last_pulled"), time_format))
+# Cache the responses from the API so a crashed or repeated run can replay
+# them. Defaults to 512MB if the config doesn't say otherwise.
+enable_cache(config.get("cache_max_mb", 512), config.get("cache_ttls"))
 
-# Placeholder for a list of documents.
-list_of_docs = []
+# Keep the raw summaries in compressed archives, compacted every 10 minutes, if
+# the config asks for it.
+if config.get("archive_summaries", False):
+    enable_archive(max_segment_mb=config.get("archive_segment_mb", 64))
+    start_compactor(config.get("archive_compact_interval", 600))
 
-# Pull the most recent list of collections if one or more days have elapsed
-# since the last run.
-if tdelta.days >= 1:
+# Log a summary of the metrics and write them for Prometheus every minute,
+# unless the config says otherwise.
+metrics_file = config.get("metrics_file", f"{save_location}metrics.prom")
+start_reporter(logger, config.get("metrics_interval", 60), metrics_file)
+
+# Pull the most recent list of collections if there isn't one yet or one or
+# more days have elapsed since it was saved.
+collections_path = f"{save_location}collections.json"
+if os.path.isfile(collections_path):
+    tdelta = (datetime.strptime(run_start, time_format)-
+              datetime.fromtimestamp(os.path.getmtime(collections_path)))
+else:
+    tdelta = None
+
+if tdelta is None or tdelta.days >= 1:
     # Log the age in days.
-    logger.info(f"Collection is {tdelta.days} days old. Repulling.")
+    if tdelta is not None:
+        logger.info(f"The list of collections is {tdelta.days} days old. "+
+                    "Repulling.")
 
     # Pull the most recent list of collections and save it.
     save_to_json(get_collections(), "collections")
 
-    # Find the specific collection that the user is searching for.
-    with open(f"{save_location}collections.json", 'rb') as collection:
-            collections = collection.read()
+# Run the collections in parallel. The number run at once defaults to all of
+# them if the config doesn't say otherwise.
+with ThreadPoolExecutor(max_workers=config.get("collection_workers",
+                                               len(doc_types))) as executor:
+    results = {doc_type: executor.submit(run_collection, doc_type, config,
+                                         run_start)
+               for doc_type in doc_types}
 
-    for item in json.loads(collections).get('collections'):
-        if item.get('collectionCode') == doc_type:
-            current_entries = item.get('packageCount')
-            break
-
-    # Compute the number of documents that have been created since the last
-    # pull.
-    entries_to_get = current_entries - config.get("num_entries")
-    logger.info(f"There are {entries_to_get} new entries.")
-
-    # Get all of the document ID's of the specified type.
-    list_of_docs = get_list_of_type(doc_type, False, entries_to_get)
-
-# Check to see what values from the list are currently in the database so as to
-# not end up performing double duty and inform the log.
-logger.info("Comparing lists to see what's needed. Currently " + 
-            f"{len(list_of_docs)} long.")
-check_all(list_of_docs, doc_type)
-logger.info(f"Done comparing. New amount {len(list_of_docs)}")
-
-# A temporary list for any documents that aren't pullable for whatever reason.
-list_of_unpullable = []
-
-# Iterate over each item added to the list.
-for item in list_of_docs:
-    # Check to see if the current item exists in the database.
-    # Kept in even after the check_all() call as a backup in case the check
-    # missed some.
-    if not check_if_exists(item):
-        # If it does not, try to insert it.
-        try:
-            insert_bill_values(get_package_summary(item))
-            # Some documents could not be pulled due to internal server error.
-            # This is here to catch those problems and report them.
-        except HTTPError as error:
-            logger.critical(f"{item} returned an HTTPError. {error}")
-            list_of_unpullable.append(item)
+# Report any collection that failed.
+for doc_type, future in results.items():
+    if future.exception():
+        logger.critical(f"{doc_type} failed. {future.exception()}")
 
-# Update both the last_pulled and the num_entries fields in the config.
-config.update({"last_pulled":run_start})
-config.update({"num_entries":current_entries})
+# Inform the logger how the API held up.
+logger.info(f"Request stats: {get_request_stats()}")
+logger.info(f"Cache stats: {get_cache_stats()}")
 
-# Write the changes to the config file.
-with open("configs/config.json", 'wt') as config_file:
-    config_file = json.dump(config, config_file, indent=4)
+# Record the final metrics.
+stop_reporter(logger, metrics_file)
 
-# Write the list of unpullable documents to a file.
-with open("content/unpullable.txt", 'wt') as unpullable:
-    for item in list_of_unpullable:
-        unpullable.write(f"{item}\n")
+# Finish with the archives.
+stop_compactor()
+close_archives()
+
+# Close all of the connections to the database and the API.
+get_backend().close()
+close_sessions()
 
 # Set the end date so it's easy to see how long the program ran.
 run_end = datetime.now().strftime(time_format)
 
 # Output the start and end times to the logger.
 logger.info(f"Run complete. Started {run_start} and ended {run_end}.")
+
+# Write out whatever is still waiting to be logged.
+shutdown_logging()
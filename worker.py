@@ -0,0 +1,214 @@
+# Spreads one large backfill over several processes, on one machine or many,
+# through a work queue table in the database.
+#
+#   python worker.py enqueue BILLS  Enumerates the collection and queues every
+#                                   package that isn't in the database yet.
+#   python worker.py work BILLS     Claims batches from the queue, pulls their
+#                                   summaries and writes them until the queue
+#                                   is empty. Run as many of these as needed.
+#
+# The workers read configs/config.json like run.py and must all point at the
+# same database. Each one has its own rate limit, so split requests_per_second
+# between them to stay under the API's limit. Each process logs to its own
+# file. Setting api_base in the config points the workers at another server,
+# such as the stand-in in benchmarks/fake_govinfo.py.
+
+import json
+import logging
+import os
+import socket
+import sys
+import time
+
+import interfaces.api_interface as api_interface
+from interfaces.api_interface import *
+from interfaces.collection_registry import *
+from interfaces.logging_interface import *
+from interfaces.metrics_interface import *
+from interfaces.storage_interface import *
+from requests import *
+
+# Create the logger for the program.
+logger = logging.getLogger("worker")
+
+
+def get_package_count(doc_type: str) -> int:
+    """
+    Get the number of packages the API says are in a collection.\n
+    doc_type    = The collectionCode. E.g. BILLS
+    """
+    for item in json.loads(get_collections()).get('collections'):
+        if item.get('collectionCode') == doc_type:
+            return item.get('packageCount')
+
+    return 0
+
+
+def enqueue_collection(doc_type: str, config: dict) -> int:
+    """
+    Enumerate a whole collection and add every package that isn't in the
+    database yet to the work queue. Returns the number of packages added.\n
+    doc_type    = The collectionCode. E.g. BILLS\n
+    config      = The whole config.
+    """
+    table = get_registered(doc_type)["table"]
+    backend = get_backend()
+    queue_chunk = config.get("queue_chunk_size", 1000)
+
+    # The enumeration is checked against the database as it streams in.
+    missing = backend.iter_missing(
+        iter_list_of_type(doc_type, get_package_count(doc_type),
+                          config.get("fetch_workers", 8)),
+        table, config.get("batch_size", 500))
+
+    queued = 0
+    chunk = []
+
+    for item in missing:
+        chunk.append(item)
+
+        if len(chunk) >= queue_chunk:
+            queued = queued + backend.enqueue(doc_type, chunk)
+            chunk = []
+
+    if chunk:
+        queued = queued + backend.enqueue(doc_type, chunk)
+
+    logger.info(f"{doc_type}: Queued {queued} packages. "+
+                f"{backend.queue_counts(doc_type)}")
+
+    return queued
+
+
+def work(doc_type: str, config: dict, worker: str) -> dict:
+    """
+    Claim batches of a collection from the work queue, pull their summaries
+    and write them, until nothing is pending and no other worker holds a
+    lease that could run out. Returns what the worker got through.\n
+    doc_type    = The collectionCode. E.g. BILLS\n
+    config      = The whole config.\n
+    worker      = The name of this worker.
+    """
+    backend = get_backend()
+    claim_size = config.get("queue_batch_size", 100)
+    lease_seconds = config.get("queue_lease_seconds", 600)
+    max_attempts = config.get("queue_max_attempts", 5)
+    poll_seconds = config.get("queue_poll_seconds", 5)
+
+    stats = {"claimed": 0, "written": 0, "failed": 0}
+
+    while True:
+        batch = backend.claim(doc_type, worker, claim_size, lease_seconds,
+                              max_attempts)
+
+        # With nothing to claim, stop once no other worker is holding
+        # anything. Otherwise wait in case one of their leases runs out.
+        if not batch:
+            if not backend.queue_counts(doc_type, max_attempts)["leased"]:
+                break
+            time.sleep(poll_seconds)
+            continue
+
+        stats["claimed"] = stats["claimed"] + len(batch)
+        count("queue_claimed", len(batch), collection=doc_type)
+
+        summaries = []
+        done = []
+        failed = []
+
+        try:
+            for item, summary, error in fetch_summaries(
+                    batch, config.get("fetch_workers", 8)):
+                if error:
+                    logger.critical(f"{item} could not be pulled. {error}")
+                    failed.append(item)
+                    continue
+
+                summaries.append(summary)
+                done.append(item)
+
+            if summaries:
+                insert_batch(doc_type, summaries, config.get("batch_size", 500))
+
+        # If the worker is stopped or something breaks, hand the batch back
+        # so another worker can take it without waiting out the lease.
+        except BaseException:
+            backend.finish(doc_type, batch, worker, backend.queue_pending)
+            raise
+
+        backend.finish(doc_type, done, worker, backend.queue_done)
+        backend.finish(doc_type, failed, worker, backend.queue_failed)
+
+        stats["written"] = stats["written"] + len(done)
+        stats["failed"] = stats["failed"] + len(failed)
+        count("queue_finished", len(done), collection=doc_type, result="done")
+        count("queue_finished", len(failed), collection=doc_type,
+              result="failed")
+
+    logger.info(f"{doc_type}: {worker} finished. {stats} "+
+                f"{backend.queue_counts(doc_type, max_attempts)}")
+
+    return stats
+
+
+# Read the config, if there is one.
+config = {}
+if os.path.isfile("configs/config.json"):
+    with open("configs/config.json", 'rt') as config_file:
+        config = json.load(config_file)
+
+# Work out what to do and to which collections.
+if len(sys.argv) < 2 or sys.argv[1] not in ("enqueue", "work"):
+    sys.exit("Usage: python worker.py enqueue|work [COLLECTION ...]")
+mode = sys.argv[1]
+doc_types = sys.argv[2:] or config.get("sync_collections", ["BILLS"])
+
+# The name the worker's leases are held under.
+worker_name = f"{socket.gethostname()}-{os.getpid()}"
+
+# Log to a file of this process's own.
+setup_logging(f"Bill_The_{mode}-{os.getpid()}.log",
+              config.get("log_level", "INFO"), config.get("log_levels"),
+              config.get("log_max_mb", 10), 0,
+              config.get("log_format", "text") == "json")
+
+# Make sure every collection is known before anything starts.
+for doc_type in doc_types:
+    get_registered(doc_type)
+
+# Open the same database as run.py.
+if config.get("backend", "mysql") == "sqlite":
+    set_backend("sqlite", path=config.get("sqlite_path",
+                                          f"{save_location}billme.db"))
+else:
+    set_backend("mysql", pool_size=config.get("pool_size", 5))
+
+# Only the enqueuer checks what's already in the database, so only it keeps a
+# membership index. Workers writing at the same time would each save one that
+# is missing the others' packages.
+if mode == "enqueue" and config.get("membership_index", True):
+    get_backend().use_index(f"{save_location}index/",
+                            config.get("index_error_rate", 0.001))
+
+# Set up the API the same way run.py does.
+api_interface.site_base = config.get("api_base", api_interface.site_base)
+set_timeout(config.get("request_timeout", 30))
+set_rate_limit(config.get("requests_per_second", 10),
+               config.get("request_burst", 20))
+
+for doc_type in doc_types:
+    if mode == "enqueue":
+        enqueue_collection(doc_type, config)
+    else:
+        work(doc_type, config, worker_name)
+
+# Inform the logger how the API held up.
+logger.info(f"Request stats: {get_request_stats()}")
+logger.info(f"Metrics:\n{format_summary()}")
+
+# Close all of the connections to the database and the API.
+get_backend().close()
+close_sessions()
+
+# Write out whatever is still waiting to be logged.
+shutdown_logging()